@@ -16,22 +16,49 @@ Use python's 'help' function to get information about each of them.
 - classes and their methods: 
     Domain:    copy, display
     Multigoal: copy, display
-    State:     copy, display
+    State:     copy, display, diff, apply_delta
+    PersistentState (a subclass of State)
+    CompactState (a subclass of State)
+    ClosedSet: seen, stats
+    NogoodCache: clear, stats
+    Budget: cancel
+    BudgetExhausted
+    PortfolioStats: ranking, stats
+    SearchStats: clear, stats
+    Tracer, VerboseTracer
+    TraceRecorder: close
+    PathProfiler: clear, stats, folded
+    StateDelta: invert, display
 
 - functions:
+    copy_on_write
     current_domain, set_current_domain, domains, remove_domain
     declare_actions
     declare_commands
     declare_goal_methods
     declare_multigoal_methods
+    declare_state_schema
     declare_task_methods
+    delta_frontier
+    encode_state, decode_state
+    find_cheapest_plan
     find_plan
+    find_plan_async, find_plan_GBFS_async, find_plan_a_star_async
+    find_plan_best_first, find_plan_best_first_async
+    find_plan_bnb
+    find_plan_parallel
+    find_plan_portfolio
+    find_plans_batch
     get_type
+    iter_improving_plans
+    iter_plans
     m_split_goals
     print_actions
     print_commands
     print_methods
+    portfolio_stats
     run_lazy_lookahead
+    undo_trail
     verify_goals
 
 Accompanying this file are a README.md file that's an overview of Pyhop 2,
@@ -51,7 +78,9 @@ import blocks_goal_splitting
 # from IPython import embed
 # from IPython.terminal.debugger import set_trace
 
-import copy, sys, pprint
+import copy, sys, pprint, random, time, json
+import array, pickle, struct
+import collections.abc
 
 ################################################################################
 # States and goals
@@ -102,7 +131,7 @@ class State():
         
     def __repr__(self):
         """Return a string that can be used to reconstruct the state"""
-        x = f"State('{self.__name__}', "
+        x = f"{type(self).__name__}('{self.__name__}', "
         x += ', '.join([f'{v}={vars(self)[v]}' for v in vars(self) if v != '__name__'])
         x += ')'
         return x
@@ -113,13 +142,32 @@ class State():
         x += ')'
         return x
 
+    def fingerprint(self):
+        """
+        Return a 64-bit hash of the state's state-variable bindings. States
+        with the same bindings have the same fingerprint, regardless of their
+        names. In copy-on-write mode (see copy_on_write), a copy of a state
+        keeps the hash of each dict-valued state variable up to date as
+        actions write to it, so fingerprint takes time proportional to the
+        number of state variables, rather than to the size of the state.
+        fingerprint doesn't modify the state.
+        """
+        x = 0
+        for (varname,val) in vars(self).items():
+            if varname != '__name__':
+                x ^= hash((varname, _var_zobrist_hash(val))) & _HASH_MASK
+        return x
+
     def copy(self,name=None):
         """
         Make a copy of the state. If name is given, then give the copy that name.
         Otherwise give it a name of the form '_state#' where # is an integer.
+        If copy_on_write() is True, the copy shares its state-variable dicts
+        and lists with self until one of the two states writes to them.
         """
         global _next_state_number
-        state = copy.deepcopy(self)
+        state = object.__new__(type(self))
+        vars(state).update(self._copy_vars())
         if name:
             state.__name__ = name
         else:
@@ -127,6 +175,12 @@ class State():
             _next_state_number += 1
         return state
 
+    def _copy_vars(self):
+        "Return a copy of vars(self), for use by State.copy"
+        if _copy_on_write:
+            return _share_vars(self)
+        return copy.deepcopy(vars(self))
+
     def display(self,heading=None):
         """
         Print the state's state-variables and their values. The arguments are:
@@ -134,6 +188,22 @@ class State():
         """
         _print_state(self,heading=heading)
 
+    def diff(self,other):
+        """
+        Return a StateDelta that says which state-variable bindings differ
+        between self and other. Applying it to a state equal to self (see
+        apply_delta) makes the state equal to other.
+        """
+        return _state_diff(self,other)
+
+    def apply_delta(self,delta):
+        """
+        Change the state's state-variable bindings in place as specified by
+        delta, which should be a StateDelta, and return the state.
+        """
+        _apply_delta(self,delta)
+        return self
+
 _next_multigoal_number = 0
 
 class Multigoal():
@@ -206,763 +276,4925 @@ class Multigoal():
         _print_state(self,heading=heading)
 
 
-def _print_state(state,heading=None):
+################################################################################
+# Copy-on-write state variables
+
+
+_copy_on_write = False
+
+
+def copy_on_write(boolean=None):
     """
-    Print the state-variables and values in 'state', which may be
-    either a state object or a goal object. The optional arguments are:
-    - heading, a heading to print beforehand.
+    If boolean is True, then State.copy will make copy-on-write copies rather
+    than deep copies. The copy and the original share each state variable
+    whose value is a dict or a list, and a state gets a private copy of such
+    a variable only when something writes to it through that state. Thus
+    an action that changes two or three of state.pos's entries clones only
+    state.pos, and leaves every other state variable shared. (A plain dict
+    or list that you put into a state isn't shared; the first copy gets its
+    own copy of it, and the state keeps the plain one.)
+
+    Action and method functions don't need to change: state.pos[b] = x
+    and state.stacks[i] += [b] both work as before. Since a state owns its
+    variables in this mode, don't keep a reference to one of them (e.g.,
+    d = state.pos) and modify it after copying the state.
+
+    If copy_on_write is called with no argument, it will return the current
+    value of boolean.
     """
-    if heading == None: heading = get_type(state)
-    if state != False:
-        title = f"{heading} {state.__name__}:"
-        dashes = '-'*len(title)
-        print(title)
-        print(dashes)
-        for (varname,val) in vars(state).items():
-            if varname != '__name__':
-                print(f"  - {varname} = {val}")
-        print('')
-    else: 
-        if heading == None: heading = 'state'
-        print('{heading} = False','\n')
+    global _copy_on_write
+    if boolean != None:
+        _copy_on_write = boolean
+    return _copy_on_write
+
+
+# Types whose values can be shared between states without ever being copied
+_atomic_types = {str, int, float, bool, complex, bytes, type(None), frozenset}
+
+
+def _is_immutable(val):
+    "Return True if val can't be modified in place"
+    t = type(val)
+    if t in _atomic_types:
+        return True
+    if t is tuple:
+        return all(_is_immutable(x) for x in val)
+    return False
+
+
+def _freeze(val):
+    "Return a hashable equivalent of val, by converting dicts, lists, and sets"
+    t = type(val)
+    if t in _atomic_types:
+        return val
+    if t is list or t is tuple or t is _CowList:
+        return tuple(_freeze(x) for x in val)
+    if isinstance(val, collections.abc.Mapping):
+        return frozenset((k,_freeze(v)) for (k,v) in val.items())
+    if t is set:
+        return frozenset(val)
+    return val
 
 
 ################################################################################
-# A class for holding planning-and-acting domains.
+# Zobrist hashing of states
+#
+# State.fingerprint returns a 64-bit hash of a state's bindings, for use in
+# duplicate detection. It uses Zobrist hashing: each (key,value) pair gets a
+# random 64-bit number, and the hash of a dict is the XOR of the numbers for
+# its items. A write to a dict changes its hash by XORing out the old item
+# and XORing in the new one, so after computing the hash once, we can keep it
+# up to date in O(1) time per write, regardless of the size of the state.
+#
+# The random numbers are kept in _zobrist_table, but only for pairs whose
+# value is atomic (a string, number, etc.). The number for a tuple or
+# frozenset is computed from the numbers for its elements. Otherwise the
+# table would get a new entry for every list, nested dict, or whole state
+# that any search ever hashed, and would keep growing for as long as the
+# program runs.
 
-class Domain():
-    """
-    d = Domain(domain_name,**kwargs) creates an object that is a container for
-    all the actions, commands, task_methods, goal_methods, multigoals, and
-    multigoal_methods associated with a planning-and-acting domain.
 
-    If domain_name is given and there is already a domain with that name,
-    the new one will replace it. If domain_name is omitted, the new domain
-    will be given a name of the form _domain#, where # is a number. In both
-    cases, the new domain will become the current domain.
+_zobrist_table = {}
+_zobrist_random = random.Random(0)
+
+# An odd 64-bit constant, for mixing the numbers for a tuple's elements
+_ZOBRIST_MULTIPLIER = 0x9e3779b97f4a7c15
+
+
+def _zobrist(key, val):
+    """
+    Return the random 64-bit number for (key,val), where val is immutable
+    (e.g., a value returned by _freeze).
     """
+    t = type(val)
+    if t is tuple:
+        # the order of the elements matters, so mix rather than XOR them
+        z = _zobrist((key, tuple), len(val))
+        for x in val:
+            z = ((z ^ _zobrist(key, x)) * _ZOBRIST_MULTIPLIER) & _HASH_MASK
+            z ^= z >> 29
+        return z
+    if t is frozenset:
+        z = _zobrist((key, frozenset), len(val))
+        for x in val:
+            z ^= _zobrist(key, x)
+        return z
+    item = (key, val)
+    z = _zobrist_table.get(item)
+    if z == None:
+        z = _zobrist_table[item] = _zobrist_random.getrandbits(64)
+    return z
+
+
+def _zobrist_items(items):
+    "Return the XOR of the Zobrist numbers for some (key,value) pairs"
+    zhash = 0
+    for (key,val) in items:
+        if not _is_immutable(val):
+            val = _freeze(val)
+        zhash ^= _zobrist(key, val)
+    return zhash
+
+
+def _var_zobrist_hash(val):
+    "Return the Zobrist hash of a state-variable value"
+    t = type(val)
+    if t is _CowDict:
+        return val._zobrist_hash()
+    if t is _PMapVar:
+        return val._map._zobrist_hash()
+    if t is dict:
+        return _zobrist_items(val.items())
+    if t is _CowList:
+        return _zobrist_items(enumerate(val._data))
+    if t is list:
+        return _zobrist_items(enumerate(val))
+    if isinstance(val, collections.abc.Mapping):
+        return _zobrist_items(val.items())
+    return _zobrist(None, _freeze(val))
+
+
+def history_key(state, tasks):
+    """
+    Return an integer key for the search node (state, tasks), for the
+    history of nodes that find_plan_GBFS and find_plan_a_star have
+    already generated. Like history_string, it identifies the node by its
+    state and the first item in tasks, but it uses state.fingerprint()
+    instead of a string representation of the entire state.
+    """
+    if tasks:
+        todo1 = tasks[0]
+        try:
+            return hash((state.fingerprint(), todo1)) & _HASH_MASK
+        except TypeError:
+            # todo1 contains a list, dict, or some other unhashable value
+            return hash((state.fingerprint(), _freeze(todo1))) & _HASH_MASK
+    return state.fingerprint()
 
-    def __init__(self,name=None):
-        """
-        If 'name' is given, then use it as the domain's name. Otherwise,
-        give it a name of the form '_domain#' where # is an integer.
-        """
-        global _next_domain_number
-        global _domain_dict, _current_domain
-        
-        if name:
-            self.__name__ = name
+
+class _CowDict(collections.abc.MutableMapping):
+    """
+    The value of a dict-valued state variable in copy-on-write mode. Several
+    states may share the same _data dict; a write through any of them first
+    gives that state its own copy. If some of the values are mutable
+    (_flat is False), we can't see writes made to them, so in that case
+    reads also make a private copy.
+
+    Once State.fingerprint has computed _zhash, the Zobrist hash of the
+    dict's items, each write updates it in O(1) time.
+    """
+    __slots__ = ('_data', '_shared', '_flat', '_zhash')
+
+    def __init__(self, data, shared=False, flat=None, zhash=None):
+        self._data = data
+        self._shared = shared
+        if flat == None:
+            flat = all(_is_immutable(x) for x in data.values())
+        self._flat = flat
+        self._zhash = zhash
+
+    def _share(self):
+        "Mark _data as shared, and return another _CowDict that shares it"
+        self._shared = True
+        return _CowDict(self._data, True, self._flat, self._zhash)
+
+    def _unshare(self):
+        if self._flat:
+            self._data = self._data.copy()
         else:
-            self.__name__ = f'_domain{_next_domain_number}'
-            _next_domain_number += 1
+            self._data = copy.deepcopy(self._data)
+        self._shared = False
+
+    def _read(self):
+        if self._shared and not self._flat:
+            self._unshare()
+        return self._data
+
+    def __getitem__(self, key):
+        if self._shared and not self._flat:
+            self._unshare()
+        return self._data[key]
+
+    def __setitem__(self, key, val):
+        if self._shared:
+            self._unshare()
+        if self._flat and not _is_immutable(val):
+            self._flat = False
+        if self._zhash != None:
+            old = self._data.get(key, _missing)
+            if old is not _missing:
+                self._zhash ^= _zobrist(key, old)
+            self._zhash = self._zhash ^ _zobrist(key, val) if self._flat else None
+        self._data[key] = val
+
+    def __delitem__(self, key):
+        if self._shared:
+            self._unshare()
+        if self._zhash != None and key in self._data:
+            self._zhash ^= _zobrist(key, self._data[key])
+        del self._data[key]
+
+    def _zobrist_hash(self):
+        if self._zhash != None:
+            return self._zhash
+        zhash = _zobrist_items(self._data.items())
+        if self._flat:
+            # if not, then in-place changes to the values would make it stale
+            self._zhash = zhash
+        return zhash
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._read().get(key, default)
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return self._read().values()
+
+    def items(self):
+        return self._read().items()
+
+    def copy(self):
+        return self._read().copy()
+
+    def __eq__(self, other):
+        if isinstance(other, _CowDict):
+            other = other._data
+        return self._data == other
 
-        _domain_dict.update({name:self})
-        _current_domain = self
-        
+    def __repr__(self):
+        return repr(self._data)
 
-        # dictionary that maps each action name to the corresponding function
-        self._action_dict = {}   
-        
-        # dictionary that maps each action name to the corresponding cost
-        self._action_cost_dict = {}    
-            
-        # dictionary that maps each command name to the corresponding function
-        self._command_dict = {}
-        
-        # dictionary that maps each task name to a list of methods for the task
-        self._task_method_dict = {'_verify_g': [_m_verify_g], '_verify_mg': [_m_verify_mg]}
-        
-        # dictionary that maps each goal name to a list of methods for the goal
-        self._goal_method_dict = {}
-        
-        # list of all methods for multigoals
-        self._multigoal_method_list = []
+    def __copy__(self):
+        return self._share()
 
-        _domain_dict.update({self.__name__:self})
+    def __deepcopy__(self, memo):
+        if self._flat:
+            return _CowDict(self._data.copy(), False, True, self._zhash)
+        return _CowDict(copy.deepcopy(self._data, memo), False, False)
 
 
-    def __str__(self):
-        return f"<Domain {self.__name__}>"
-        
-    def __repr__(self):
-        """Return a string that can be used to reconstruct the domain"""
-        x = f"Domain('{self.__name__}', "
-        x += ', '.join([f'{v}={vars(self)[v]}' for v in vars(self) if v != '__name__'])
-        x += ')'
-        return x
+class _CowList(collections.abc.MutableSequence):
+    """
+    The value of a list-valued state variable in copy-on-write mode.
+    It works the same way as _CowDict.
+    """
+    __slots__ = ('_data', '_shared', '_flat')
 
-    def copy(self,name=None):
-        """
-        Make a copy of the domain. If name is given, then give the copy that name.
-        Otherwise give it a name of the form '_domain#' where # is an integer.
-        """
-        global next_domain_number
-        dom = copy.deepcopy(self)
-        if name:
-            dom.__name__ = name
+    def __init__(self, data, shared=False, flat=None):
+        self._data = data
+        self._shared = shared
+        if flat == None:
+            flat = all(_is_immutable(x) for x in data)
+        self._flat = flat
+
+    _read = _CowDict._read
+
+    def _share(self):
+        "Mark _data as shared, and return another _CowList that shares it"
+        self._shared = True
+        return _CowList(self._data, True, self._flat)
+
+    def _unshare(self):
+        if self._flat:
+            self._data = self._data.copy()
         else:
-            dom.__name__ = f'_domain{next_domain_number}'
-            next_domain_number += 1
-        return dom
-        
+            self._data = copy.deepcopy(self._data)
+        self._shared = False
+
+    def __getitem__(self, i):
+        if self._shared and not self._flat:
+            self._unshare()
+        return self._data[i]
+
+    def __setitem__(self, i, val):
+        if self._shared:
+            self._unshare()
+        if self._flat:
+            if isinstance(i, slice):
+                val = list(val)
+                self._flat = all(_is_immutable(x) for x in val)
+            else:
+                self._flat = _is_immutable(val)
+        self._data[i] = val
 
-# If you call Domain() with no arguments, the new domain's name will be
-# _domain#, where # is the following number.
-_next_domain_number = 0
+    def __delitem__(self, i):
+        if self._shared:
+            self._unshare()
+        del self._data[i]
 
+    def insert(self, i, val):
+        self[i:i] = [val]
 
-# The set of all domains that have been created
-_domain_dict = {}
+    def append(self, val):
+        self.insert(len(self._data), val)
 
+    def extend(self, vals):
+        n = len(self._data)
+        self[n:n] = vals
 
-# A global variable telling the Pyhop 2 functions what domain we're using.
-# At the end of this file, we'll set it to a newly created domain.
-_current_domain = None
+    def __iadd__(self, vals):
+        self.extend(vals)
+        return self
 
+    def __add__(self, other):
+        if isinstance(other, _CowList):
+            other = other._data
+        return self._read() + other
 
-def current_domain():
-    "Return the name of the current domain."
-    return _current_domain.__name__
+    def __radd__(self, other):
+        return other + self._read()
 
+    def __mul__(self, n):
+        return self._read() * n
 
-def set_current_domain(domain_name):
+    __rmul__ = __mul__
+
+    def __imul__(self, n):
+        self[:] = self._read() * n
+        return self
+
+    def sort(self, *, key=None, reverse=False):
+        if self._shared:
+            self._unshare()
+        self._data.sort(key=key, reverse=reverse)
+
+    def __iter__(self):
+        return iter(self._read())
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, val):
+        return val in self._read()
+
+    def index(self, *args):
+        return self._read().index(*args)
+
+    def count(self, val):
+        return self._read().count(val)
+
+    def copy(self):
+        return self._read().copy()
+
+    def __eq__(self, other):
+        if isinstance(other, _CowList):
+            other = other._data
+        return self._data == other
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def __copy__(self):
+        return self._share()
+
+    def __deepcopy__(self, memo):
+        if self._flat:
+            return _CowList(self._data.copy(), False, True)
+        return _CowList(copy.deepcopy(self._data, memo), False, False)
+
+
+def _share_vars(state):
     """
-    domain_name should be the name of a domain that has been defined using
-    the Domain class. set_current_domain makes it the current domain.
+    Return a copy-on-write copy of vars(state). Writes to a plain dict or
+    list in state can't be seen, so it isn't shared: the copy gets a
+    _CowDict or _CowList with its own copy of the data, which later copies
+    can share. state itself isn't modified.
     """
-    global _current_domain
-    domain = _domain_dict.get(domain_name)
-    if domain == None:
-        raise Exception(f"There is no domain named {domain_name}")
-    _current_domain = _domain_dict[domain_name]
+    new_vars = {}
+    memo = {}
+    for (varname,val) in vars(state).items():
+        t = type(val)
+        if t is _CowDict or t is _CowList:
+            new_vars[varname] = val._share()
+        elif t is _PMapVar:
+            new_vars[varname] = _PMapVar(val._map)
+        elif t is dict:
+            new_vars[varname] = copy.deepcopy(_CowDict(val), memo)
+        elif t is list:
+            new_vars[varname] = copy.deepcopy(_CowList(val), memo)
+        elif _is_immutable(val):
+            new_vars[varname] = val
+        else:
+            new_vars[varname] = copy.deepcopy(val,memo)
+    return new_vars
 
 
-def domains():
-    "Return the set of all domain names."
-    return {name for name in _domain_dict}
+################################################################################
+# Persistent states
+#
+# A PersistentState stores each dict-valued state variable in a persistent
+# hash array mapped trie (HAMT). A trie node is never modified after it is
+# created: writing state.pos[b] = x creates new copies of the O(log n) nodes
+# on the path to b's entry, and shares every other node with the state that
+# the write was made in. Thus a successor state costs O(log n) memory rather
+# than O(n), and two states that descend from the same initial state can be
+# compared by skipping every subtrie that they share.
+#
+# A trie node is either a _HamtNode, whose bitmap says which of its 32 slots
+# are occupied, or a _HamtCollision that holds keys with identical hashes.
+# Each occupied slot holds either a node or a leaf, and a leaf is a tuple
+# (hash,key,value). At depth d, a key's slot is given by bits 5d to 5d+4 of
+# its hash. A subtrie exists only where two or more keys share a prefix, so
+# the shape of the trie depends only on the set of keys.
 
 
-def remove_domain(domain_name):
-    "Remove the domain named domain_name from the set of all domains."
-    if _current_domain == domain_name:
-        raise Exception(f"Can't remove {domain.__name__}, because it's the current domain")
-    else:
-        _domain_dict.pop(domain_name)
-    
+_HASH_MASK = (1 << 64) - 1
 
-################################################################################
-# Commands for distinguishing data types
+class _Missing():
+    __slots__ = ()
 
+    def __repr__(self):
+        return 'UNBOUND'
 
-def get_type(object):
-    "Return object's type name"
-    return type(object).__name__
+    def __copy__(self):
+        return self
 
+    def __deepcopy__(self, memo):
+        return self
 
-def _todo_to_string(todo):
-    ttype = get_type(todo)
-    if ttype == 'list':
-        return str([str(x) for x in todo])
-    elif ttype == 'tuple':
-        return str(tuple([str(x) for x in todo]))
-    else:
-        return str(todo)
+# A sentinel for missing keys, since None may be a value
+_missing = _Missing()
 
 
-################################################################################
-# Functions to declare actions, commands, tasks, goals, multigoals
+def _popcount(x):
+    return bin(x).count('1')
 
 
-def declare_actions(*actions):
+class _HamtNode():
+    __slots__ = ('bitmap', 'entries', 'hash')
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+        self.hash = None
+
+
+class _HamtCollision():
+    __slots__ = ('h', 'leaves', 'hash')
+
+    def __init__(self, h, leaves):
+        self.h = h
+        self.leaves = leaves
+        self.hash = None
+
+
+def _entry_hash_bits(entry):
+    "Return the 64-bit key hash of a leaf or a _HamtCollision"
+    return entry[0] if type(entry) is tuple else entry.h
+
+
+def _hamt_get(node, h, key):
+    shift = 0
+    while True:
+        if type(node) is _HamtCollision:
+            for leaf in node.leaves:
+                if leaf[1] == key:
+                    return leaf[2]
+            return _missing
+        bit = 1 << ((h >> shift) & 31)
+        if not node.bitmap & bit:
+            return _missing
+        entry = node.entries[_popcount(node.bitmap & (bit - 1))]
+        if type(entry) is tuple:
+            if entry[0] == h and entry[1] == key:
+                return entry[2]
+            return _missing
+        node = entry
+        shift += 5
+
+
+def _hamt_merge(shift, entry1, entry2):
     """
-    Each member of actions must be a function name (not a string).
-    declare_actions tells Pyhop 2 that each of them is an action. For
-    example, this tells Pyhop 2 that pickup and putdown are actions:
-        declare_actions(pickup,putdown)
-    
-    declare_actions can be called several times to declare more actions.
+    Return a subtrie containing entry1 and entry2, each of which is a leaf
+    or a _HamtCollision, and whose key hashes agree in their first 'shift' bits.
     """
-    if _current_domain == None:
-        raise Exception(f"cannot declare actions until a domain has been created.")
-    _current_domain._action_dict.update({act.__name__:act for act in actions})
-    for act in actions:
-        _current_domain._action_cost_dict.setdefault(act.__name__, 1)
-    return _current_domain._action_dict
+    h1 = _entry_hash_bits(entry1)
+    h2 = _entry_hash_bits(entry2)
+    if h1 == h2:
+        # two leaves whose keys have the same hash
+        return _HamtCollision(h1, (entry1, entry2))
+    b1 = (h1 >> shift) & 31
+    b2 = (h2 >> shift) & 31
+    if b1 == b2:
+        return _HamtNode(1 << b1, (_hamt_merge(shift+5, entry1, entry2),))
+    if b1 < b2:
+        return _HamtNode((1 << b1) | (1 << b2), (entry1, entry2))
+    return _HamtNode((1 << b1) | (1 << b2), (entry2, entry1))
+
+
+def _hamt_set(node, shift, leaf):
+    """
+    Return (newnode, added), where newnode is node with leaf in it, and added
+    is True if leaf's key wasn't already in node. If the key was already
+    bound to the same value, then newnode is node.
+    """
+    (h, key, val) = leaf
+    if type(node) is _HamtCollision:
+        leaves = list(node.leaves)
+        for (i,old) in enumerate(leaves):
+            if old[1] == key:
+                if old[2] is val:
+                    return (node, False)
+                leaves[i] = leaf
+                return (_HamtCollision(h, tuple(leaves)), False)
+        return (_HamtCollision(h, node.leaves + (leaf,)), True)
+    bit = 1 << ((h >> shift) & 31)
+    i = _popcount(node.bitmap & (bit - 1))
+    entries = node.entries
+    if not node.bitmap & bit:
+        return (_HamtNode(node.bitmap | bit, entries[:i] + (leaf,) + entries[i:]), True)
+    entry = entries[i]
+    if type(entry) is tuple:
+        if entry[0] == h and entry[1] == key:
+            if entry[2] is val:
+                return (node, False)
+            (new_entry, added) = (leaf, False)
+        else:
+            (new_entry, added) = (_hamt_merge(shift+5, entry, leaf), True)
+    elif type(entry) is _HamtCollision and entry.h != h:
+        (new_entry, added) = (_hamt_merge(shift+5, entry, leaf), True)
+    else:
+        (new_entry, added) = _hamt_set(entry, shift+5, leaf)
+        if new_entry is entry:
+            return (node, False)
+    return (_HamtNode(node.bitmap, entries[:i] + (new_entry,) + entries[i+1:]), added)
 
-def declare_actions_cost(*actions):
-    if _current_domain == None:
-        raise Exception(f"cannot declare actions until a domain has been created.")
-    _current_domain._action_cost_dict.update({act.__name__:cost for (act, cost) in actions})
-    return _current_domain._action_cost_dict
 
-def declare_commands(*commands):
+def _hamt_delete(node, shift, h, key):
     """
-    Each member of commands must be a function name (not a string), and the
-    name should have the form c_foo, where foo is the name of an action.
-    declare_commands tells Pyhop 2 that each of the functions is a command.
-    Example: the following tells Pyhop 2 that c_pickup and c_putdown are
-    commands:
-        declare_commands(c_pickup,c_putdown)
-    
-    declare_commands can be called several times to declare more commands.
+    Return node without key, or node itself if key isn't in it. If the result
+    would have just one leaf or _HamtCollision, return that instead, so that
+    the caller can put it in place of node.
     """
-    if _current_domain == None:
-        raise Exception(f"cannot declare commands until a domain has been created.")
-    _current_domain._command_dict.update({cmd.__name__:cmd for cmd in commands})
-    return _current_domain._command_dict
+    if type(node) is _HamtCollision:
+        if node.h != h:
+            return node
+        leaves = tuple(leaf for leaf in node.leaves if leaf[1] != key)
+        if len(leaves) == len(node.leaves):
+            return node
+        if len(leaves) == 1:
+            return leaves[0]
+        return _HamtCollision(h, leaves)
+    bit = 1 << ((h >> shift) & 31)
+    if not node.bitmap & bit:
+        return node
+    i = _popcount(node.bitmap & (bit - 1))
+    entry = node.entries[i]
+    if type(entry) is tuple:
+        if entry[0] != h or entry[1] != key:
+            return node
+        new_entry = None
+    else:
+        new_entry = _hamt_delete(entry, shift+5, h, key)
+        if new_entry is entry:
+            return node
+    if new_entry == None:
+        bitmap = node.bitmap & ~bit
+        entries = node.entries[:i] + node.entries[i+1:]
+    else:
+        bitmap = node.bitmap
+        entries = node.entries[:i] + (new_entry,) + node.entries[i+1:]
+    if len(entries) == 1 and type(entries[0]) is not _HamtNode:
+        return entries[0]
+    return _HamtNode(bitmap, entries)
+
+
+def _hamt_leaves(node):
+    if type(node) is _HamtCollision:
+        yield from node.leaves
+        return
+    for entry in node.entries:
+        if type(entry) is tuple:
+            yield entry
+        else:
+            yield from _hamt_leaves(entry)
 
 
-def declare_task_methods(task_name, *task_methods):
-    """
-    task_name must be a character string, and each member of task_methods must
-    be a function name (not a character string). declare_task_methods tells
-    Pyhop 2 that each of the functions is a task_method that is relevant for
-    every task of the form (task_name, arg1, ..., argn). Example:
-        declare_task_methods('travel', travel_by_car, travel_by_foot)
-    tells Pyhop that travel_by_car and travel_by_foot are methods and are 
-    relevant for tasks such as these:
-        ('travel', 'alice', 'store')
-        ('travel', 'alice', 'umd', 'ucla')
-        ('travel', 'alice', 'umd', 'ucla', 'slowly')
-        ('travel', 'bob', 'home', 'park', 'looking', 'at', 'birds')
+def _hamt_equal(node1, node2):
+    if node1 is node2:
+        return True
+    if type(node1) is not type(node2):
+        return False
+    if type(node1) is _HamtCollision:
+        return node1.h == node2.h and \
+            {leaf[1]:leaf[2] for leaf in node1.leaves} == \
+            {leaf[1]:leaf[2] for leaf in node2.leaves}
+    if node1.bitmap != node2.bitmap:
+        return False
+    for (e1,e2) in zip(node1.entries, node2.entries):
+        if e1 is e2:
+            continue
+        if type(e1) is tuple:
+            if type(e2) is not tuple or e1[0] != e2[0] or e1[1] != e2[1] \
+                    or e1[2] != e2[2]:
+                return False
+        elif not _hamt_equal(e1, e2):
+            return False
+    return True
+
+
+def _hamt_hash(node):
+    "Return a hash of node's contents. It is cached in the node."
+    if node.hash == None:
+        if type(node) is _HamtCollision:
+            node.hash = hash(frozenset((leaf[1],leaf[2]) for leaf in node.leaves))
+        else:
+            node.hash = hash((node.bitmap,) + tuple(
+                hash((e[1],e[2])) if type(e) is tuple else _hamt_hash(e)
+                for e in node.entries))
+    return node.hash
 
-    This is similar to the original Pyhop's declare_methods function,
-    except that declare_task_methods can be called several times to 
-    declare more methods for the same task.
+
+class _PMap():
     """
-    if _current_domain == None:
-        raise Exception(f"cannot declare methods until a domain has been created.")
-    if task_name in _current_domain._task_method_dict:
-        old_methods = _current_domain._task_method_dict[task_name]
-        # even though _current_domain._task_method_dict[task_name] is a list,
-        # we don't want to add any methods that are already in it
-        new_methods = [m for m in task_methods if m not in old_methods]
-        _current_domain._task_method_dict[task_name].extend(new_methods)
-    else:
-        _current_domain._task_method_dict.update({task_name:list(task_methods)})
-    return _current_domain._task_method_dict
+    An immutable map implemented as a HAMT. set and delete return a new
+    _PMap that shares all but O(log n) of its nodes with the old one.
+    Like a dict, it iterates over its keys in the order they were added.
+    The tuple of keys is shared too, unless set adds a key or delete
+    removes one.
+    """
+    __slots__ = ('_root', '_keys', '_zhash')
+
+    def __init__(self, root=None, keys=(), zhash=None):
+        self._root = _HamtNode(0, ()) if root == None else root
+        self._keys = keys
+        self._zhash = zhash
+
+    @staticmethod
+    def from_dict(d):
+        pmap = _PMap()
+        for (key,val) in d.items():
+            pmap = pmap.set(key,val)
+        return pmap
+
+    def get(self, key, default=None):
+        val = _hamt_get(self._root, hash(key) & _HASH_MASK, key)
+        return default if val is _missing else val
+
+    def set(self, key, val):
+        leaf = (hash(key) & _HASH_MASK, key, val)
+        zhash = self._zhash
+        if zhash != None:
+            old = _hamt_get(self._root, leaf[0], key)
+            if old is not _missing:
+                zhash ^= _zobrist(key, _freeze(old))
+            zhash ^= _zobrist(key, _freeze(val))
+        (root, added) = _hamt_set(self._root, 0, leaf)
+        if root is self._root:
+            return self
+        return _PMap(root, self._keys + (key,) if added else self._keys, zhash)
+
+    def delete(self, key):
+        h = hash(key) & _HASH_MASK
+        old = _hamt_get(self._root, h, key)
+        if old is _missing:
+            raise KeyError(key)
+        root = _hamt_delete(self._root, 0, h, key)
+        if type(root) is not _HamtNode:
+            # a lone leaf or collision node; the root must be a _HamtNode
+            root = _HamtNode(1 << (_entry_hash_bits(root) & 31), (root,))
+        zhash = self._zhash
+        if zhash != None:
+            zhash ^= _zobrist(key, _freeze(old))
+        return _PMap(root, tuple(k for k in self._keys if k != key), zhash)
+
+    def _zobrist_hash(self):
+        if self._zhash == None:
+            self._zhash = _zobrist_items(self.items())
+        return self._zhash
+
+    def items(self):
+        root = self._root
+        return ((k, _hamt_get(root, hash(k) & _HASH_MASK, k)) for k in self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __eq__(self, other):
+        if not isinstance(other, _PMap):
+            return NotImplemented
+        return len(self._keys) == len(other._keys) and \
+            _hamt_equal(self._root, other._root)
+
+    def __hash__(self):
+        return _hamt_hash(self._root)
+
+
+class _PMapVar(collections.abc.MutableMapping):
+    """
+    The value of a dict-valued state variable in a PersistentState. Writing
+    to it replaces its _PMap with an updated one, leaving the old _PMap
+    (which other states may share) unchanged.
+    """
+    __slots__ = ('_map',)
 
+    def __init__(self, pmap):
+        self._map = pmap
 
-def declare_goal_methods(goal_name, *goal_methods):
+    def __getitem__(self, key):
+        val = _hamt_get(self._map._root, hash(key) & _HASH_MASK, key)
+        if val is _missing:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val):
+        self._map = self._map.set(key, val)
+
+    def __delitem__(self, key):
+        self._map = self._map.delete(key)
+
+    def __iter__(self):
+        return iter(self._map._keys)
+
+    def __len__(self):
+        return len(self._map._keys)
+
+    def __contains__(self, key):
+        return _hamt_get(self._map._root, hash(key) & _HASH_MASK, key) \
+            is not _missing
+
+    def get(self, key, default=None):
+        return self._map.get(key, default)
+
+    def items(self):
+        return self._map.items()
+
+    def copy(self):
+        return dict(self._map.items())
+
+    def __eq__(self, other):
+        if isinstance(other, _PMapVar):
+            return self._map == other._map
+        if isinstance(other, collections.abc.Mapping):
+            return dict(self._map.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self._map.items()))
+
+    def __copy__(self):
+        return _PMapVar(self._map)
+
+    def __deepcopy__(self, memo):
+        return _PMapVar(self._map)
+
+
+def _persistent_value(val):
     """
-    goal_name must be a character string, and each member of goal_methods must
-    be a function name (not a character string). declare_goal_methods tells
-    Pyhop 2 that each of the functions is a goal_method that is relevant for
-    every goal of the form (goal_name, arg, value). Example:
-        declare_goal_method('loc',travel_by_car)
-    tells Pyhop that travel_by_car is relevant for goals such as these:
-        ('loc', 'alice', 'ucla')
-        ('loc', 'bob', 'home')
-    
-    declare_goal_methods can be called several times to declare more
-    methods for the same goal.
+    Convert val to the representation that a PersistentState uses for it:
+    a _PMapVar for a dict whose values are immutable, or a _CowDict or
+    _CowList for other dicts and lists.
     """
-    if _current_domain == None:
-        raise Exception(f"cannot declare methods until a domain has been created.")
-    if goal_name not in _current_domain._goal_method_dict:
-        _current_domain._goal_method_dict.update({goal_name:list(goal_methods)})
-    else:
-        old_methods = _current_domain._goal_method_dict[goal_name]
-        new_methods = [m for m in goal_methods if m not in old_methods]
-        _current_domain._goal_method_dict[goal_name].extend(new_methods)
-    return _current_domain._goal_method_dict    
+    t = type(val)
+    if t is dict:
+        if all(_is_immutable(x) for x in val.values()):
+            return _PMapVar(_PMap.from_dict(val))
+        return _CowDict(val)
+    if t is list:
+        return _CowList(val)
+    if t is _CowDict and val._flat:
+        return _PMapVar(_PMap.from_dict(val._data))
+    return val
+
+
+class PersistentState(State):
+    """
+    s = PersistentState(state_name,**kwargs) creates a state that is used
+    in the same way as a State, e.g., s.loc['b'] = 'room2'. The difference
+    is in how it's stored: each dict-valued state variable whose values are
+    immutable (strings, numbers, booleans, tuples, etc.) is kept in a
+    persistent hash array mapped trie. s.copy() takes O(v) time, where v
+    is the number of state variables, and each write to the copy takes
+    O(log n) time and memory and leaves s unchanged. Thus thousands of
+    states in the frontier of find_plan_GBFS or find_plan_a_star share
+    almost all of their storage.
+
+    Two PersistentStates are equal if they have the same state variables
+    with the same values (their names don't matter). Comparing states that
+    descend from the same state skips the parts that they share. A
+    PersistentState can also be hashed, e.g., to put it in a set, but
+    it shouldn't be modified while it's in one.
+
+    Dict values must not be modified in place, e.g., if s.loc['b'] is a list,
+    then s.loc['b'].append(x) would change every state that shares it.
+    Do s.loc['b'] = s.loc['b'] + [x] instead.
+    """
+    def __setattr__(self, varname, val):
+        object.__setattr__(self, varname, _persistent_value(val))
 
+    def __init__(self,name=None,**kwargs):
+        super().__init__(name)
+        for (varname,val) in kwargs.items():
+            setattr(self,varname,val)
+
+    def _copy_vars(self):
+        return _share_vars(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, State):
+            return NotImplemented
+        vars1 = vars(self)
+        vars2 = vars(other)
+        if len(vars1) != len(vars2):
+            return False
+        for (varname,val) in vars1.items():
+            if varname != '__name__':
+                if varname not in vars2 or not val == vars2[varname]:
+                    return False
+        return True
 
-def declare_multigoal_methods(*mg_methods):
+    def __hash__(self):
+        x = 0
+        for (varname,val) in vars(self).items():
+            if varname != '__name__':
+                t = type(val)
+                val = val._map if t is _PMapVar else _freeze(val)
+                x ^= hash((varname, val))
+        return x
+
+
+################################################################################
+# Compact states
+#
+# If a domain declares a state schema, i.e., the state variables and the
+# possible keys and values of each one, then a CompactState can store all of
+# its state variables in a single array.array. Each key of each variable has
+# a fixed position in the array, and the number at that position is 1 plus
+# the index of the key's value in the variable's list of values, or 0 if the
+# key has no value. Thus copying a state copies one block of memory, and a
+# state with n keys takes n bytes (or 2n, if some variable has more than 255
+# possible values) plus a small fixed overhead.
+#
+# state.pos returns a _CompactVar, a lightweight view that translates keys
+# and values to and from array positions and value indices.
+
+
+class _VarSchema():
+    "The keys and values of one state variable in a state schema"
+    __slots__ = ('name', 'offset', 'keys', 'key_index', 'values', 'value_index')
+
+    def __init__(self, name, offset, keys, values):
+        self.name = name
+        self.offset = offset
+        self.keys = tuple(keys)
+        self.key_index = {k:i for (i,k) in enumerate(self.keys)}
+        self.values = tuple(values)
+        # 0 means "no value", so the index of values[i] is i+1. The keys
+        # include the type, since e.g. True == 1 but they're different values.
+        self.value_index = {(type(v),v):i+1 for (i,v) in enumerate(self.values)}
+
+
+class _StateSchema():
     """
-    declare_multigoal_methods tells Pyhop 2 that each member of mg_methods
-    is a multigoal_method. Each member of mg_methods must be a function name
-    (not a string). Example: the following tells Pyhop 2 that stack_all_blocks
-    and unstack_all_blocks are multigoal_methods:
-        declare_multigoal_methods(stack_all_blocks,unstack_all_blocks)
+    The state schema of a domain. See declare_state_schema for what the
+    arguments are.
+    """
+    def __init__(self, **variables):
+        self.vars = {}
+        size = 0
+        max_values = 0
+        for (varname,(keys,values)) in variables.items():
+            var = _VarSchema(varname, size, keys, values)
+            self.vars[varname] = var
+            size += len(var.keys)
+            max_values = max(max_values, len(var.values))
+        self.size = size
+        if max_values < 1 << 8:
+            self.typecode = 'B'
+        elif max_values < 1 << 16:
+            self.typecode = 'H'
+        else:
+            self.typecode = 'L'
+        self.empty = array.array(self.typecode, bytes(size * \
+                        array.array(self.typecode).itemsize))
 
-    declare_multigoal_methods can be called several times to declare
-    more multigoal methods.
+    def __repr__(self):
+        x = '_StateSchema('
+        x += ', '.join([f'{v.name}=({list(v.keys)}, {list(v.values)})'
+                        for v in self.vars.values()])
+        x += ')'
+        return x
+
+
+class _CompactVar(collections.abc.MutableMapping):
     """
-    if _current_domain == None:
-        raise Exception(    \
-                f"cannot declare methods until a domain has been created.")
-    new_mg_methods = [m for m in mg_methods if m not in \
-                      _current_domain._multigoal_method_list]
-    _current_domain._multigoal_method_list.extend(new_mg_methods)
-    return _current_domain._multigoal_method_list    
+    The value of a state variable in a CompactState. It reads and writes
+    the state's array, so it behaves like the dict that it replaces.
+    """
+    __slots__ = ('_values', '_var')
+
+    def __init__(self, values, var):
+        self._values = values
+        self._var = var
+
+    def __getitem__(self, key):
+        var = self._var
+        i = self._values[var.offset + var.key_index[key]]
+        if i == 0:
+            raise KeyError(key)
+        return var.values[i-1]
+
+    def get(self, key, default=None):
+        var = self._var
+        k = var.key_index.get(key)
+        if k == None:
+            return default
+        i = self._values[var.offset + k]
+        return default if i == 0 else var.values[i-1]
+
+    def __setitem__(self, key, val):
+        var = self._var
+        k = var.key_index.get(key)
+        if k == None:
+            raise Exception(f"{key} isn't a key of state variable {var.name}")
+        i = var.value_index.get((type(val), val))
+        if i == None:
+            raise Exception(f"{val} isn't a value of state variable {var.name}")
+        self._values[var.offset + k] = i
+
+    def __delitem__(self, key):
+        var = self._var
+        j = var.offset + var.key_index[key]
+        if self._values[j] == 0:
+            raise KeyError(key)
+        self._values[j] = 0
+
+    def __contains__(self, key):
+        var = self._var
+        k = var.key_index.get(key)
+        return k != None and self._values[var.offset + k] != 0
+
+    def __iter__(self):
+        var = self._var
+        values = self._values
+        offset = var.offset
+        return (key for (k,key) in enumerate(var.keys) if values[offset+k])
+
+    def __len__(self):
+        var = self._var
+        n = len(var.keys)
+        return n - self._values[var.offset:var.offset+n].count(0)
+
+    def items(self):
+        var = self._var
+        vals = var.values
+        chunk = self._values[var.offset:var.offset+len(var.keys)]
+        return [(key, vals[i-1]) for (key,i) in zip(var.keys, chunk) if i]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    # a copy is detached from the state, so make it a dict
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self.items()), memo)
+
+
+# The attributes of a CompactState that aren't state variables
+_COMPACT_ATTRS = ('__name__', '_schema', '_values')
+
+
+class CompactState(State):
+    """
+    s = CompactState(state_name,**kwargs) creates a state that is used in
+    the same way as a State, but stores its state variables in a compact
+    array, using the state schema of the current domain (see
+    declare_state_schema). Each keyword argument must be the name of a
+    state variable in the schema, and its value must be a dict whose keys
+    and values are among the ones that the schema lists for that variable.
+    State variables that the schema doesn't mention may also be assigned,
+    e.g., s.max_stacks = 4, and are stored in the same way as in a State.
+
+    s.pos['a'] = 'table', s.pos.get('a'), 'a' in s.pos, and iteration all
+    work as they do for a dict. Writing a key or value that isn't in the
+    schema raises an exception. s.copy() copies a single array.
+    """
+
+    def __init__(self,name=None,**kwargs):
+        schema = _current_domain._state_schema
+        if schema == None:
+            raise Exception(
+                f"domain {_current_domain.__name__} has no state schema")
+        self._schema = schema
+        self._values = schema.empty[:]
+        super().__init__(name)
+        for (varname,val) in kwargs.items():
+            setattr(self,varname,val)
+
+    def __getattr__(self, varname):
+        # called only if varname isn't in vars(self)
+        if varname[0] != '_':
+            var = self._schema.vars.get(varname)
+            if var != None:
+                return _CompactVar(self._values, var)
+        raise AttributeError(
+            f"{type(self).__name__} object has no attribute {varname}")
+
+    def __setattr__(self, varname, val):
+        var = None if varname[0] == '_' else self._schema.vars.get(varname)
+        if var == None:
+            object.__setattr__(self, varname, val)
+            return
+        if isinstance(val, _CompactVar) and val._values is self._values:
+            if val._var is var:
+                return      # e.g., state.pos = state.pos
+            val = val.copy()
+        (start, end) = (var.offset, var.offset + len(var.keys))
+        self._values[start:end] = self._schema.empty[start:end]
+        view = _CompactVar(self._values, var)
+        for (key,v) in val.items():
+            view[key] = v
+
+    def _var_items(self):
+        "Return the (varname,value) pairs for the state's state variables"
+        items = [(name, _CompactVar(self._values, var))
+                 for (name,var) in self._schema.vars.items()]
+        items.extend(self._other_vars().items())
+        return items
+
+    def _other_vars(self):
+        "Return a dict of the state variables that aren't in the schema"
+        return {varname: val for (varname,val) in vars(self).items()
+                if varname not in _COMPACT_ATTRS}
+
+    def __repr__(self):
+        x = f"{type(self).__name__}('{self.__name__}', "
+        x += self.nameless_repr()[1:]
+        return x
+
+    def nameless_repr(self):
+        x = f"("
+        x += ', '.join([f'{v}={val}' for (v,val) in self._var_items()])
+        x += ')'
+        return x
+
+    def fingerprint(self):
+        x = hash(self._values.tobytes()) & _HASH_MASK
+        for (varname,val) in self._other_vars().items():
+            x ^= hash((varname, _var_zobrist_hash(val))) & _HASH_MASK
+        return x
+
+    def copy(self,name=None):
+        global _next_state_number
+        state = object.__new__(type(self))
+        object.__setattr__(state, '_schema', self._schema)
+        object.__setattr__(state, '_values', self._values[:])
+        other_vars = self._other_vars()
+        if other_vars:
+            vars(state).update(copy.deepcopy(other_vars))
+        if name:
+            state.__name__ = name
+        else:
+            state.__name__ = f'_state{_next_state_number}'
+            _next_state_number += 1
+        return state
 
 
 ################################################################################
-# Functions to print information about the declared tasks, goals, etc.
+# State deltas
 
-def print_domain(heading='\nDomain name:'):
+
+class StateDelta():
     """
-    Print the domain's state-variables and their values. The arguments are:
-     - heading (optional) is a heading to print beforehand.
+    A StateDelta is the difference between two states, as computed by
+    State.diff. It has two attributes:
+      - changes is a dictionary that maps the name of each dict-valued
+        state variable that differs to a dictionary {key: (old, new)}
+        for each key whose value differs;
+      - var_changes is a dictionary {varname: (old, new)} for each other
+        state variable that differs, including state variables that only
+        one of the states has.
+    If a key or state variable is absent from one of the states, the
+    corresponding old or new value is StateDelta.UNBOUND.
+
+    A delta is about the same size as the number of changes, so storing
+    one per action takes much less memory than storing every state.
     """
-    print(f'{heading} {_current_domain.__name__}')
-    print_actions()
-    print_commands()
-    print_methods()
+    UNBOUND = _missing
 
-def print_actions():
-    """Print the names of all the actions"""
-    if _current_domain._action_dict:
-        print('-- Actions:', ', '.join(_current_domain._action_dict))
-    else:
-        print('-- There are no actions --')
+    def __init__(self, changes=None, var_changes=None):
+        self.changes = {} if changes == None else changes
+        self.var_changes = {} if var_changes == None else var_changes
 
-def print_commands():
-    """Print the names of all the commands"""
-    if _current_domain._command_dict:
-        print('-- Commands:', ', '.join(_current_domain._command_dict))
-    else:
-        print('-- There are no commands --')
+    def __len__(self):
+        "Return the number of changed bindings"
+        return sum(len(c) for c in self.changes.values()) \
+            + len(self.var_changes)
 
-def _print_task_methods():
-    """Print a table of the task_methods for each task"""
-    if _current_domain._task_method_dict:
-        print('')
-        print('Task name:         Relevant task methods:')
-        print('---------------    ----------------------')
-        for task in _current_domain._task_method_dict:
-            print(f'{task:<19}' + ', '.join(    \
-                [f.__name__ for f in _current_domain._task_method_dict[task]]))
-        print('')
+    def __bool__(self):
+        return bool(self.changes or self.var_changes)
+
+    def __eq__(self, other):
+        if not isinstance(other, StateDelta):
+            return NotImplemented
+        return self.changes == other.changes and \
+            self.var_changes == other.var_changes
+
+    def __repr__(self):
+        x = 'StateDelta('
+        x += ', '.join([f'{v}={c}' for (v,c) in self.changes.items()] +
+                       [f'{v}={c}' for (v,c) in self.var_changes.items()])
+        x += ')'
+        return x
+
+    def invert(self):
+        "Return the delta that undoes this one"
+        return StateDelta(
+            {v: {k: (new,old) for (k,(old,new)) in c.items()}
+             for (v,c) in self.changes.items()},
+            {v: (new,old) for (v,(old,new)) in self.var_changes.items()})
+
+    def display(self,heading=None):
+        """
+        Print the changes, one per line. The arguments are:
+         - heading (optional) is a heading to print beforehand.
+        """
+        if heading != None:
+            print(heading)
+        for (varname,c) in self.changes.items():
+            for (key,(old,new)) in c.items():
+                print(f"  - {varname}[{key!r}]: {old!r} -> {new!r}")
+        for (varname,(old,new)) in self.var_changes.items():
+            print(f"  - {varname}: {old!r} -> {new!r}")
+
+
+def _hamt_entry_dict(entry):
+    "Return a dict of the keys and values in a trie entry"
+    if type(entry) is tuple:
+        return {entry[1]: entry[2]}
+    return {leaf[1]: leaf[2] for leaf in _hamt_leaves(entry)}
+
+
+def _hamt_diff(node1, node2, changes):
+    """
+    Put key: (val1, val2) into changes for each key whose value in node1's
+    trie differs from its value in node2's trie, skipping shared subtries.
+    """
+    if node1 is node2:
+        return
+    if type(node1) is _HamtNode and type(node2) is _HamtNode \
+            and node1.bitmap == node2.bitmap:
+        for (e1,e2) in zip(node1.entries, node2.entries):
+            if e1 is e2:
+                continue
+            if type(e1) is _HamtNode and type(e2) is _HamtNode:
+                _hamt_diff(e1, e2, changes)
+            else:
+                _dict_diff(_hamt_entry_dict(e1), _hamt_entry_dict(e2), changes)
     else:
-        print('-- There are no task methods --')
+        _dict_diff(_hamt_entry_dict(node1), _hamt_entry_dict(node2), changes)
+
+
+def _dict_diff(d1, d2, changes):
+    "Put key: (val1, val2) into changes for each key whose value differs"
+    for (key,val) in d1.items():
+        newval = d2.get(key, _missing)
+        if newval is not val and newval != val:
+            changes[key] = (val, newval)
+    for (key,newval) in d2.items():
+        if key not in d1:
+            changes[key] = (_missing, newval)
+
+
+def _mapping_diff(val1, val2):
+    "Return {key: (old, new)} for the keys whose values differ"
+    changes = {}
+    t = type(val1)
+    if t is type(val2):
+        if t is _PMapVar:
+            _hamt_diff(val1._map._root, val2._map._root, changes)
+            return changes
+        if t is _CowDict and val1._data is val2._data:
+            return changes
+    _dict_diff(val1, val2, changes)
+    return changes
+
+
+def _state_diff(state1, state2):
+    vars1 = dict(_state_var_items(state1))
+    vars2 = dict(_state_var_items(state2))
+    delta = StateDelta()
+    if isinstance(state1, CompactState) and isinstance(state2, CompactState) \
+            and state1._values == state2._values:
+        # the schema variables are equal, so only check the others
+        vars1 = state1._other_vars()
+        vars2 = state2._other_vars()
+    for (varname,val1) in vars1.items():
+        val2 = vars2.get(varname, _missing)
+        if val2 is val1:
+            continue
+        if isinstance(val1, collections.abc.Mapping) and \
+                isinstance(val2, collections.abc.Mapping):
+            changes = _mapping_diff(val1, val2)
+            if changes:
+                delta.changes[varname] = changes
+        elif val2 is _missing or val1 != val2:
+            delta.var_changes[varname] = (copy.deepcopy(val1), copy.deepcopy(val2))
+    for (varname,val2) in vars2.items():
+        if varname not in vars1:
+            delta.var_changes[varname] = (_missing, copy.deepcopy(val2))
+    return delta
+
+
+def _apply_delta(state, delta):
+    for (varname,c) in delta.changes.items():
+        val = getattr(state, varname)
+        for (key,(old,new)) in c.items():
+            if new is _missing:
+                del val[key]
+            else:
+                val[key] = new
+    for (varname,(old,new)) in delta.var_changes.items():
+        if new is _missing:
+            delattr(state, varname)
+        else:
+            setattr(state, varname, copy.deepcopy(new))
 
-def _print_goal_methods():
-    """Print a table of the goal_methods for each state_variable_name"""
-    if _current_domain._goal_method_dict:
-        print('State var name:    Relevant goal methods:')
-        print('---------------    ----------------------')
-        for var in _current_domain._goal_method_dict:
-            print(f'{var:<19}' + ', '.join( \
-                [f.__name__ for f in _current_domain._goal_method_dict[var]]))
+
+################################################################################
+# Binary encoding of states and multigoals
+#
+# encode_state converts a State or Multigoal to a canonical byte string:
+# two states with the same state-variable bindings have the same encoding,
+# regardless of the order in which the variables and keys were added, or of
+# whether the state is a State, PersistentState, or CompactState. Thus the
+# encoding can be used as a dictionary key or stored on disk.
+#
+# Each value is encoded as a one-byte tag followed by its contents:
+#     N, T, F       None, True, False
+#     i <varint>    an int n, as the varint of 2n if n >= 0, else -2n-1
+#     f <8 bytes>   a float, big-endian IEEE 754
+#     s <varint n> <n bytes>  a string, in UTF-8; b is the same for bytes
+#     l, t <varint n> <n values>   a list or a tuple
+#     d <varint n> <n key-value pairs>, sorted by the key's encoding
+#     e <varint n> <n values>, sorted by their encodings   a frozenset;
+#                             E is the same for a set
+#     p <varint n> <n bytes>  any other value, pickled (not canonical, and
+#                             only if the caller allows it)
+# A varint is an unsigned integer, 7 bits per byte, low-order bits first,
+# and with the high bit set in every byte but the last. Since no encoding is
+# a prefix of another one, sorting the concatenated key-value encodings
+# sorts them by key. A state's encoding is
+#     PH2 <version> <S or M> <name, or N> <variables, encoded as a dict>
+
+
+_encoding_version = b'\x01'
+
+# Encodings of strings that have been encoded before. Most strings in a
+# state (object names, locations, etc.) occur many times.
+_str_codes = {}
+_MAX_STR_CODES = 100000
+
+
+def _varint(n):
+    if n < 0x80:
+        return bytes((n,))
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _encode_value(val, allow_pickle=False):
+    t = type(val)
+    if t is str:
+        code = _str_codes.get(val)
+        if code == None:
+            b = val.encode('utf-8')
+            code = b's' + _varint(len(b)) + b
+            if len(_str_codes) < _MAX_STR_CODES:
+                _str_codes[val] = code
+        return code
+    if t is bool:
+        return b'T' if val else b'F'
+    if val is None:
+        return b'N'
+    if t is int:
+        return b'i' + _varint(2*val if val >= 0 else -2*val-1)
+    if t is float:
+        return b'f' + struct.pack('>d', val)
+    if t is tuple:
+        return b't' + _varint(len(val)) + \
+            b''.join([_encode_value(x, allow_pickle) for x in val])
+    if t is list or t is _CowList:
+        return b'l' + _varint(len(val)) + \
+            b''.join([_encode_value(x, allow_pickle) for x in val])
+    if isinstance(val, collections.abc.Mapping):
+        # inline the lookups of strings that have been encoded before
+        codes = _str_codes
+        items = []
+        for (k,v) in val.items():
+            kcode = codes.get(k) if type(k) is str else None
+            if kcode == None:
+                kcode = _encode_value(k, allow_pickle)
+            vcode = codes.get(v) if type(v) is str else None
+            if vcode == None:
+                vcode = _encode_value(v, allow_pickle)
+            items.append(kcode + vcode)
+        items.sort()
+        return b'd' + _varint(len(val)) + b''.join(items)
+    if t is set or t is frozenset:
+        return (b'E' if t is set else b'e') + _varint(len(val)) + \
+            b''.join(sorted([_encode_value(x, allow_pickle) for x in val]))
+    if t is bytes:
+        return b'b' + _varint(len(val)) + val
+    if not allow_pickle:
+        raise Exception(f"encode_state: can't encode {val!r} of type " \
+                        f"{t.__name__} without allow_pickle=True")
+    b = pickle.dumps(val)
+    return b'p' + _varint(len(b)) + b
+
+
+def _decode_varint(data, i):
+    n = data[i]
+    if n < 0x80:
+        return (n, i+1)
+    n &= 0x7f
+    shift = 7
+    while True:
+        i += 1
+        byte = data[i]
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (n, i+1)
+        shift += 7
+
+
+def _decode_value(data, i, allow_pickle=False):
+    "Return (value, j), where the value's encoding is data[i:j]"
+    tag = data[i]
+    i += 1
+    if tag == 0x73:     # s
+        (n, i) = _decode_varint(data, i)
+        return (data[i:i+n].decode('utf-8'), i+n)
+    if tag == 0x54:     # T
+        return (True, i)
+    if tag == 0x46:     # F
+        return (False, i)
+    if tag == 0x4e:     # N
+        return (None, i)
+    if tag == 0x69:     # i
+        (n, i) = _decode_varint(data, i)
+        return (n >> 1 if not n & 1 else -((n+1) >> 1), i)
+    if tag == 0x66:     # f
+        return (struct.unpack_from('>d', data, i)[0], i+8)
+    if tag == 0x64:     # d
+        (n, i) = _decode_varint(data, i)
+        d = {}
+        for _ in range(n):
+            # inline the decoding of short strings and booleans
+            if data[i] == 0x73 and data[i+1] < 0x80:
+                j = i + 2 + data[i+1]
+                key = data[i+2:j].decode('utf-8')
+                i = j
+            else:
+                (key, i) = _decode_value(data, i, allow_pickle)
+            tag = data[i]
+            if tag == 0x73 and data[i+1] < 0x80:
+                j = i + 2 + data[i+1]
+                d[key] = data[i+2:j].decode('utf-8')
+                i = j
+            elif tag == 0x54:
+                d[key] = True
+                i += 1
+            elif tag == 0x46:
+                d[key] = False
+                i += 1
+            else:
+                (d[key], i) = _decode_value(data, i, allow_pickle)
+        return (d, i)
+    if tag in b'lteE':
+        (n, i) = _decode_varint(data, i)
+        vals = []
+        for _ in range(n):
+            (val, i) = _decode_value(data, i, allow_pickle)
+            vals.append(val)
+        if tag == 0x74:     # t
+            return (tuple(vals), i)
+        if tag == 0x65:     # e
+            return (frozenset(vals), i)
+        if tag == 0x45:     # E
+            return (set(vals), i)
+        return (vals, i)
+    if tag == 0x62:     # b
+        (n, i) = _decode_varint(data, i)
+        return (bytes(data[i:i+n]), i+n)
+    if tag == 0x70:     # p
+        if not allow_pickle:
+            raise Exception(f"decode_state: pickled value at byte {i-1}, " \
+                            "and allow_pickle isn't True")
+        (n, i) = _decode_varint(data, i)
+        return (pickle.loads(data[i:i+n]), i+n)
+    raise Exception(f"decode_state: unknown tag {chr(tag)!r} at byte {i-1}")
+
+
+def encode_state(state, name=True, allow_pickle=False):
+    """
+    Return a byte string that encodes state, which may be a state or a
+    multigoal. States with the same state-variable bindings get the same
+    encoding, no matter what order the bindings were made in, so the
+    encoding can be used as a key for duplicate detection or caching.
+    If name is False, the state's name is left out, so that states with
+    different names but the same bindings also get the same encoding.
+    decode_state converts the encoding back into a state.
+
+    The values may be None, booleans, numbers, strings, bytes, tuples,
+    lists, sets, frozensets, and dicts. encode_state raises an exception
+    for any other value, unless allow_pickle is True, in which case the
+    value is pickled, and its encoding isn't canonical.
+    """
+    kind = b'M' if isinstance(state, Multigoal) else b'S'
+    code = _encode_value(state.__name__) if name else b'N'
+    return b'PH2' + _encoding_version + kind + code + \
+        _encode_value(dict(_state_var_items(state)), allow_pickle)
+
+
+def decode_state(data, cls=None, allow_pickle=False):
+    """
+    Return the state or multigoal that data encodes, where data is a byte
+    string returned by encode_state. If cls is given, it's the class of the
+    state to create, e.g., PersistentState. Otherwise the result is a State
+    or a Multigoal. If the encoding has no name, the result gets a name of
+    the form _state# or _multigoal#.
+
+    If the encoding contains pickled values (see encode_state), decoding
+    it raises an exception unless allow_pickle is True. Unpickling data
+    can run arbitrary code, so don't use allow_pickle=True for data that
+    might come from someone you don't trust, e.g., a cache file that
+    other users can write to.
+    """
+    if data[:4] != b'PH2' + _encoding_version:
+        raise Exception("decode_state: data isn't an encoded state")
+    kind = data[4:5]
+    (name, i) = _decode_value(data, 5)
+    (state_vars, i) = _decode_value(data, i, allow_pickle)
+    if i != len(data):
+        raise Exception(f"decode_state: {len(data) - i} extra bytes at the end")
+    if cls == None:
+        cls = Multigoal if kind == b'M' else State
+    state = cls(name)
+    for (varname,val) in state_vars.items():
+        setattr(state,varname,val)
+    return state
+
+
+def _state_var_items(state):
+    "Return the (varname,value) pairs for the state variables of a state or goal"
+    if isinstance(state, CompactState):
+        return state._var_items()
+    return [(v,val) for (v,val) in vars(state).items() if v != '__name__']
+
+
+def _print_state(state,heading=None):
+    """
+    Print the state-variables and values in 'state', which may be
+    either a state object or a goal object. The optional arguments are:
+    - heading, a heading to print beforehand.
+    """
+    if heading == None: heading = get_type(state)
+    if state != False:
+        title = f"{heading} {state.__name__}:"
+        dashes = '-'*len(title)
+        print(title)
+        print(dashes)
+        for (varname,val) in _state_var_items(state):
+            print(f"  - {varname} = {val}")
         print('')
-    else:
-        print('-- There are no goal methods --')
+    else: 
+        if heading == None: heading = 'state'
+        print('{heading} = False','\n')
+
 
-def _print_multigoal_methods():
-    """Print the names of all the multigoal_methods"""
-    if _current_domain._multigoal_method_list:
-        print('-- Multigoal methods:', ', '.join(  \
-                [f.__name__ for f in _current_domain._multigoal_method_list]))
-    else:
-        print('-- There are no multigoal methods --')
-    
-def print_methods():
-    """Print tables showing what all the methods are"""
-    _print_task_methods()
-    _print_goal_methods()
-    _print_multigoal_methods()
-    
 ################################################################################
-# A built-in multigoal method and its helper function.
+# A class for holding planning-and-acting domains.
+
+class Domain():
+    """
+    d = Domain(domain_name,**kwargs) creates an object that is a container for
+    all the actions, commands, task_methods, goal_methods, multigoals, and
+    multigoal_methods associated with a planning-and-acting domain.
+
+    If domain_name is given and there is already a domain with that name,
+    the new one will replace it. If domain_name is omitted, the new domain
+    will be given a name of the form _domain#, where # is a number. In both
+    cases, the new domain will become the current domain.
+    """
+
+    def __init__(self,name=None):
+        """
+        If 'name' is given, then use it as the domain's name. Otherwise,
+        give it a name of the form '_domain#' where # is an integer.
+        """
+        global _next_domain_number
+        global _domain_dict, _current_domain
+        
+        if name:
+            self.__name__ = name
+        else:
+            self.__name__ = f'_domain{_next_domain_number}'
+            _next_domain_number += 1
+
+        _domain_dict.update({name:self})
+        _current_domain = self
+        
+
+        # dictionary that maps each action name to the corresponding function
+        self._action_dict = {}   
+        
+        # dictionary that maps each action name to the corresponding cost
+        self._action_cost_dict = {}    
+            
+        # dictionary that maps each command name to the corresponding function
+        self._command_dict = {}
+        
+        # dictionary that maps each task name to a list of methods for the task
+        self._task_method_dict = {'_verify_g': [_m_verify_g], '_verify_mg': [_m_verify_mg]}
+        
+        # dictionary that maps each goal name to a list of methods for the goal
+        self._goal_method_dict = {}
+        
+        # list of all methods for multigoals
+        self._multigoal_method_list = []
+
+        # the state schema for CompactStates, if one has been declared
+        self._state_schema = None
+
+        # dispatch tables that map each action, task, and goal name to the
+        # function that a planner uses for it, keyed by the planner's tuple
+        # of those functions. They're compiled by _dispatch_dict when
+        # needed, and the declare_ functions set this back to None.
+        self._dispatch = None
+
+        _domain_dict.update({self.__name__:self})
+
+
+    def __str__(self):
+        return f"<Domain {self.__name__}>"
+        
+    def __repr__(self):
+        """Return a string that can be used to reconstruct the domain"""
+        x = f"Domain('{self.__name__}', "
+        x += ', '.join([f'{v}={vars(self)[v]}' for v in vars(self) if v != '__name__'])
+        x += ')'
+        return x
+
+    def copy(self,name=None):
+        """
+        Make a copy of the domain. If name is given, then give the copy that name.
+        Otherwise give it a name of the form '_domain#' where # is an integer.
+        """
+        global next_domain_number
+        dom = copy.deepcopy(self)
+        if name:
+            dom.__name__ = name
+        else:
+            dom.__name__ = f'_domain{next_domain_number}'
+            next_domain_number += 1
+        return dom
+        
+
+# If you call Domain() with no arguments, the new domain's name will be
+# _domain#, where # is the following number.
+_next_domain_number = 0
+
+
+# The set of all domains that have been created
+_domain_dict = {}
+
+
+# A global variable telling the Pyhop 2 functions what domain we're using.
+# At the end of this file, we'll set it to a newly created domain.
+_current_domain = None
+
+
+def current_domain():
+    "Return the name of the current domain."
+    return _current_domain.__name__
+
+
+def set_current_domain(domain_name):
+    """
+    domain_name should be the name of a domain that has been defined using
+    the Domain class. set_current_domain makes it the current domain.
+    """
+    global _current_domain
+    domain = _domain_dict.get(domain_name)
+    if domain == None:
+        raise Exception(f"There is no domain named {domain_name}")
+    _current_domain = _domain_dict[domain_name]
+
+
+def domains():
+    "Return the set of all domain names."
+    return {name for name in _domain_dict}
+
+
+def remove_domain(domain_name):
+    "Remove the domain named domain_name from the set of all domains."
+    if _current_domain == domain_name:
+        raise Exception(f"Can't remove {domain.__name__}, because it's the current domain")
+    else:
+        _domain_dict.pop(domain_name)
+    
+
+################################################################################
+# Commands for distinguishing data types
+
+
+def get_type(object):
+    "Return object's type name"
+    return type(object).__name__
+
+
+def _todo_to_string(todo):
+    ttype = get_type(todo)
+    if ttype == 'list':
+        return str([str(x) for x in todo])
+    elif ttype == 'tuple':
+        return str(tuple([str(x) for x in todo]))
+    else:
+        return str(todo)
+
+
+################################################################################
+# Functions to declare actions, commands, tasks, goals, multigoals
+
+
+def declare_actions(*actions):
+    """
+    Each member of actions must be a function name (not a string).
+    declare_actions tells Pyhop 2 that each of them is an action. For
+    example, this tells Pyhop 2 that pickup and putdown are actions:
+        declare_actions(pickup,putdown)
+    
+    declare_actions can be called several times to declare more actions.
+    """
+    if _current_domain == None:
+        raise Exception(f"cannot declare actions until a domain has been created.")
+    _current_domain._action_dict.update({act.__name__:act for act in actions})
+    _current_domain._dispatch = None
+    for act in actions:
+        _current_domain._action_cost_dict.setdefault(act.__name__, 1)
+    return _current_domain._action_dict
+
+def declare_actions_cost(*actions):
+    if _current_domain == None:
+        raise Exception(f"cannot declare actions until a domain has been created.")
+    _current_domain._action_cost_dict.update({act.__name__:cost for (act, cost) in actions})
+    return _current_domain._action_cost_dict
+
+def declare_commands(*commands):
+    """
+    Each member of commands must be a function name (not a string), and the
+    name should have the form c_foo, where foo is the name of an action.
+    declare_commands tells Pyhop 2 that each of the functions is a command.
+    Example: the following tells Pyhop 2 that c_pickup and c_putdown are
+    commands:
+        declare_commands(c_pickup,c_putdown)
+    
+    declare_commands can be called several times to declare more commands.
+    """
+    if _current_domain == None:
+        raise Exception(f"cannot declare commands until a domain has been created.")
+    _current_domain._command_dict.update({cmd.__name__:cmd for cmd in commands})
+    return _current_domain._command_dict
+
+
+def declare_task_methods(task_name, *task_methods):
+    """
+    task_name must be a character string, and each member of task_methods must
+    be a function name (not a character string). declare_task_methods tells
+    Pyhop 2 that each of the functions is a task_method that is relevant for
+    every task of the form (task_name, arg1, ..., argn). Example:
+        declare_task_methods('travel', travel_by_car, travel_by_foot)
+    tells Pyhop that travel_by_car and travel_by_foot are methods and are 
+    relevant for tasks such as these:
+        ('travel', 'alice', 'store')
+        ('travel', 'alice', 'umd', 'ucla')
+        ('travel', 'alice', 'umd', 'ucla', 'slowly')
+        ('travel', 'bob', 'home', 'park', 'looking', 'at', 'birds')
+
+    This is similar to the original Pyhop's declare_methods function,
+    except that declare_task_methods can be called several times to 
+    declare more methods for the same task.
+    """
+    if _current_domain == None:
+        raise Exception(f"cannot declare methods until a domain has been created.")
+    if task_name in _current_domain._task_method_dict:
+        old_methods = _current_domain._task_method_dict[task_name]
+        # even though _current_domain._task_method_dict[task_name] is a list,
+        # we don't want to add any methods that are already in it
+        new_methods = [m for m in task_methods if m not in old_methods]
+        _current_domain._task_method_dict[task_name].extend(new_methods)
+    else:
+        _current_domain._task_method_dict.update({task_name:list(task_methods)})
+    _current_domain._dispatch = None
+    return _current_domain._task_method_dict
+
+
+def declare_goal_methods(goal_name, *goal_methods):
+    """
+    goal_name must be a character string, and each member of goal_methods must
+    be a function name (not a character string). declare_goal_methods tells
+    Pyhop 2 that each of the functions is a goal_method that is relevant for
+    every goal of the form (goal_name, arg, value). Example:
+        declare_goal_method('loc',travel_by_car)
+    tells Pyhop that travel_by_car is relevant for goals such as these:
+        ('loc', 'alice', 'ucla')
+        ('loc', 'bob', 'home')
+    
+    declare_goal_methods can be called several times to declare more
+    methods for the same goal.
+    """
+    if _current_domain == None:
+        raise Exception(f"cannot declare methods until a domain has been created.")
+    if goal_name not in _current_domain._goal_method_dict:
+        _current_domain._goal_method_dict.update({goal_name:list(goal_methods)})
+    else:
+        old_methods = _current_domain._goal_method_dict[goal_name]
+        new_methods = [m for m in goal_methods if m not in old_methods]
+        _current_domain._goal_method_dict[goal_name].extend(new_methods)
+    _current_domain._dispatch = None
+    return _current_domain._goal_method_dict    
+
+
+def _dispatch_dict(handlers):
+    """
+    handlers is a planner's tuple (action_handler, task_handler,
+    goal_handler) of the functions it uses for actions, tasks, and goals.
+    Return the current domain's dispatch dictionary for them, compiling it
+    first if necessary. It maps the name of each action, task, and goal to
+    its handler, so the planners can find what to do with a todo with a
+    single lookup. If a name is declared as more than one kind, an action
+    takes precedence over a task, and a task over a goal.
+    """
+    tables = _current_domain._dispatch
+    if tables == None:
+        tables = _current_domain._dispatch = {}
+    dispatch = tables.get(handlers)
+    if dispatch == None:
+        (action_handler, task_handler, goal_handler) = handlers
+        dispatch = {name:goal_handler \
+                    for name in _current_domain._goal_method_dict}
+        dispatch.update({name:task_handler \
+                         for name in _current_domain._task_method_dict})
+        dispatch.update({name:action_handler \
+                         for name in _current_domain._action_dict})
+        tables[handlers] = dispatch
+    return dispatch
+
+
+def declare_multigoal_methods(*mg_methods):
+    """
+    declare_multigoal_methods tells Pyhop 2 that each member of mg_methods
+    is a multigoal_method. Each member of mg_methods must be a function name
+    (not a string). Example: the following tells Pyhop 2 that stack_all_blocks
+    and unstack_all_blocks are multigoal_methods:
+        declare_multigoal_methods(stack_all_blocks,unstack_all_blocks)
+
+    declare_multigoal_methods can be called several times to declare
+    more multigoal methods.
+    """
+    if _current_domain == None:
+        raise Exception(    \
+                f"cannot declare methods until a domain has been created.")
+    new_mg_methods = [m for m in mg_methods if m not in \
+                      _current_domain._multigoal_method_list]
+    _current_domain._multigoal_method_list.extend(new_mg_methods)
+    return _current_domain._multigoal_method_list    
+
+
+def declare_state_schema(**variables):
+    """
+    declare_state_schema tells Pyhop 2 what state variables the domain's
+    states have, and what keys and values each of them can have, so that
+    states can be created as CompactStates. Each keyword arg is the name of
+    a state variable, and its value is a pair (keys, values), where keys
+    and values are lists. Example:
+        blocks = ['a', 'b', 'c']
+        declare_state_schema(pos=(blocks, blocks + ['table', 'hand']),
+                             clear=(blocks, [True, False]),
+                             holding=(['hand'], blocks + [False]))
+    A value written to a CompactState must be in the list with the same
+    type; e.g., 1 and 0 aren't values of clear above, even though 1 == True
+    and 0 == False.
+
+    Calling declare_state_schema again replaces the schema. CompactStates
+    that were created with the old schema keep using it.
+    """
+    if _current_domain == None:
+        raise Exception(    \
+                f"cannot declare a state schema until a domain has been created.")
+    _current_domain._state_schema = _StateSchema(**variables)
+    return _current_domain._state_schema
+
+
+################################################################################
+# Functions to print information about the declared tasks, goals, etc.
+
+def print_domain(heading='\nDomain name:'):
+    """
+    Print the domain's state-variables and their values. The arguments are:
+     - heading (optional) is a heading to print beforehand.
+    """
+    print(f'{heading} {_current_domain.__name__}')
+    print_actions()
+    print_commands()
+    print_methods()
+
+def print_actions():
+    """Print the names of all the actions"""
+    if _current_domain._action_dict:
+        print('-- Actions:', ', '.join(_current_domain._action_dict))
+    else:
+        print('-- There are no actions --')
+
+def print_commands():
+    """Print the names of all the commands"""
+    if _current_domain._command_dict:
+        print('-- Commands:', ', '.join(_current_domain._command_dict))
+    else:
+        print('-- There are no commands --')
+
+def _print_task_methods():
+    """Print a table of the task_methods for each task"""
+    if _current_domain._task_method_dict:
+        print('')
+        print('Task name:         Relevant task methods:')
+        print('---------------    ----------------------')
+        for task in _current_domain._task_method_dict:
+            print(f'{task:<19}' + ', '.join(    \
+                [f.__name__ for f in _current_domain._task_method_dict[task]]))
+        print('')
+    else:
+        print('-- There are no task methods --')
+
+def _print_goal_methods():
+    """Print a table of the goal_methods for each state_variable_name"""
+    if _current_domain._goal_method_dict:
+        print('State var name:    Relevant goal methods:')
+        print('---------------    ----------------------')
+        for var in _current_domain._goal_method_dict:
+            print(f'{var:<19}' + ', '.join( \
+                [f.__name__ for f in _current_domain._goal_method_dict[var]]))
+        print('')
+    else:
+        print('-- There are no goal methods --')
+
+def _print_multigoal_methods():
+    """Print the names of all the multigoal_methods"""
+    if _current_domain._multigoal_method_list:
+        print('-- Multigoal methods:', ', '.join(  \
+                [f.__name__ for f in _current_domain._multigoal_method_list]))
+    else:
+        print('-- There are no multigoal methods --')
+    
+def print_methods():
+    """Print tables showing what all the methods are"""
+    _print_task_methods()
+    _print_goal_methods()
+    _print_multigoal_methods()
+    
+################################################################################
+# A built-in multigoal method and its helper function.
+
+
+def m_split_goals(state,multigoal):
+    """
+    m_split_goals is the only multigoal method that Pyhop 2 provides, and
+    Pyhop 2 won't use it unless the user declares it explicitly in a call
+    to pyhop2.declare_multigoal_methods.
+    
+    m_split_goals takes two arguments: the current state and a multigoal
+    to achieve. m_split_goals separates the multigoal into a collection of
+    individual goals. Then it repeatedly iterates through the list of
+    individual goals, trying to achieve each goal that isn't already true.
+    The purpose of the repetition is to overcome deleted-condition
+    interactions (in which accomplishing a goal has a side-effect of 
+    falsifying another goal that was previously true).
+    
+    More specifically, if one or more of the individual goals is not true,
+    then m_split_goals returns a goal list [g_1, ..., g_n, G], where
+    g_1, ..., g_n are the goals that aren't true, and G is the multigoal.
+    The list tells seek_plan to achieve g_1, ..., g_n sequentially, then
+    invoke m_split_goals again to re-achieve any goals that have become
+    false.
+
+    The main problem with m_split_goals is that it isn't smart about
+    choosing the order in which to achieve g1, ..., gn. Some orderings
+    may work better than others. Thus it might be desirable to modify
+    the method to use a heuristic function to choose a good order.
+    """
+    goal_dict = _goals_not_achieved(state,multigoal)
+    goal_list = []
+    for state_var_name in goal_dict:
+        for arg in goal_dict[state_var_name]:
+            val = goal_dict[state_var_name][arg]
+            goal_list.append((state_var_name,arg,val))
+    if goal_list:
+        # achieve goals, then check whether they're all simultaneously true
+        return goal_list + [multigoal]
+    return goal_list
+
+
+# helper function for m_split_goals above:
+
+def _goals_not_achieved(state,multigoal):
+    """
+    _goals_not_achieved takes two arguments: a state s and a multigoal g.
+    It returns a dictionary of the goals in g that aren't true in s.
+    For example, suppose
+        s.loc['c0'] = 'room0', g.loc['c0'] = 'room0',
+        s.loc['c1'] = 'room1', g.loc['c1'] = 'room3',
+        s.loc['c2'] = 'room2', g.loc['c2'] = 'room4'.
+    Then _goals_not_achieved(s, g) will return
+        {'loc': {'c1': 'room3', 'c2': 'room4'}}    
+    """
+    unachieved = {}
+    for name in vars(multigoal):
+        if name != '__name__':
+            for arg in vars(multigoal).get(name):
+                val = vars(multigoal).get(name).get(arg)
+                if val != getattr(state,name).get(arg):
+                    # want arg_value_pairs.name[arg] = val
+                    if not unachieved.get(name):
+                        unachieved.update({name:{}})
+                    unachieved.get(name).update({arg:val})
+    return unachieved
+
+
+################################################################################
+# Functions to verify whether goal_method and multigoal_methods achieve the
+# goals they are supposed to achieve.
+
+
+_verify_goals = True
+
+
+def verify_goals(boolean=None):
+    """
+    If boolean is True, then whenever the planner uses a method m to refine
+    a goal or multigoal, it will insert a "verification" task into the
+    current partial plan. If boolean is False, the planner won't insert
+    any verification tasks into the plan. If verify_goals is call with no
+    argument, it will return the current value of boolean.
+    
+    The purpose of the verification task is to raise an exception if the
+    refinement produced by m doesn't achieve the goal or multigoal that it
+    is supposed to achieve. This won't insert anything into the final plan;
+    it just will verify whether m did what it was supposed to do.
+    """
+    global _verify_goals
+    if boolean != None:
+        _verify_goals = boolean
+    return _verify_goals
+
+
+
+def _m_verify_g(state, method_name, state_var_name, arg, desired_val, \
+        depth):
+    """
+    Pyhop 2 uses this method to check whether a goal_method has achieved the
+    goal that it promised to achieve.
+    """
+    if getattr(state,state_var_name)[arg] != desired_val:
+        raise Exception(f"depth {depth}: method {method_name} didn't achieve",
+                f"goal {state_var_name}[{arg}] = {desired_val}")
+    return []       # i.e., don't create any subtasks or subgoals
+
+
+def _m_verify_mg(state, method_name, multigoal, depth):
+    """
+    Pyhop 2 uses this method to check whether a multigoal-method has achieved
+    the multigoal that it promised to achieve.
+    """
+    goal_dict = _goals_not_achieved(state,multigoal)
+    if goal_dict:
+        raise Exception(f"depth {depth}: method {method_name} " + \
+                        f"didn't achieve {multigoal}]")
+    return []
+
+
+def _trace_verify(tracer, todo1, method):
+    """
+    If method is _m_verify_g or _m_verify_mg, it has just found that the
+    method named in the verification task todo1 achieved its goal or
+    multigoal, so tell tracer.
+    """
+    if method is _m_verify_g:
+        (_, method_name, state_var_name, arg, val, depth) = todo1
+        tracer.on_verify(depth, method_name, (state_var_name, arg, val))
+    elif method is _m_verify_mg:
+        (_, method_name, multigoal, depth) = todo1
+        tracer.on_verify(depth, method_name, multigoal)
+
+
+################################################################################
+# Applying actions and commands
+#
+# An action is applied only if the task name is the name of the action.
+# This differs from HGN planners such as GDP and Godel, in which we can
+# decide which actions are relevant by matching their "effects" atoms with
+# the goal atoms. That isn't feasible in Pyhop 2.
+#
+# The problem is that in Pyhop 2, the only way to tell what effects an
+# action will have is to try to apply the fully instantiated action.
+# Thus, to find an action that is applicable in a state s and whose effects
+# satisfy a goal g, we would need to iterate through every possible action
+# instance (i.e, every combination of action name and parameter values), to
+# see if applying the action instance in s produces a state that satisfies
+# g. Such a combinatorial explosion would be unacceptably expensive.
+#
+# In Pyhop 2, one can get the same effect, with much less computational
+# expense, as follows. Consider a blocks-world action unstack(hand,b1,b2)
+# that has three effects: loc(b1)=hand, holding(hand)=b1, and
+# the-block-on(b2)=nil. Then we can write three methods:
+# - a method m1(b1,new_loc) that's declared relevant for 'loc'. If
+#   called with new_loc = hand, it calls unstack(hand,b1,state.loc(b1)).
+# - a method m2(hand,b1) that's declared relevant for 'holding'.
+#   It calls unstack(hand,b1,state.loc(b1)).
+# - a method m3(b2,status) that's declared relevant for 'clear'. If
+#   called with status=nil, it calls unstack(hand,the-block-on(b2),b2)).
+#
+# In hgn_pyhop <https://github.com/ospur/hgn-pyhop>, unlike Pyhop 2, one
+# may declare actions to be directly relevant for goals. I considered
+# adding this feature to Pyhop 2, but decided against it. For a goal of the
+# form g = (name, arg, val), it would require restricting each relevant
+# action to have exactly two parameters, one corresponding to arg and the
+# other corresponding to val. Suppose we try to do this with the action
+# unstack(hand,b1,b2) described above. To make it relevant for the goal
+# loc(b1)=hand, we would need to rewrite it to take two parameters:
+# b1 and hand.  If we instead wanted to make it relevant for the goal
+# holding(hand,b1), or the goal atop(b2,nil), we would need
+# to rewrite the action so its parameters can be hand and b1, or
+# b2 and nil, respectively. All three of these are a bit unnatural --
+# and furthermore there's no way to accomplish all three of them at
+# once, which is what the GDP and Godel HGN planning algorithms would
+# require. In contrast, in the current Pyhop 2 we can easily get the
+# same effect by writing the three goal_methods described earlier.
+# In my view, this is a better approach.
+################################################################################
+
+
+def _apply_action(state, task1, depth, tracer=None, stats=None):
+    """
+    apply_action is called only when task1's name matches an action name.
+    It applies the action by retrieving the action's function definition
+    and calling it on the arguments, and returns the new state, or False if
+    the action isn't applicable. If find_plan is using an undo trail (see
+    undo_trail), the action modifies state itself, and seek_plan undoes the
+    modifications when it backtracks. tracer is None or a Tracer, and
+    stats is None or a SearchStats.
+    """
+    if tracer != None: tracer.on_action_try(depth, task1)
+    action = _current_domain._action_dict[task1[0]]
+    if _trail == None:
+        if stats == None:
+            newstate = action(state.copy(),*task1[1:])
+        else:
+            newstate = stats._apply(action, state.copy(), task1)
+    else:
+        _trail_save(state)
+        if stats == None:
+            newstate = action(state,*task1[1:])
+        else:
+            newstate = stats._apply(action, state, task1)
+        if newstate and newstate is not state:
+            _trail_vars(newstate)
+    if tracer != None: tracer.on_action(depth, task1, newstate)
+    if newstate:
+        return newstate
+    return False
+
+
+def _apply_command(state, command, args, tracer=None):
+    """
+    apply_command is called only when task1's name matches a command name.
+    It applies the command by retrieving the command's function definition
+    and calling it on the arguments. tracer is None or a Tracer.
+    """
+    if tracer != None: tracer.on_command_try(state, command, args)
+    next_state = command(state.copy(),*args)
+    if tracer != None: tracer.on_command(command, args, next_state)
+    if next_state:
+        return next_state
+    else:
+        return False
+
+################################################################################
+# Applying actions in place, with an undo trail
+#
+# Normally _apply_action gives each action a copy of the state. If
+# undo_trail() is True, find_plan instead makes one copy of the initial state
+# and applies every action to it in place. Each change is recorded on the
+# trail (a list of undo entries), and when seek_plan backtracks over an
+# action, _trail_undo pops the entries that were made since then and undoes
+# them. This is the trail technique used in Prolog and SAT solvers.
+#
+# To record changes to a dict-valued state variable one key at a time, the
+# working state's dicts are replaced by _TrailDicts. For state variables
+# whose changes can't be seen that way (e.g., lists, or dicts of lists),
+# _trail_save makes a copy of them before each action.
+
+
+_use_trail = False
+
+# The current undo trail, or None if find_plan isn't using one
+_trail = None
+
+
+def undo_trail(boolean=None):
+    """
+    If boolean is True, then find_plan will apply actions to the current
+    state in place rather than to copies of it, and record the changes on an
+    undo trail so that it can undo them when it backtracks. This removes
+    nearly all of the copying from find_plan, and helps the most on deep
+    plans with little backtracking. The state that is passed to find_plan
+    isn't modified.
+
+    Action functions don't need to change, but they must not keep
+    references to the state or its state variables, since the values will
+    change after the action returns. Methods must not modify the state.
+
+    If undo_trail is called with no argument, it will return the current
+    value of boolean.
+    """
+    global _use_trail
+    if boolean != None:
+        _use_trail = boolean
+    return _use_trail
+
+
+class _TrailDict(dict):
+    """
+    The value of a dict-valued state variable during a search that uses an
+    undo trail. Reads are ordinary dict reads, and every write puts an
+    entry (dict, key, old value) on the trail. A deletion's entry also has
+    the key's position, so that undoing it puts the key back where it was
+    and iteration order is the same as if the state had been copied.
+    """
+    __slots__ = ()
+
+    def __setitem__(self, key, val):
+        if _trail != None:
+            _trail.append((self, key, dict.get(self, key, _missing)))
+        dict.__setitem__(self, key, val)
+
+    def __delitem__(self, key):
+        old = dict.__getitem__(self, key)
+        if _trail != None:
+            for (position,k) in enumerate(self):
+                if k is key or k == key:
+                    break
+            _trail.append((self, key, old, position))
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        if key in self:
+            val = self[key]
+            del self[key]
+            return val
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        (key, val) = dict.popitem(self)
+        if _trail != None:
+            _trail.append((self, key, val, len(self)))
+        return (key, val)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for (key,val) in dict(*args, **kwargs).items():
+            self[key] = val
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    # copies aren't part of the search, so make them dicts
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+
+def _trail_vars(state):
+    """
+    Replace each dict-valued state variable in state whose values are
+    immutable with a _TrailDict, so that writes to it go onto the trail.
+    """
+    state_vars = vars(state)
+    for (varname,val) in list(state_vars.items()):
+        t = type(val)
+        if t is dict or t is _CowDict:
+            if all(_is_immutable(x) for x in val.values()):
+                state_vars[varname] = _TrailDict(val.items())
+
+
+def _trail_save(state):
+    """
+    Put an entry on the trail that will restore state's state-variable
+    bindings, and copies of the state variables that _TrailDict can't
+    keep track of.
+    """
+    saved = dict(vars(state))
+    contents = []
+    compact = isinstance(state, CompactState)
+    for (varname,val) in saved.items():
+        t = type(val)
+        if t is _TrailDict or t in _atomic_types or \
+                (compact and varname in _COMPACT_ATTRS):
+            continue
+        if t is _PMapVar:
+            contents.append((val, val._map))
+        elif not _is_immutable(val):
+            saved[varname] = copy.deepcopy(val)
+    if compact:
+        contents.append((state._values, state._values[:]))
+    _trail.append((state, saved, contents))
+
+
+def _trail_undo(mark):
+    "Undo the entries on the trail after the first 'mark' of them"
+    while len(_trail) > mark:
+        entry = _trail.pop()
+        if type(entry[0]) is _TrailDict:
+            if len(entry) == 4:
+                _trail_reinsert(*entry)
+                continue
+            (d, key, old) = entry
+            if old is _missing:
+                dict.__delitem__(d, key)
+            else:
+                dict.__setitem__(d, key, old)
+        else:
+            (state, saved, contents) = entry
+            state_vars = vars(state)
+            state_vars.clear()
+            state_vars.update(saved)
+            for (val, old) in contents:
+                if type(val) is _PMapVar:
+                    val._map = old
+                else:
+                    val[:] = old
+
+
+def _trail_reinsert(d, key, val, position):
+    "Put key back into d at the position it was deleted from"
+    if position == len(d):
+        dict.__setitem__(d, key, val)
+        return
+    items = list(d.items())
+    items.insert(position, (key, val))
+    dict.clear(d)
+    dict.update(d, items)
+
+
+################################################################################
+# Applying methods
+#
+# seek_plan doesn't call itself recursively. Instead, it keeps a stack of
+# choice points, one for each task, goal, or multigoal whose relevant methods
+# it hasn't finished trying. When the search below a method fails, seek_plan
+# backtracks to the most recent choice point and tries its next method.
+# Thus the length of a plan isn't limited by Python's recursion limit.
+#
+# The recursive seek_plan failed with a RecursionError if a method kept
+# decomposing a task into itself; now such a search runs until its Budget
+# runs out. With cycle_check=True (see find_plan), once the stack has
+# _CYCLE_CHECK_DEPTH choice points, seek_plan gives each new choice point a
+# key (see _subproblem_key) and treats one whose state and todo list are the
+# same as those of a choice point below it on the stack as a failure. If
+# actions and methods depend only on the state and their arguments, the
+# search below that choice point would repeat itself forever, so this can't
+# change a plan that would otherwise be found. Computing a key takes time
+# proportional to the size of the state, so the check is off by default. A
+# search whose todo list or state keeps growing still needs a Budget to
+# stop it.
+
+_CYCLE_CHECK_DEPTH = 100
+
+
+class _ChoicePoint():
+    """
+    A task, goal, or multigoal (todo1) in a search node, and the methods
+    that are relevant for it. kind is 'task', 'goal', or 'multigoal', and
+    methods[i] is the next method to try. mark is the length of the undo
+    trail (if there is one) when the choice point was created, key is
+    the choice point's key in the nogood cache (if there is one), cost
+    is the cost of plan in a branch-and-bound search, and path_key is its
+    key in the set of choice points on the current path (if the search
+    looks for cycles and is deep enough).
+    """
+    __slots__ = ('kind', 'state', 'todo1', 'more', 'plan', 'depth',
+                 'methods', 'i', 'mark', 'key', 'cost', 'path_key')
+
+    def __init__(self, kind, state, todo1, more, plan, depth, methods):
+        self.kind = kind
+        self.state = state
+        self.todo1 = todo1
+        self.more = more
+        self.plan = plan
+        self.depth = depth
+        self.methods = methods
+        self.i = 0
+        self.mark = None if _trail == None else len(_trail)
+        self.key = None
+        self.cost = 0
+        self.path_key = None
+
+
+def _find_task_method(state, task1, more_tasks, plan, depth, tracer=None):
+    """
+    Return a choice point for the methods in task1's entry in the
+    task-method dictionary.
+    """
+    relevant = _current_domain._task_method_dict[task1[0]]
+    if tracer != None: tracer.on_choice(depth, 'task', task1, relevant)
+    return _ChoicePoint('task', state, task1, more_tasks, plan, depth, relevant)
+
+
+def _find_goal_method(state, goal1, more_goals, plan, depth, tracer=None):
+    """
+    Return a choice point for the methods in goal1's entry in the
+    goal-method dictionary, or None if goal1 is already achieved.
+    """
+    (state_var_name, arg, val) = goal1
+    if getattr(state,state_var_name).get(arg) == val:
+        if tracer != None: tracer.on_choice(depth, 'goal', goal1, None)
+        return None
+    relevant = _current_domain._goal_method_dict[state_var_name]
+    if tracer != None: tracer.on_choice(depth, 'goal', goal1, relevant)
+    return _ChoicePoint('goal', state, goal1, more_goals, plan, depth, relevant)
+
+
+def _find_multigoal_method(state, multigoal1, more_goals, plan, depth, \
+                           tracer=None):
+    """
+    Return a choice point for the multigoal methods. Unlike with goal
+    methods, we don't do verification here because it's unclear what
+    we're supposed to verify.
+    """
+    relevant = _current_domain._multigoal_method_list
+    if tracer != None:
+        tracer.on_choice(depth, 'multigoal', multigoal1, relevant)
+    return _ChoicePoint('multigoal', state, multigoal1, more_goals, plan, \
+                        depth, relevant)
+
+
+# The handlers for find_plan's dispatch table (see _dispatch_dict). Each
+# _find_ function returns a choice point, or None for a goal that's already
+# achieved.
+_seek_plan_handlers = (_apply_action, _find_task_method, _find_goal_method)
+
+
+def _next_method(choice, stats=None, tracer=None):
+    """
+    Iterate through choice's remaining methods until we find one that's
+    applicable, and apply it to produce a list of subtasks or subgoals.
+    Return the search node (state, todo_list, plan, depth) in which
+    todo_list is the subtask or subgoal list + [verification] + the rest
+    of the todo list, where verification is a special task to test whether
+    the method actually achieved its goal. If no more methods are
+    applicable, return None. stats is None or a SearchStats, and tracer is
+    None or a Tracer.
+    """
+    (kind, state, todo1, depth) = \
+        (choice.kind, choice.state, choice.todo1, choice.depth)
+    methods = choice.methods
+    while choice.i < len(methods):
+        method = methods[choice.i]
+        choice.i += 1
+        if choice.mark != None:
+            # undo the actions in the search below the previous method
+            _trail_undo(choice.mark)
+        if tracer != None: tracer.on_method_try(depth, kind, todo1, method)
+        if kind == 'task':
+            if stats == None:
+                subtasks = method(state,*todo1[1:])
+            else:
+                subtasks = stats._try(method, state,*todo1[1:])
+            if tracer != None:
+                _trace_verify(tracer, todo1, method)
+                tracer.on_method(depth, kind, todo1, method, subtasks)
+            # Can't just say "if subtasks:", because that's wrong if subtasks == []
+            if subtasks != False and subtasks != None:
+                return (state, _link(subtasks, choice.more), choice.plan, depth+1)
+        elif kind == 'goal':
+            (state_var_name, arg, val) = todo1
+            if stats == None:
+                subgoals = method(state,arg,val)
+            else:
+                subgoals = stats._try(method, state, arg, val)
+            if tracer != None:
+                tracer.on_method(depth, kind, todo1, method, subgoals)
+            # Can't just say "if subgoals:", because that's wrong if subgoals == []
+            if subgoals != False and subgoals != None:
+                if _verify_goals:
+                    verification = [('_verify_g', method.__name__, \
+                                     state_var_name, arg, val, depth)]
+                else:
+                    verification = []
+                todo_list = _link(subgoals + verification, choice.more)
+                return (state, todo_list, choice.plan, depth+1)
+        else:
+            if stats == None:
+                subgoals = method(state,todo1)
+            else:
+                subgoals = stats._try(method, state, todo1)
+            if tracer != None:
+                tracer.on_method(depth, kind, todo1, method, subgoals)
+            # Can't just say "if subgoals:", because that's wrong if subgoals == []
+            if subgoals != False and subgoals != None:
+                if _verify_goals:
+                    verification = [('_verify_mg', method.__name__, todo1, \
+                                     depth)]
+                else:
+                    verification = []
+                todo_list = _link(subgoals + verification, choice.more)
+                return (state, todo_list, choice.plan, depth+1)
+    if tracer != None: tracer.on_backtrack(depth, kind, todo1, methods)
+    return None
+
+
+############################################################
+# Linked lists
+#
+# The planners represent todo lists and plans as persistent linked lists, so
+# that a search node can share them with its parent instead of copying them.
+# Removing the first item of a todo list is just a matter of taking its rest,
+# and a method's subtasks are put in front of the rest without copying it.
+# Plans are kept in reverse order, so adding an action creates one new link.
+# Thus each step costs O(1) rather than O(n), and finding a plan of length n
+# takes linear rather than quadratic time. The planners convert plans back
+# to ordinary lists before returning them.
+#
+# A heuristic function given to find_plan_GBFS or find_plan_a_star receives
+# its todo list as a _Link. It can iterate over it, index it, and take its
+# length, as with a list, but it can't modify it.
+
+
+class _Link(collections.abc.Sequence):
+    """
+    A persistent linked list whose first item is first, followed by the
+    items in rest. The empty list is _nil.
+    """
+    __slots__ = ('first', 'rest', '_len', '_hash')
+
+    def __init__(self, first, rest):
+        self.first = first
+        self.rest = rest
+        self._len = rest._len + 1
+        self._hash = None
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        link = self
+        while link._len:
+            yield link.first
+            link = link.rest
+
+    def __getitem__(self, i):
+        if i == 0 and self._len:
+            return self.first
+        if isinstance(i, slice):
+            return list(self)[i]
+        if i < 0:
+            i += self._len
+        if i < 0 or i >= self._len:
+            raise IndexError('_Link index out of range')
+        link = self
+        for _ in range(i):
+            link = link.rest
+        return link.first
+
+    def __eq__(self, other):
+        if isinstance(other, (_Link, list, tuple)):
+            return len(other) == self._len and all(
+                x == y for (x,y) in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+_nil = object.__new__(_Link)
+_nil.first = None
+_nil.rest = _nil
+_nil._len = 0
+_nil._hash = 0
+
+
+def _link(items, rest=_nil):
+    """
+    Return a _Link containing the items, followed by the items in rest.
+    If items is already a _Link and rest is empty, return it unchanged.
+    """
+    if type(items) is _Link and rest is _nil:
+        return items
+    for item in reversed(list(items)):
+        rest = _Link(item, rest)
+    return rest
+
+
+def _plan_list(plan):
+    "Convert a plan that is stored in reverse order as a _Link, to a list"
+    actions = list(plan)
+    actions.reverse()
+    return actions
+
+
+def _todo_hash(todo_list):
+    """
+    Return a hash of the items in todo_list, which must be a _Link. Each
+    link caches the hash of the list that starts there, so this takes time
+    proportional to the number of links that haven't been hashed before.
+    """
+    unhashed = []
+    link = todo_list
+    while link._hash == None:
+        unhashed.append(link)
+        link = link.rest
+    h = link._hash
+    for link in reversed(unhashed):
+        try:
+            x = hash(link.first)
+        except TypeError:
+            # the item contains a list, dict, or some other unhashable value
+            x = hash(_freeze(link.first))
+        h = link._hash = hash((x, h))
+    return h
+
+
+############################################################
+# Nogood caches
+#
+# Depth-first search can reach the same subproblem -- the same state and the
+# same remaining todo list -- along several paths. If the first attempt at it
+# failed, so will every later one. A NogoodCache remembers the subproblems
+# that find_plan has proven to be unsolvable, i.e., the choice points whose
+# methods have all been tried and failed, so that find_plan can backtrack as
+# soon as it reaches one of them again.
+
+
+class NogoodCache():
+    """
+    nc = NogoodCache(max_bytes) creates a nogood cache for find_plan, which
+    remembers each subproblem (state, todo_list) that find_plan has found to
+    be unsolvable. To use it, call find_plan(state, todo_list, nogoods=nc),
+    or use nogoods=True to have find_plan create one. find_plan empties the
+    cache when it starts, so the cache is valid only within a single call.
+
+    A subproblem is identified by state.fingerprint() and a hash of the todo
+    list; two different subproblems get the same key with probability about
+    2**-128. When the memory would exceed max_bytes (default 64 MB), the
+    least recently used entry is forgotten. That can't make find_plan miss
+    a plan, but it may search the forgotten subproblem again.
+
+    The cache assumes that actions and methods depend only on their
+    arguments and the state, which is also what backtracking assumes.
+    After a search, nc.stats() returns a dictionary of statistics about it.
+    """
+
+    # approximate bytes per entry, measured with tracemalloc
+    _ENTRY_BYTES = 240
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = (64 << 20) if max_bytes == None else max_bytes
+        self.clear()
+
+    def __repr__(self):
+        return f"NogoodCache(max_bytes={self.max_bytes})"
+
+    def clear(self):
+        "Forget all of the entries, and reset the statistics"
+        self._table = collections.OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.entries = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def _key(self, state, todo_list):
+        return _subproblem_key(state, todo_list)
+
+    def _failed(self, key):
+        "Return True if the subproblem whose key is key is known to fail"
+        self.lookups += 1
+        table = self._table
+        if key in table:
+            self.hits += 1
+            table.move_to_end(key)
+            return True
+        return False
+
+    def _add(self, key):
+        "Record that the subproblem whose key is key fails"
+        table = self._table
+        if key in table:
+            return
+        table[key] = True
+        self.entries += 1
+        self.bytes += self._ENTRY_BYTES
+        while self.bytes > self.max_bytes and table:
+            table.popitem(last=False)
+            self.bytes -= self._ENTRY_BYTES
+            self.entries -= 1
+            self.evictions += 1
+
+    def stats(self):
+        "Return a dictionary of statistics about the nogood cache"
+        return {'lookups': self.lookups,
+                'hits': self.hits,
+                'entries': self.entries,
+                'evictions': self.evictions,
+                'bytes': self.bytes}
+
+
+def _subproblem_key(state, todo_list):
+    "Return a key that identifies the subproblem (state, todo_list)"
+    return (state.fingerprint(), len(todo_list), _todo_hash(todo_list))
+
+
+def _nogood_cache(nogoods):
+    "Return an empty NogoodCache if nogoods is True, or None if it's false"
+    if isinstance(nogoods, NogoodCache):
+        nogoods.clear()
+        return nogoods
+    return NogoodCache() if nogoods else None
+
+
+############################################################
+# Search budgets
+#
+# A planner that is given a Budget charges each node expansion to it, and
+# gives up when any of the budget's limits is reached. In that case it
+# returns a BudgetExhausted object rather than False, since False means
+# that the planner searched the entire search space without finding a plan.
+
+
+class BudgetExhausted():
+    """
+    The value that find_plan, find_plan_GBFS, and find_plan_a_star return
+    if their budget runs out before they find a plan. Like False, it is
+    false in a boolean context, but it isn't equal to False. Attributes:
+     - reason is 'expansions', 'time', 'frontier_bytes', or 'cancelled';
+     - expansions is the number of nodes that were expanded;
+     - seconds is the time the search took;
+     - frontier_bytes is the largest frontier size estimate (see Budget),
+       or None if max_frontier_bytes wasn't given.
+    """
+
+    def __init__(self, reason, expansions, seconds, frontier_bytes):
+        self.reason = reason
+        self.expansions = expansions
+        self.seconds = seconds
+        self.frontier_bytes = frontier_bytes
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"BudgetExhausted({self.reason!r}, " + \
+            f"expansions={self.expansions}, seconds={self.seconds:.3f})"
+
+
+class Budget():
+    """
+    b = Budget(max_expansions, time_limit, deadline, max_frontier_bytes,
+    cancel_event) creates a budget for find_plan, find_plan_best_first,
+    find_plan_GBFS, or find_plan_a_star; pass it as the planner's budget
+    argument. Each limit is optional:
+     - max_expansions is the maximum number of nodes to expand;
+     - time_limit is the maximum number of seconds to search;
+     - deadline is a time.time() value at which to stop searching;
+     - max_frontier_bytes is the maximum estimated size of the frontier
+       (the stack of choice points in find_plan, or the priority queue in
+       find_plan_GBFS and find_plan_a_star). The estimate is the number of
+       nodes in the frontier times the size of the initial state, so it
+       is too high if the states share memory (see copy_on_write and
+       PersistentState). With undo_trail, find_plan's choice points share
+       a single state, so only the choice points themselves are counted.
+     - cancel_event is an object with an is_set method, such as a
+       threading.Event or multiprocessing.Event. The search stops soon
+       after it is set. b.cancel() does the same thing from another thread.
+
+    The limits apply to each search separately: the planner resets the
+    counters when it starts. Afterward, b.expansions is the number of nodes
+    that the search expanded, and b.exhausted is the BudgetExhausted object
+    if the budget ran out, or None otherwise.
+    """
+
+    # approximate bytes for a search node or choice point, not counting
+    # its state
+    _NODE_BYTES = 200
+
+    def __init__(self, max_expansions=None, time_limit=None, deadline=None,
+                 max_frontier_bytes=None, cancel_event=None):
+        self.max_expansions = max_expansions
+        self.time_limit = time_limit
+        self.deadline = deadline
+        self.max_frontier_bytes = max_frontier_bytes
+        self.cancel_event = cancel_event
+        self.expansions = 0
+        self.frontier_bytes = None
+        self.exhausted = None
+        self._cancelled = False
+        self._start_time = None
+        self._stop_time = None
+        self._node_bytes = self._NODE_BYTES
+
+    def __repr__(self):
+        return f"Budget(max_expansions={self.max_expansions}, " + \
+            f"time_limit={self.time_limit}, deadline={self.deadline}, " + \
+            f"max_frontier_bytes={self.max_frontier_bytes})"
+
+    def cancel(self):
+        "Make the search that is using this budget stop as soon as it can"
+        self._cancelled = True
+
+    def _start(self, state, shared_state=False):
+        """
+        Reset the counters at the start of a search from state. If
+        shared_state is True, the frontier's nodes don't each have a copy
+        of the state.
+        """
+        now = time.monotonic()
+        self.expansions = 0
+        self.exhausted = None
+        self._start_time = now
+        self._stop_time = None
+        if self.time_limit != None:
+            self._stop_time = now + self.time_limit
+        if self.deadline != None:
+            stop = now + (self.deadline - time.time())
+            if self._stop_time == None or stop < self._stop_time:
+                self._stop_time = stop
+        if self.max_frontier_bytes != None:
+            self.frontier_bytes = 0
+            self._node_bytes = self._NODE_BYTES
+            if not shared_state:
+                self._node_bytes += _approx_size(state)
+
+    def _charge(self, frontier_size):
+        """
+        Charge one node expansion to the budget. Return None if there's
+        budget left, otherwise a BudgetExhausted object.
+        """
+        self.expansions += 1
+        if self.max_expansions != None and \
+                self.expansions > self.max_expansions:
+            self.expansions -= 1
+            return self._exhausted('expansions')
+        if self._stop_time != None and time.monotonic() >= self._stop_time:
+            return self._exhausted('time')
+        if self.max_frontier_bytes != None:
+            size = frontier_size * self._node_bytes
+            if size > self.frontier_bytes:
+                self.frontier_bytes = size
+            if size > self.max_frontier_bytes:
+                return self._exhausted('frontier_bytes')
+        if self._cancelled or \
+                (self.cancel_event != None and self.cancel_event.is_set()):
+            return self._exhausted('cancelled')
+        return None
+
+    def _exhausted(self, reason):
+        self.exhausted = BudgetExhausted(reason, self.expansions, \
+                   time.monotonic() - self._start_time, self.frontier_bytes)
+        return self.exhausted
+
+
+def _approx_size(x):
+    "Return a rough estimate of the number of bytes used by a state or value"
+    size = sys.getsizeof(x)
+    if isinstance(x, State):
+        for (varname,val) in _state_var_items(x):
+            size += _approx_size(val)
+    elif isinstance(x, collections.abc.Mapping):
+        for (key,val) in x.items():
+            size += sys.getsizeof(key) + _approx_size(val)
+    elif type(x) in {list, tuple, set, frozenset, _CowList}:
+        for val in x:
+            size += _approx_size(val)
+    return size
+
+
+############################################################
+# Search statistics
+#
+# A planner that is given a SearchStats object counts what it does in it.
+# The counting is done only if there's a SearchStats object, and costs a
+# few dictionary updates and time.perf_counter calls per node, so it's
+# cheap enough to leave on. Calls to the domain's actions and methods, and
+# to the heuristic function, go through SearchStats's _apply, _try, and
+# _estimate methods, which time them.
+
+
+class SearchStats():
+    """
+    ss = SearchStats() creates an object for collecting statistics about a
+    search. To use it, pass it as the stats argument of find_plan,
+    iter_plans, find_cheapest_plan, iter_improving_plans, find_plan_bnb,
+    find_plan_best_first, find_plan_GBFS, find_plan_a_star, their
+    asynchronous versions, find_plan_parallel, or find_plans_batch. The
+    planner resets the statistics when it starts. Afterward:
+     - ss.expanded is the number of nodes that were expanded, and
+       ss.generated is the number of nodes produced by applying actions
+       and methods to them (including duplicates);
+     - ss.method_attempts and ss.method_failures are Counters that map
+       each method name to the number of times the method was called and
+       the number of times it wasn't applicable;
+     - ss.action_attempts and ss.action_failures are likewise for actions;
+     - ss.backtracks is the number of times find_plan's depth-first search
+       went back to an earlier choice point. For find_plan_GBFS and
+       find_plan_a_star, it's the number of times the next node expanded
+       wasn't one level deeper than the one before;
+     - ss.max_depth is the largest depth of an expanded node, and
+       ss.max_frontier is the largest number of choice points on
+       find_plan's stack or nodes in find_plan_GBFS's priority queue;
+     - ss.duplicates is the number of nodes that were pruned because the
+       nogood cache or the closed set had already seen them, or because
+       they were the same as a node above them on find_plan's stack;
+     - ss.seconds is the time the search took, and ss.domain_seconds and
+       ss.heuristic_seconds are the parts of it spent in the domain's
+       actions and methods, and in the heuristic function.
+    ss.stats() returns all of these as a dictionary, with the rest of the
+    time as 'engine_seconds'. For find_plan_parallel and find_plans_batch,
+    the counts and times are the sums over the searches that the worker
+    processes did (so ss.seconds may be more than the elapsed time), and
+    max_depth and max_frontier are the largest of theirs.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def __repr__(self):
+        return f"SearchStats(expanded={self.expanded}, " + \
+            f"generated={self.generated}, seconds={self.seconds:.3f})"
+
+    def clear(self):
+        "Reset the statistics"
+        self.expanded = 0
+        self.generated = 0
+        self.method_attempts = collections.Counter()
+        self.method_failures = collections.Counter()
+        self.action_attempts = collections.Counter()
+        self.action_failures = collections.Counter()
+        self.backtracks = 0
+        self.max_depth = 0
+        self.max_frontier = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+        self.domain_seconds = 0.0
+        self.heuristic_seconds = 0.0
+
+    def _expand(self, depth, frontier_size):
+        "Record the expansion of a node"
+        self.expanded += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if frontier_size > self.max_frontier:
+            self.max_frontier = frontier_size
+
+    def _apply(self, action, state, task1):
+        "Apply action to state and the arguments in task1, and record it"
+        name = task1[0]
+        self.action_attempts[name] += 1
+        start = time.perf_counter()
+        newstate = action(state,*task1[1:])
+        self.domain_seconds += time.perf_counter() - start
+        if newstate:
+            self.generated += 1
+        else:
+            self.action_failures[name] += 1
+        return newstate
+
+    def _try(self, method, state, *args):
+        "Call method on state and args, and record it"
+        name = method.__name__
+        self.method_attempts[name] += 1
+        start = time.perf_counter()
+        result = method(state,*args)
+        self.domain_seconds += time.perf_counter() - start
+        if result != False and result != None:
+            self.generated += 1
+        else:
+            self.method_failures[name] += 1
+        return result
+
+    def _add(self, other):
+        "Add the statistics in other (e.g., from a worker process) to self"
+        self.expanded += other.expanded
+        self.generated += other.generated
+        self.method_attempts.update(other.method_attempts)
+        self.method_failures.update(other.method_failures)
+        self.action_attempts.update(other.action_attempts)
+        self.action_failures.update(other.action_failures)
+        self.backtracks += other.backtracks
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.max_frontier = max(self.max_frontier, other.max_frontier)
+        self.duplicates += other.duplicates
+        self.seconds += other.seconds
+        self.domain_seconds += other.domain_seconds
+        self.heuristic_seconds += other.heuristic_seconds
+
+    def _estimate(self, h, state, todo_list):
+        "Call the heuristic function h, and record the time it took"
+        start = time.perf_counter()
+        value = h(state, todo_list)
+        self.heuristic_seconds += time.perf_counter() - start
+        return value
+
+    def stats(self):
+        "Return a dictionary of the statistics"
+        return {'expanded': self.expanded,
+                'generated': self.generated,
+                'method_attempts': dict(self.method_attempts),
+                'method_failures': dict(self.method_failures),
+                'action_attempts': dict(self.action_attempts),
+                'action_failures': dict(self.action_failures),
+                'backtracks': self.backtracks,
+                'max_depth': self.max_depth,
+                'max_frontier': self.max_frontier,
+                'duplicates': self.duplicates,
+                'seconds': self.seconds,
+                'engine_seconds': self.seconds - self.domain_seconds \
+                                  - self.heuristic_seconds,
+                'domain_seconds': self.domain_seconds,
+                'heuristic_seconds': self.heuristic_seconds}
+
+
+def _search_stats(stats):
+    "Reset stats at the start of a search, if there is one, and return it"
+    if stats != None:
+        stats.clear()
+    return stats
+
+
+def _timed_steps(steps, stats):
+    """
+    A generator that yields what the generator steps yields and returns
+    what it returns, adding the time that steps runs to stats.seconds.
+    """
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(steps)
+        except StopIteration as stop:
+            stats.seconds += time.perf_counter() - start
+            return stop.value
+        stats.seconds += time.perf_counter() - start
+        yield item
+
+
+############################################################
+# Tracing
+#
+# A planner that is given a Tracer calls the tracer's methods to report
+# what it's doing: expanding a node, trying a method, applying an action,
+# backtracking, and so forth. Each call is preceded by a test of whether
+# there's a tracer, so a search without one costs nothing extra, and the
+# search loops don't build any strings. The planners' verbose output at
+# levels 2 and 3 is produced by VerboseTracer; if verbose >= 2 and no
+# tracer is given, the planner uses VerboseTracer(verbose). TraceRecorder
+# writes the search tree to a file, with timings, for viewing in Perfetto.
+# PathProfiler adds up the time spent on each decomposition path, for
+# viewing as a flame graph.
+
+
+class Tracer():
+    """
+    The base class for tracers. To write a tracer, define a subclass that
+    overrides the methods for the events you want to know about, and pass
+    an instance of it as the tracer argument of find_plan, iter_plans,
+    find_cheapest_plan, iter_improving_plans, find_plan_bnb,
+    find_plan_best_first, find_plan_GBFS, find_plan_a_star, or their
+    asynchronous versions. The best-first planners are the last three. The
+    methods are:
+     - on_start(planner, state, todo_list): planner (the name of the
+       planning function) is starting a search;
+     - on_expand(depth, state, todo_list, heuristic): the search is
+       expanding a node at the given depth. For the best-first planners,
+       heuristic is the node's priority in the priority queue; otherwise
+       it's None;
+     - on_generate(depth, state, todo_list, heuristic): a best-first
+       planner has put a new node into its priority queue. This
+       happens right after the on_method or on_action call for the method
+       or action that produced the node;
+     - on_choice(depth, kind, todo1, methods): the first item of the todo
+       list, todo1, is a task, goal, or multigoal (kind is 'task', 'goal',
+       or 'multigoal'), and methods are its relevant methods. If todo1 is
+       a goal that's already achieved, methods is None;
+     - on_method_try(depth, kind, todo1, method): method is about to be
+       tried on todo1;
+     - on_method(depth, kind, todo1, method, result, heuristic, duplicate):
+       the method returned result, which is False or None if the method
+       isn't applicable. For the best-first planners, duplicate is True if
+       the closed set already had the new node, and otherwise heuristic is
+       h's value for the new node;
+     - on_verify(depth, method_name, goal): the verification task after
+       the subgoals of the method named method_name, which was applied at
+       the given depth, found that the method achieved goal (a goal
+       (state_var_name, arg, val) or a multigoal). This happens right
+       before the on_method call for the verification method;
+     - on_action_try(depth, action): action is about to be applied;
+     - on_action(depth, action, newstate, heuristic, duplicate): applying
+       action produced newstate, which is false if the action isn't
+       applicable. heuristic and duplicate are as in on_method;
+     - on_backtrack(depth, kind, todo1, methods): in a depth-first search,
+       none of the methods for todo1 led to a plan, so the search goes back
+       to an earlier choice point;
+     - on_nogood(depth): the nogood cache says that the node fails;
+     - on_cycle(depth): in a depth-first search with cycle_check=True, the
+       node has the same state and todo list as a node above it, so it
+       fails;
+     - on_prune(depth, cost, best): in a branch-and-bound search, the node's
+       cost can't beat the best plan's cost;
+     - on_budget_exhausted(depth, exhausted): the budget ran out, and
+       exhausted is the BudgetExhausted object;
+     - on_solution(depth): the todo list is empty, so the search has found
+       a plan;
+     - on_finish(result): the search has finished, and result is what the
+       planner returns. For iter_plans and iter_improving_plans, this
+       happens only if the generator runs to the end, and result is False
+       or the BudgetExhausted object.
+    run_lazy_lookahead also takes a tracer, which it gives to find_plan.
+    Between searches, it calls
+     - on_command_try(state, command, args): command (a function) is about
+       to be executed in state with the arguments args;
+     - on_command(command, args, newstate): executing command produced
+       newstate, which is false if the command failed.
+    """
+
+    def on_start(self, planner, state, todo_list):
+        pass
+
+    def on_expand(self, depth, state, todo_list, heuristic=None):
+        pass
+
+    def on_generate(self, depth, state, todo_list, heuristic):
+        pass
+
+    def on_choice(self, depth, kind, todo1, methods):
+        pass
+
+    def on_method_try(self, depth, kind, todo1, method):
+        pass
+
+    def on_method(self, depth, kind, todo1, method, result, heuristic=None,
+                  duplicate=False):
+        pass
+
+    def on_verify(self, depth, method_name, goal):
+        pass
+
+    def on_action_try(self, depth, action):
+        pass
+
+    def on_action(self, depth, action, newstate, heuristic=None,
+                  duplicate=False):
+        pass
+
+    def on_backtrack(self, depth, kind, todo1, methods):
+        pass
+
+    def on_nogood(self, depth):
+        pass
+
+    def on_cycle(self, depth):
+        pass
+
+    def on_prune(self, depth, cost, best):
+        pass
+
+    def on_budget_exhausted(self, depth, exhausted):
+        pass
+
+    def on_solution(self, depth):
+        pass
+
+    def on_finish(self, result):
+        pass
+
+    def on_command_try(self, state, command, args):
+        pass
+
+    def on_command(self, command, args, newstate):
+        pass
+
+
+# The planners that do best-first searches, in which the nodes below a node
+# aren't expanded right after it
+_best_first_planners = ('find_plan_best_first', 'find_plan_GBFS',
+                        'find_plan_a_star', 'seek_plan_GBFS',
+                        'seek_plan_a_star')
+
+
+class VerboseTracer(Tracer):
+    """
+    VerboseTracer(verbose) is a tracer that prints what the planners print
+    when verbose is 2 or 3: if verbose = 2, a message for each node that's
+    expanded, and if verbose = 3, also info about what it's computing.
+    """
+
+    def __init__(self, verbose=3):
+        self.verbose = verbose
+        # find_plan_GBFS and find_plan_a_star print some things differently
+        self._best_first = False
+
+    def __repr__(self):
+        return f"VerboseTracer({self.verbose})"
+
+    def on_start(self, planner, state, todo_list):
+        self._best_first = planner in _best_first_planners
+
+    def on_expand(self, depth, state, todo_list, heuristic=None):
+        if self.verbose >= 2: 
+            todo_list_str =     \
+                    '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
+            if heuristic == None:
+                print(f'depth {depth} todo_list ' + todo_list_str)
+            else:
+                print(f'depth {depth} todo_list ' + todo_list_str + f' popped with heuristic {heuristic}')
+
+    def on_choice(self, depth, kind, todo1, methods):
+        if self.verbose < 3:
+            return
+        if kind == 'task':
+            print(f'depth {depth} task {todo1}: look for a task method')
+        elif kind == 'goal':
+            print(f'depth {depth} goal {todo1}: look for a goal method')
+            if methods == None:
+                print(f'depth {depth} goal {todo1} is already achieved')
+                return
+        else:
+            print(f'depth {depth} multigoal {todo1}:', \
+                  f'look for a multigoal method')
+        print(f'depth {depth} {kind} {todo1} methods {[m.__name__ for m in methods]}')
+
+    def on_method_try(self, depth, kind, todo1, method):
+        if self.verbose >= 3:
+            word = 'goal' if kind == 'goal' else 'task'
+            print(f'depth {depth} {word} {todo1}: trying method {method.__name__}')
+
+    def on_method(self, depth, kind, todo1, method, result, heuristic=None,
+                  duplicate=False):
+        if self.verbose < 3:
+            return
+        name = method.__name__
+        if result == False or result == None:
+            if kind == 'multigoal':
+                print(f'depth {depth} multigoal_method {name}', \
+                      f'not applicable')
+            else:
+                print(f'depth {depth}', f'{kind}_method {name} not applicable')
+        elif kind == 'task':
+            if duplicate:
+                print(f'depth {depth} task_method {name}', \
+                      f'subtasks: {result} repeated, not put into queue')
+            elif heuristic != None:
+                print(f'depth {depth} task_method {name}', \
+                      f'subtasks: {result} put into queue with heuristic {heuristic}')
+            else:
+                print(f'depth {depth} task_method {name}', \
+                      f'subtasks: {result}')
+        else:
+            word = 'goal_method' if kind == 'goal' else 'multigoal_method'
+            if duplicate:
+                print(f'depth {depth} {word} {name}', \
+                      f'subgoals: {result} repeated, not put into queue')
+            elif heuristic != None:
+                print(f'depth {depth} {word} {name}', \
+                      f'subgoals: {result} put into queue with heuristic {heuristic}')
+            else:
+                print(f'depth {depth} {word} {name}', f'subgoals: {result}')
+
+    def on_verify(self, depth, method_name, goal):
+        if self.verbose < 3:
+            return
+        if isinstance(goal, Multigoal):
+            print(f"depth {depth}: method {method_name} achieved {goal}")
+        else:
+            (state_var_name, arg, val) = goal
+            print(f"depth {depth}: method {method_name} achieved",
+                  f"goal {state_var_name}[{arg}] = {val}")
+
+    def on_action_try(self, depth, action):
+        if self.verbose >= 3: print(f'depth {depth} action {action}: apply action')
+
+    def on_action(self, depth, action, newstate, heuristic=None,
+                  duplicate=False):
+        if self.verbose < 3:
+            return
+        if duplicate:
+            print(f'depth {depth}', end=' ')
+            print(repr(newstate) + ' repeated, not put into queue')
+        elif heuristic != None:
+            print(f'depth {depth}', end=' ')
+            print(repr(newstate) + ' with heuristic ' + str(heuristic))
+        elif not self._best_first:
+            print(f'depth {depth}', end=' ')
+            print(repr(newstate))
+        if not newstate:
+            print(f'depth {depth} action {action} not applicable')
+
+    def on_backtrack(self, depth, kind, todo1, methods):
+        if self.verbose < 3:
+            return
+        if kind == 'task':
+            print(f'depth {depth} could not accomplish task {todo1}')        
+        elif kind == 'goal':
+            name = methods[-1].__name__ if methods else None
+            print(f'depth {depth} goal_method {name}', \
+                  f'could not achieve goal {todo1}')        
+        else:
+            print(f'depth {depth} could not achieve multigoal {todo1}')        
+
+    def on_nogood(self, depth):
+        if self.verbose >= 3:
+            print(f'depth {depth} nogood: this state and todo_list', \
+                  f'have already failed')
+
+    def on_cycle(self, depth):
+        if self.verbose >= 3:
+            print(f'depth {depth} cycle: this state and todo_list', \
+                  f'are already on the current path')
+
+    def on_prune(self, depth, cost, best):
+        if self.verbose >= 3:
+            print(f'depth {depth} cost {cost} can\'t beat', \
+                  f'best cost {best}, backtrack')
+
+    def on_budget_exhausted(self, depth, exhausted):
+        if self.verbose >= 3:
+            print(f'depth {depth} budget exhausted: {exhausted}')
+
+    def on_solution(self, depth):
+        if self.verbose >= 3:
+            print(f'depth {depth} no more tasks or goals, return plan')
+
+    def on_command_try(self, state, command, args):
+        if self.verbose >= 3:
+            print(f"_apply_command: state = {state.__name__},", \
+                  f"command = {command.__name__}, args = {args}")
+
+    def on_command(self, command, args, newstate):
+        if self.verbose < 3:
+            return
+        if newstate:
+            print(f"_apply_command: {command.__name__}", \
+                  f"returns state {newstate.__name__}")
+        else:
+            print(f"_apply_command: {command.__name__} not applicable")
+
+
+class TraceRecorder(Tracer):
+    """
+    TraceRecorder(file, format='jsonl') is a tracer that writes an event to
+    file for each node that a search expands and each method or action that
+    it tries, so that the search can be examined afterward. file is a file
+    name or a writable file object, and format is 'jsonl' or 'chrome':
+     - If format is 'jsonl', each event is a line containing a JSON object.
+     - If format is 'chrome', the file is a JSON array in the Chrome trace
+       event format, which can be loaded into Perfetto (ui.perfetto.dev) or
+       chrome://tracing.
+    Each event has a category ('search', 'node', 'method', or 'action'), a
+    name (the planner's name, the first item of the node's todo list, or
+    the method's or action's name), an id, the id of its parent event, the
+    depth, and a start time and duration in microseconds. The parent of a
+    search's first node is the search, the parent of a method or action is
+    the node it was tried in, and the parent of any other node is the
+    method or action that produced it (or the node before it, if it was
+    produced by removing an already-achieved goal).
+
+    In a depth-first search (find_plan, iter_plans, and so forth), an event
+    lasts until the search leaves everything below it, so its duration is
+    the time spent in that part of the search tree and the events nest in
+    Perfetto's display. In find_plan_GBFS and find_plan_a_star, the nodes
+    below a node are expanded at different times, so the duration of a node
+    is just the time spent expanding it; use the parent ids to find how
+    much time went into the nodes below it.
+
+    The events are written as the search goes. There are also instantaneous
+    events ('solution', 'nogood', 'cycle', 'prune', and 'budget') with a node as
+    their parent. A TraceRecorder can be used for several searches; call
+    its close method after the last one.
+    """
+
+    def __init__(self, file, format='jsonl'):
+        if format not in ('jsonl', 'chrome'):
+            raise Exception(f"TraceRecorder: format '{format}' isn't " + \
+                            "'jsonl' or 'chrome'")
+        self.format = format
+        if isinstance(file, str):
+            self.file = open(file, 'w')
+            self._own_file = True
+        else:
+            self.file = file
+            self._own_file = False
+        self.events = 0         # the number of events written
+        self._next_id = 0
+        self._origin = time.perf_counter()
+        # Unfinished events, as [key, id, parent, category, name, start,
+        # args] lists. In a depth-first search, key is (depth, 0) for a
+        # node and (depth, 1) for a method or action; in a best-first
+        # search, depth is replaced by 0.
+        self._open = []
+        self._best_first = False
+        # in a best-first search, the ids of the methods or actions that
+        # produced the nodes in the priority queue, and of the last one
+        self._pending = {}
+        self._producer = None
+        if format == 'chrome':
+            self.file.write('[')
+
+    def __repr__(self):
+        return f"TraceRecorder({self.format}, events={self.events})"
+
+    def _now(self):
+        return (time.perf_counter() - self._origin) * 1000000
+
+    def _begin(self, key, category, name, args):
+        "Start an event, ending the ones that it follows, and return its id"
+        now = self._now()
+        self._end(key, now)
+        parent = self._open[-1][1] if self._open else None
+        self._next_id += 1
+        self._open.append([key, self._next_id, parent, category, name, \
+                           now, args])
+        return self._next_id
+
+    def _end(self, key, now):
+        "End the unfinished events whose keys are >= key"
+        while self._open and self._open[-1][0] >= key:
+            (_, number, parent, category, name, start, args) = \
+                self._open.pop()
+            self._write(category, name, number, parent, start, \
+                        now - start, args)
+
+    def _instant(self, category, args):
+        parent = self._open[-1][1] if self._open else None
+        self._next_id += 1
+        self._write(category, category, self._next_id, parent, self._now(), \
+                    None, args)
+
+    def _write(self, category, name, number, parent, start, duration, args):
+        if self.format == 'jsonl':
+            event = {'cat': category, 'name': name, 'id': number, \
+                     'parent': parent, 'ts': round(start, 3)}
+            if duration != None:
+                event['dur'] = round(duration, 3)
+            event.update(args)
+            self.file.write(json.dumps(event, default=str) + '\n')
+        else:
+            event = {'name': name, 'cat': category, 'pid': 1, 'tid': 1, \
+                     'ts': round(start, 3)}
+            if duration != None:
+                event['ph'] = 'X'
+                event['dur'] = round(duration, 3)
+            else:
+                event['ph'] = 'i'
+                event['s'] = 't'
+            event['args'] = dict(args, id=number, parent=parent)
+            if self.events > 0:
+                self.file.write(',\n')
+            self.file.write(json.dumps(event, default=str))
+        self.events += 1
+
+    def _key(self, depth, i):
+        return (0, i) if self._best_first else (depth, i)
+
+    def on_start(self, planner, state, todo_list):
+        self._end((-1, 0), self._now())
+        self._best_first = planner in _best_first_planners
+        self._pending = {}
+        self._producer = None
+        self._begin((-1, 0), 'search', planner, {})
+
+    def on_expand(self, depth, state, todo_list, heuristic=None):
+        name = _todo_to_string(todo_list.first) if todo_list else '[]'
+        args = {'depth': depth}
+        if heuristic != None:
+            args['heuristic'] = heuristic
+        if self._best_first:
+            self._end((0, 0), self._now())
+            producer = self._pending.pop((id(state), id(todo_list)), None)
+            self._begin((0, 0), 'node', name, args)
+            if producer != None:
+                self._open[-1][2] = producer
+        else:
+            self._begin((depth, 0), 'node', name, args)
+
+    def on_generate(self, depth, state, todo_list, heuristic):
+        self._pending[(id(state), id(todo_list))] = self._producer
+
+    def on_method_try(self, depth, kind, todo1, method):
+        self._begin(self._key(depth, 1), 'method', method.__name__, \
+                    {'depth': depth})
+
+    def on_method(self, depth, kind, todo1, method, result, heuristic=None,
+                  duplicate=False):
+        self._finish_call(depth, result != False and result != None, \
+                          heuristic, duplicate)
 
+    def on_action_try(self, depth, action):
+        self._begin(self._key(depth, 1), 'action', _todo_to_string(action), \
+                    {'depth': depth})
 
-def m_split_goals(state,multigoal):
-    """
-    m_split_goals is the only multigoal method that Pyhop 2 provides, and
-    Pyhop 2 won't use it unless the user declares it explicitly in a call
-    to pyhop2.declare_multigoal_methods.
-    
-    m_split_goals takes two arguments: the current state and a multigoal
-    to achieve. m_split_goals separates the multigoal into a collection of
-    individual goals. Then it repeatedly iterates through the list of
-    individual goals, trying to achieve each goal that isn't already true.
-    The purpose of the repetition is to overcome deleted-condition
-    interactions (in which accomplishing a goal has a side-effect of 
-    falsifying another goal that was previously true).
-    
-    More specifically, if one or more of the individual goals is not true,
-    then m_split_goals returns a goal list [g_1, ..., g_n, G], where
-    g_1, ..., g_n are the goals that aren't true, and G is the multigoal.
-    The list tells seek_plan to achieve g_1, ..., g_n sequentially, then
-    invoke m_split_goals again to re-achieve any goals that have become
-    false.
+    def on_action(self, depth, action, newstate, heuristic=None,
+                  duplicate=False):
+        self._finish_call(depth, bool(newstate), heuristic, duplicate)
 
-    The main problem with m_split_goals is that it isn't smart about
-    choosing the order in which to achieve g1, ..., gn. Some orderings
-    may work better than others. Thus it might be desirable to modify
-    the method to use a heuristic function to choose a good order.
-    """
-    goal_dict = _goals_not_achieved(state,multigoal)
-    goal_list = []
-    for state_var_name in goal_dict:
-        for arg in goal_dict[state_var_name]:
-            val = goal_dict[state_var_name][arg]
-            goal_list.append((state_var_name,arg,val))
-    if goal_list:
-        # achieve goals, then check whether they're all simultaneously true
-        return goal_list + [multigoal]
-    return goal_list
+    def _finish_call(self, depth, applicable, heuristic, duplicate):
+        """
+        Record the outcome of the method or action that was just tried.
+        It ends now unless the depth-first search continues below it.
+        """
+        (key, number, _, _, _, _, args) = self._open[-1]
+        args['applicable'] = applicable
+        if heuristic != None:
+            args['heuristic'] = heuristic
+        if duplicate:
+            args['duplicate'] = True
+        if self._best_first or not applicable:
+            self._end(key, self._now())
+        self._producer = number
+
+    def on_nogood(self, depth):
+        self._instant('nogood', {'depth': depth})
+
+    def on_cycle(self, depth):
+        self._instant('cycle', {'depth': depth})
+
+    def on_prune(self, depth, cost, best):
+        self._instant('prune', {'depth': depth, 'cost': cost, 'best': best})
+
+    def on_budget_exhausted(self, depth, exhausted):
+        self._instant('budget', {'depth': depth, 'reason': exhausted.reason})
+
+    def on_solution(self, depth):
+        self._instant('solution', {'depth': depth})
+
+    def on_finish(self, result):
+        if self._open:
+            args = self._open[0][6]
+            if type(result) is list:
+                args['plan_length'] = len(result)
+            else:
+                args['result'] = str(result)
+        self._end((-1, 0), self._now())
+        self.file.flush()
 
+    def close(self):
+        """
+        End any unfinished events (e.g., if iter_plans was stopped before it
+        finished) and finish the file, closing it if TraceRecorder opened it.
+        """
+        self._end((-1, 0), self._now())
+        if self.format == 'chrome':
+            self.file.write(']\n')
+        if self._own_file:
+            self.file.close()
+        else:
+            self.file.flush()
 
-# helper function for m_split_goals above:
 
-def _goals_not_achieved(state,multigoal):
+class PathProfiler(Tracer):
     """
-    _goals_not_achieved takes two arguments: a state s and a multigoal g.
-    It returns a dictionary of the goals in g that aren't true in s.
-    For example, suppose
-        s.loc['c0'] = 'room0', g.loc['c0'] = 'room0',
-        s.loc['c1'] = 'room1', g.loc['c1'] = 'room3',
-        s.loc['c2'] = 'room2', g.loc['c2'] = 'room4'.
-    Then _goals_not_achieved(s, g) will return
-        {'loc': {'c1': 'room3', 'c2': 'room4'}}    
+    pp = PathProfiler() is a tracer that measures how much time a planner
+    spends, and how many nodes it expands, along each decomposition path.
+    A decomposition path is the sequence of tasks, goals, and methods that
+    produced the item at the front of a node's todo list. An example is
+    solve_goal > multi_level_aux > pos > clear_block > move_somewhere_else:
+    task solve_goal, decomposed by method multi_level_aux into subgoals
+    including a pos goal, and so forth. Each task, action, or goal is named
+    by its first element, and each multigoal is named 'multigoal'. To use
+    pp, pass it as the tracer argument of a planner (see Tracer). It adds
+    up the results of all of the searches it's used for. Afterward:
+     - pp.stats() returns a dictionary that maps each path, as a string like
+       the one above, to the number of seconds spent there (not counting
+       the paths below it) and the number of nodes expanded there.
+     - pp.folded() returns the time in microseconds on each path in the
+       folded-stack format (a line such as 'solve_goal;multi_level_aux;pos
+       1234' for each path) that flamegraph.pl, inferno, speedscope, and
+       other flame graph tools read. pp.folded(nodes=True) does the same
+       for the numbers of nodes.
+     - pp.clear() resets the statistics.
+    The time spent in a method is attributed to a path ending with the
+    method's name, and all other time to the path of the node being
+    expanded, including the time spent in its actions and, for
+    find_plan_GBFS and find_plan_a_star, in the heuristic function.
     """
-    unachieved = {}
-    for name in vars(multigoal):
-        if name != '__name__':
-            for arg in vars(multigoal).get(name):
-                val = vars(multigoal).get(name).get(arg)
-                if val != vars(state).get(name).get(arg):
-                    # want arg_value_pairs.name[arg] = val
-                    if not unachieved.get(name):
-                        unachieved.update({name:{}})
-                    unachieved.get(name).update({arg:val})
-    return unachieved
 
+    def __init__(self):
+        self.clear()
 
-################################################################################
-# Functions to verify whether goal_method and multigoal_methods achieve the
-# goals they are supposed to achieve.
+    def __repr__(self):
+        return f"PathProfiler(paths={len(self.seconds)}, " + \
+            f"nodes={sum(self.nodes.values())})"
+
+    def clear(self):
+        "Reset the statistics"
+        # seconds and nodes map paths (tuples of names) to the statistics
+        self.seconds = collections.Counter()
+        self.nodes = collections.Counter()
+        self._path = None       # the path that time is being charged to
+        self._mark = None       # when it started being charged
+        self._clear_search()
+
+    def _clear_search(self):
+        # In a depth-first search, _stack has an entry (depth, todo_list,
+        # paths, path) for each node on the way to the current one, where
+        # paths is a _Link giving each todo_list item's decomposition path
+        # and path is the node's path. In a best-first search it has just
+        # the current node, and _pending has the paths for the nodes in
+        # the priority queue.
+        self._stack = []
+        self._pending = {}
+        self._best_first = False
+        self._method = None     # (depth, name) of the last method applied
+
+    def _charge(self, path):
+        "Charge the time since the last call to self._path; then use path"
+        now = time.perf_counter()
+        if self._path != None:
+            self.seconds[self._path] += now - self._mark
+        (self._path, self._mark) = (path, now)
+
+    def _child_paths(self, parent, todo_list):
+        """
+        Return the paths for the items of todo_list, which the parent node's
+        first todo_list item was replaced with: the paths of the items that
+        follow it in parent's todo_list, preceded by a path for each new item.
+        """
+        (_, parent_todo, parent_paths, parent_path) = parent
+        k = len(todo_list) - len(parent_todo) + 1
+        if k <= 0:
+            return parent_paths.rest
+        if self._method != None and self._method[0] == parent[0]:
+            path = parent_path + (self._method[1],)
+        else:
+            path = parent_path
+        return _link([path] * k, parent_paths.rest)
+
+    def on_start(self, planner, state, todo_list):
+        self._charge(None)
+        self._clear_search()
+        self._best_first = planner in _best_first_planners
+
+    def on_expand(self, depth, state, todo_list, heuristic=None):
+        if self._best_first:
+            paths = self._pending.pop((id(state), id(todo_list)), None)
+            self._stack = []
+        else:
+            while self._stack and self._stack[-1][0] >= depth:
+                self._stack.pop()
+            if self._stack and self._stack[-1][0] == depth - 1:
+                paths = self._child_paths(self._stack[-1], todo_list)
+            else:
+                paths = None
+        if paths == None:
+            paths = _link([()] * len(todo_list))
+        if todo_list:
+            path = paths.first + (_path_name(todo_list.first),)
+            self.nodes[path] += 1
+            self._charge(path)
+        else:
+            path = ()
+        self._stack.append((depth, todo_list, paths, path))
+
+    def on_generate(self, depth, state, todo_list, heuristic):
+        self._pending[(id(state), id(todo_list))] = \
+            self._child_paths(self._stack[-1], todo_list)
+
+    def on_method_try(self, depth, kind, todo1, method):
+        while len(self._stack) > 1 and self._stack[-1][0] > depth:
+            self._stack.pop()
+        self._charge(self._stack[-1][3] + (method.__name__,))
+
+    def on_method(self, depth, kind, todo1, method, result, heuristic=None,
+                  duplicate=False):
+        self._charge(self._stack[-1][3])
+        if result != False and result != None:
+            self._method = (depth, method.__name__)
+
+    def on_solution(self, depth):
+        # don't charge the time until the search resumes (e.g., in
+        # iter_plans) to anything
+        self._charge(None)
+
+    def on_finish(self, result):
+        self._charge(None)
+
+    def stats(self):
+        "Return a dictionary of the statistics for each path"
+        paths = sorted(set(self.seconds) | set(self.nodes))
+        return {' > '.join(path): {'seconds': self.seconds[path], \
+                                   'nodes': self.nodes[path]} \
+                for path in paths}
+
+    def folded(self, nodes=False):
+        """
+        Return the statistics in folded-stack format: the time in
+        microseconds on each path, or if nodes is True, the number of nodes.
+        """
+        if nodes:
+            counts = self.nodes
+        else:
+            counts = {path: round(seconds * 1000000) \
+                      for (path, seconds) in self.seconds.items()}
+        return ''.join(f"{';'.join(path)} {n}\n" \
+                       for (path, n) in sorted(counts.items()) if n > 0)
 
 
-_verify_goals = True
+def _path_name(todo1):
+    "The name of todo1 in a PathProfiler's decomposition paths"
+    if isinstance(todo1, Multigoal):
+        return 'multigoal'
+    return str(todo1[0])
 
 
-def verify_goals(boolean=None):
+def _tracer(tracer, verbose, planner, state, todo_list):
     """
-    If boolean is True, then whenever the planner uses a method m to refine
-    a goal or multigoal, it will insert a "verification" task into the
-    current partial plan. If boolean is False, the planner won't insert
-    any verification tasks into the plan. If verify_goals is call with no
-    argument, it will return the current value of boolean.
-    
-    The purpose of the verification task is to raise an exception if the
-    refinement produced by m doesn't achieve the goal or multigoal that it
-    is supposed to achieve. This won't insert anything into the final plan;
-    it just will verify whether m did what it was supposed to do.
+    Return the tracer for a search that planner is starting: tracer if
+    there is one, otherwise a VerboseTracer if verbose >= 2, otherwise None.
+    Tell the tracer that the search is starting.
     """
-    global _verify_goals
-    if boolean != None:
-        _verify_goals = boolean
-    return _verify_goals
+    if tracer == None and verbose >= 2:
+        tracer = VerboseTracer(verbose)
+    if tracer != None:
+        tracer.on_start(planner, state, todo_list)
+    return tracer
+
 
+############################################################
+# The planning algorithm
 
 
-def _m_verify_g(state, method_name, state_var_name, arg, desired_val, \
-        depth, verbose=0):
+def find_plan(state, todo_list, verbose=0, nogoods=None, budget=None,
+              stats=None, tracer=None, cycle_check=False):
     """
-    Pyhop 2 uses this method to check whether a goal_method has achieved the
-    goal that it promised to achieve.
+    find_plan tries to find a plan that accomplishes the items in todo_list,
+    starting from the given state, using whatever methods and actions you 
+    declared previously. If successful, it returns the plan. Otherwise it
+    returns False. Arguments:
+     - 'state' is a state;
+     - 'todo_list' is a list to-dos (tasks, goals, and multigoals);
+     - verbose = 0, 1, 2, or 3 indicates how much debugging info to print:
+        - if verbose = 0 (the default), it prints nothing;
+        - if verbose = 1, it prints the initial parameters and the answer;
+        - if verbose = 2, it also prints a message on each recursive call;
+        - if verbose = 3, it also prints info about what it's computing.
+       The messages at levels 2 and 3 come from a VerboseTracer.
+     - nogoods is True or a NogoodCache, to keep find_plan from searching
+       the same unsolvable subproblem more than once. See NogoodCache.
+     - budget is a Budget. If it runs out before find_plan finds a plan,
+       find_plan returns a BudgetExhausted object rather than False.
+     - stats is a SearchStats, in which to collect statistics about the
+       search.
+     - tracer is a Tracer, whose methods are called as the search goes
+       along. If it's given, it's used instead of a VerboseTracer.
+     - if cycle_check is True, a method that keeps decomposing a task into
+       the same state and todo list makes find_plan backtrack, rather than
+       search forever (see "Applying methods"). Without it, use a budget to
+       stop such a search.
     """
-    if vars(state)[state_var_name][arg] != desired_val:
-        raise Exception(f"depth {depth}: method {method_name} didn't achieve",
-                f"goal {state_var_name}[{arg}] = {desired_val}")
-    if verbose >= 3:
-        print(f"depth {depth}: method {method_name} achieved",
-                f"goal {state_var_name}[{arg}] = {desired_val}")
-    return []       # i.e., don't create any subtasks or subgoals
+    return _run_steps(_find_plan_steps(state, todo_list, verbose, nogoods, \
+                                       budget, None, stats, tracer, \
+                                       cycle_check))
 
 
-def _m_verify_mg(state, method_name, multigoal, depth, verbose=0):
+def _find_plan_steps(state, todo_list, verbose=0, nogoods=None, budget=None,
+                     yield_every=None, stats=None, tracer=None,
+                     cycle_check=False):
     """
-    Pyhop 2 uses this method to check whether a multigoal-method has achieved
-    the multigoal that it promised to achieve.
+    A generator that does find_plan's work, and returns find_plan's result.
+    If yield_every is a number, the generator yields _pause after every
+    yield_every node expansions (see "Asynchronous planning").
     """
-    goal_dict = _goals_not_achieved(state,multigoal)
-    if goal_dict:
-        raise Exception(f"depth {depth}: method {method_name} " + \
-                        f"didn't achieve {multigoal}]")
-    if verbose >= 3:
-        print(f"depth {depth}: method {method_name} achieved {multigoal}")
-    return []
+    if verbose >= 1: 
+        todo_list_str =     \
+            '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
+        print(f'FP> find_plan, verbose={verbose}:')
+        print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
+    nogoods = _nogood_cache(nogoods)
+    stats = _search_stats(stats)
+    tracer = _tracer(tracer, verbose, 'find_plan', state, todo_list)
+    if budget != None:
+        budget._start(state, shared_state=_use_trail)
+    if _use_trail:
+        plans = _seek_plans_with_trail(state, todo_list, verbose, nogoods, \
+                                       budget, None, yield_every, stats, \
+                                       tracer, cycle_check)
+    else:
+        plans = _seek_plans(state, todo_list, [], 0, verbose, nogoods, \
+                            budget, None, yield_every, stats, tracer, \
+                            cycle_check)
+    if stats != None:
+        plans = _timed_steps(plans, stats)
+    while True:
+        try:
+            result = next(plans)
+        except StopIteration as stop:
+            result = stop.value
+            break
+        if result is not _pause:
+            break
+        yield _pause
+    if tracer != None: tracer.on_finish(result)
+    if verbose >= 1:
+        if nogoods != None:
+            print('FP> nogood cache:', nogoods.stats())
+        if stats != None:
+            print('FP> search stats:', stats.stats())
+        print('FP> result =',result,'\n')
+    return result
 
 
-################################################################################
-# Applying actions and commands
-#
-# An action is applied only if the task name is the name of the action.
-# This differs from HGN planners such as GDP and Godel, in which we can
-# decide which actions are relevant by matching their "effects" atoms with
-# the goal atoms. That isn't feasible in Pyhop 2.
-#
-# The problem is that in Pyhop 2, the only way to tell what effects an
-# action will have is to try to apply the fully instantiated action.
-# Thus, to find an action that is applicable in a state s and whose effects
-# satisfy a goal g, we would need to iterate through every possible action
-# instance (i.e, every combination of action name and parameter values), to
-# see if applying the action instance in s produces a state that satisfies
-# g. Such a combinatorial explosion would be unacceptably expensive.
-#
-# In Pyhop 2, one can get the same effect, with much less computational
-# expense, as follows. Consider a blocks-world action unstack(hand,b1,b2)
-# that has three effects: loc(b1)=hand, holding(hand)=b1, and
-# the-block-on(b2)=nil. Then we can write three methods:
-# - a method m1(b1,new_loc) that's declared relevant for 'loc'. If
-#   called with new_loc = hand, it calls unstack(hand,b1,state.loc(b1)).
-# - a method m2(hand,b1) that's declared relevant for 'holding'.
-#   It calls unstack(hand,b1,state.loc(b1)).
-# - a method m3(b2,status) that's declared relevant for 'clear'. If
-#   called with status=nil, it calls unstack(hand,the-block-on(b2),b2)).
-#
-# In hgn_pyhop <https://github.com/ospur/hgn-pyhop>, unlike Pyhop 2, one
-# may declare actions to be directly relevant for goals. I considered
-# adding this feature to Pyhop 2, but decided against it. For a goal of the
-# form g = (name, arg, val), it would require restricting each relevant
-# action to have exactly two parameters, one corresponding to arg and the
-# other corresponding to val. Suppose we try to do this with the action
-# unstack(hand,b1,b2) described above. To make it relevant for the goal
-# loc(b1)=hand, we would need to rewrite it to take two parameters:
-# b1 and hand.  If we instead wanted to make it relevant for the goal
-# holding(hand,b1), or the goal atop(b2,nil), we would need
-# to rewrite the action so its parameters can be hand and b1, or
-# b2 and nil, respectively. All three of these are a bit unnatural --
-# and furthermore there's no way to accomplish all three of them at
-# once, which is what the GDP and Godel HGN planning algorithms would
-# require. In contrast, in the current Pyhop 2 we can easily get the
-# same effect by writing the three goal_methods described earlier.
-# In my view, this is a better approach.
-################################################################################
+def _seek_plan_with_trail(state, todo_list, verbose=0, nogoods=None, \
+                          budget=None, plan=[], depth=0, stats=None, \
+                          cycle_check=False):
+    """
+    Call seek_plan with a new undo trail, on a copy of state whose
+    state variables have been prepared for it by _trail_vars.
+    """
+    global _trail
+    state = state.copy()
+    _trail_vars(state)
+    outer_trail = _trail
+    _trail = []
+    try:
+        return seek_plan(state, todo_list, plan, depth, verbose, nogoods, \
+                         budget, stats, cycle_check)
+    finally:
+        _trail = outer_trail
+
+
+def seek_plan(state, todo_list, plan, depth, verbose=0, nogoods=None, \
+              budget=None, stats=None, cycle_check=False):
+    """
+    Workhorse for find_plan. Arguments:
+     - state is the current state;
+     - todo_list is the current list to-dos (tasks, goals, and multigoals);
+     - plan is the current partial plan;
+     - depth is the search depth, for use in debugging;
+     - verbose = 0, 1, 2, or 3 indicates how much debugging info to print.
+       For details, see the docstring for find_plan.
+     - nogoods is None or a NogoodCache;
+     - budget is None or a Budget. If it runs out, seek_plan returns a
+       BudgetExhausted object.
+     - stats is None or a SearchStats, which seek_plan adds its
+       statistics to (without resetting it first).
+     - cycle_check is as in find_plan.
+    seek_plan returns the first plan that _seek_plans finds, or False or a
+    BudgetExhausted object if there isn't one.
+    """
+    tracer = _tracer(None, verbose, 'seek_plan', state, todo_list)
+    plans = _seek_plans(state, todo_list, plan, depth, verbose, nogoods, \
+                        budget, stats=stats, tracer=tracer, \
+                        cycle_check=cycle_check)
+    if stats != None:
+        plans = _timed_steps(plans, stats)
+    try:
+        return next(plans)
+    except StopIteration as stop:
+        return stop.value
+
+
+def _run_steps(steps):
+    """
+    Run steps, a generator such as the one _find_plan_steps returns, until
+    it's done, and return the value it returns.
+    """
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
 
+# What the planners' generators yield when they pause (see "Asynchronous
+# planning")
+_pause = object()
 
-def _apply_action(state, task1, more_tasks, plan, depth, verbose=0):
+
+def _seek_plans(state, todo_list, plan, depth, verbose=0, nogoods=None, \
+                budget=None, bound=None, yield_every=None, stats=None, \
+                tracer=None, cycle_check=False):
     """
-    apply_action is called only when task1's name matches an action name.
-    It applies the action by retrieving the action's function definition
-    and calling it on the arguments.
+    A generator that yields each plan for todo_list, in the order in which
+    depth-first search finds them. The arguments are as in seek_plan,
+    plus bound, which is None or a _CostBound for a branch-and-bound
+    search. In the latter case, each plan that is yielded is cheaper than
+    the one before, and bound.best is its cost. If yield_every is a number,
+    the generator also yields _pause after every yield_every expansions.
+    stats is None or a SearchStats, and tracer is None or a Tracer. (The
+    caller is responsible for making a VerboseTracer if verbose >= 2.)
+    cycle_check is as in find_plan. When there are no more plans, the
+    generator returns False, or a BudgetExhausted object if the budget ran
+    out.
+
+    _seek_plans does a depth-first search, using a stack of choice points
+    rather than recursion, so it can find plans of any length. After it
+    yields a plan, it resumes at the most recent choice point. Internally,
+    todo_list and plan are _Links (see "Linked lists" above), with plan in
+    reverse order; the plan is converted back to a list when it's yielded.
     """
-    if verbose >= 3: print(f'depth {depth} action {task1}: apply action')
-    action = _current_domain._action_dict[task1[0]]
-    newstate = action(state.copy(),*task1[1:])
-    if verbose >= 3:
-        print(f'depth {depth}', end=' ')
-        print(repr(newstate))
-    if newstate:
-        return seek_plan(newstate, more_tasks, plan+[task1], depth+1, verbose)
-    if verbose >= 3: print(f'depth {depth} action {task1} not applicable')
-    return False
+    todo_list = _link(todo_list)
+    plan = _link(plan[::-1]) if type(plan) is not _Link else plan
+    dispatch = _dispatch_dict(_seek_plan_handlers)
+    choices = []
+    # the path_keys of the choice points in choices, if there's a cycle check
+    path = set() if cycle_check else None
+    cost = 0        # the cost of plan, if there's a bound
+    expansions = 0  # expansions since the last pause
+    while True:
+        if tracer != None: tracer.on_expand(depth, state, todo_list)
+        if bound != None and bound._prunes(state, todo_list, cost, stats):
+            if tracer != None: tracer.on_prune(depth, cost, bound.best)
+        elif not todo_list:
+            if tracer != None: tracer.on_solution(depth)
+            # every choice point on the stack has succeeded, so none of
+            # them is a nogood
+            for choice in choices:
+                choice.key = None
+            if bound != None:
+                bound.best = cost
+            yield _plan_list(plan)
+        else:
+            if budget != None:
+                exhausted = budget._charge(len(choices))
+                if exhausted != None:
+                    if tracer != None:
+                        tracer.on_budget_exhausted(depth, exhausted)
+                    return exhausted
+            if yield_every != None:
+                expansions += 1
+                if expansions >= yield_every:
+                    expansions = 0
+                    yield _pause
+            if stats != None:
+                stats._expand(depth, len(choices))
+            (todo1, more) = (todo_list.first, todo_list.rest)
+            if isinstance(todo1, Multigoal):
+                handler = _find_multigoal_method
+            elif type(todo1) is tuple or type(todo1) is list:
+                handler = dispatch.get(todo1[0])
+            else:
+                handler = None
+            if handler is _apply_action:
+                newstate = _apply_action(state, todo1, depth, tracer, stats)
+                if newstate:
+                    (state, todo_list, plan, depth) = \
+                        (newstate, more, _Link(todo1, plan), depth+1)
+                    if bound != None:
+                        cost += bound.c(todo1)
+                    continue
+            elif handler == None:
+                raise Exception(    \
+                    f"depth {depth}: {todo1} isn't an action, task, goal, or multigoal\n")
+            else:
+                key = None if nogoods == None else nogoods._key(state, todo_list)
+                path_key = None
+                if path != None and len(choices) >= _CYCLE_CHECK_DEPTH:
+                    path_key = key if key != None else \
+                        _subproblem_key(state, todo_list)
+                if key != None and nogoods._failed(key):
+                    if tracer != None: tracer.on_nogood(depth)
+                    if stats != None:
+                        stats.duplicates += 1
+                    choice = None
+                elif path_key != None and path_key in path:
+                    if tracer != None: tracer.on_cycle(depth)
+                    if stats != None:
+                        stats.duplicates += 1
+                    # the choice points on the stack failed only on this
+                    # path, so none of them is a nogood
+                    for choice in choices:
+                        choice.key = None
+                    choice = None
+                else:
+                    choice = handler(state, todo1, more, plan, depth, tracer)
+                    if choice == None:
+                        # the goal is already achieved
+                        (todo_list, depth) = (more, depth+1)
+                        continue
+                if choice != None:
+                    choice.key = key
+                    choice.cost = cost
+                    if path_key != None:
+                        choice.path_key = path_key
+                        path.add(path_key)
+                    choices.append(choice)
+        # Try the next method of the most recent choice point. If it has no
+        # more applicable methods, backtrack to the one before it.
+        while choices:
+            if stats != None and choices[-1].i > 0:
+                stats.backtracks += 1
+            node = _next_method(choices[-1], stats, tracer)
+            if node != None:
+                break
+            choice = choices.pop()
+            if choice.key != None:
+                nogoods._add(choice.key)
+            if choice.path_key != None:
+                path.discard(choice.path_key)
+        else:
+            return False
+        (state, todo_list, plan, depth) = node
+        cost = choices[-1].cost
 
 
-def _apply_command(state, command, args, verbose=1):
+def iter_plans(state, todo_list, verbose=0, nogoods=None, budget=None,
+               stats=None, tracer=None, cycle_check=False):
     """
-    apply_command is called only when task1's name matches a command name.
-    It applies the command by retrieving the command's function definition
-    and calling it on the arguments.
+    A generator that yields the plans for todo_list one at a time, in the
+    order in which find_plan's depth-first search finds them; the first one
+    is the plan that find_plan would return. Each plan is found by resuming
+    the search at its most recent choice point, rather than by starting
+    over. If two different ways of decomposing the todo list produce the
+    same plan, it's yielded only once. The arguments are as in find_plan.
+    If there's a budget, it applies to the entire enumeration, and the
+    iteration stops when it runs out; budget.exhausted tells whether it did.
+    Likewise, stats and tracer cover the entire enumeration so far.
+    For example, this gets the first 5 plans:
+        plans = list(itertools.islice(iter_plans(state, todo_list), 5))
     """
-    if verbose >= 3:
-        print(f"_apply_command: state = {state.__name__},", \
-              f"command = {command.__name__}, args = {args}")
-    next_state = command(state.copy(),*args)
-    if next_state:
-        if verbose >= 3:
-            print(f"_apply_command: {command.__name__}", \
-                  f"returns state {next_state.__name__}")
-        return next_state
+    if verbose >= 1: 
+        todo_list_str =     \
+            '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
+        print(f'FP> iter_plans, verbose={verbose}:')
+        print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
+    nogoods = _nogood_cache(nogoods)
+    stats = _search_stats(stats)
+    tracer = _tracer(tracer, verbose, 'iter_plans', state, todo_list)
+    if budget != None:
+        budget._start(state, shared_state=_use_trail)
+    if _use_trail:
+        plans = _seek_plans_with_trail(state, todo_list, verbose, nogoods, \
+                                       budget, None, None, stats, tracer, \
+                                       cycle_check)
     else:
-        if verbose >= 3:
-            print(f"_apply_command: {command.__name__} not applicable")
+        plans = _seek_plans(state, todo_list, [], 0, verbose, nogoods, \
+                            budget, None, None, stats, tracer, cycle_check)
+    if stats != None:
+        plans = _timed_steps(plans, stats)
+    found = set()
+    for plan in plans:
+        key = _freeze(plan)
+        if key in found:
+            if verbose >= 1: print('FP> duplicate plan, not yielded')
+            continue
+        found.add(key)
+        if verbose >= 1: print(f'FP> plan {len(found)} =',plan,'\n')
+        yield plan
+    if tracer != None:
+        tracer.on_finish(budget.exhausted if budget != None and \
+                         budget.exhausted != None else False)
+    if verbose >= 1 and stats != None:
+        print('FP> search stats:', stats.stats())
+
+
+def _seek_plans_with_trail(state, todo_list, verbose=0, nogoods=None, \
+                           budget=None, bound=None, yield_every=None, \
+                           stats=None, tracer=None, cycle_check=False):
+    """
+    Like _seek_plan_with_trail, but for _seek_plans. Since the caller may run
+    other searches between one plan and the next, the generator's undo trail
+    is installed only while the search is running.
+    """
+    global _trail
+    state = state.copy()
+    _trail_vars(state)
+    trail = []
+    plans = _seek_plans(state, todo_list, [], 0, verbose, nogoods, budget, \
+                        bound, yield_every, stats, tracer, cycle_check)
+    while True:
+        outer_trail = _trail
+        _trail = trail
+        try:
+            plan = next(plans)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            _trail = outer_trail
+        yield plan
+
+
+def find_cheapest_plan(state, todo_list, k, c=None, verbose=0, nogoods=None,
+                       budget=None, stats=None, tracer=None,
+                       cycle_check=False):
+    """
+    Return the cheapest of the first k plans that iter_plans finds, or False
+    if there aren't any (or a BudgetExhausted object, if the budget ran out
+    before any were found). The cost of a plan is the sum of c(action) for
+    its actions, where c is a function like find_plan_GBFS's c; if c isn't
+    given, the costs are the ones declared with declare_actions_cost. The
+    other arguments are as in find_plan. If several plans have the lowest
+    cost, find_cheapest_plan returns the first one. k must be at least 1.
+    """
+    if k < 1:
+        raise Exception(f"find_cheapest_plan: k must be at least 1, not {k}")
+    best = False
+    best_cost = None
+    for (i,plan) in enumerate(iter_plans(state, todo_list, verbose, \
+                                         nogoods, budget, stats, tracer, \
+                                         cycle_check)):
+        if c == None:
+            cost = current_cost(plan)
+        else:
+            cost = sum(c(action) for action in plan)
+        if best_cost == None or cost < best_cost:
+            (best, best_cost) = (plan, cost)
+        if i+1 >= k:
+            break
+    if best == False and budget != None and budget.exhausted != None:
+        best = budget.exhausted
+    if verbose >= 1: print('FP> cheapest plan =',best,'cost =',best_cost,'\n')
+    return best
+
+
+############################################################
+# Branch and bound
+
+
+class _CostBound():
+    """
+    The bound in a branch-and-bound search: c is the action-cost function,
+    h is the heuristic (or None), and best is the cost of the best plan
+    found so far.
+    """
+    __slots__ = ('c', 'h', 'best')
+
+    def __init__(self, c, h):
+        self.c = c
+        self.h = h
+        self.best = float('inf')
+
+    def _prunes(self, state, todo_list, cost, stats=None):
+        """
+        Return True if a node whose plan costs cost can't lead to a plan
+        that's cheaper than the best one. stats is None or a SearchStats.
+        """
+        if cost >= self.best:
+            return True
+        if self.h != None and todo_list:
+            if stats == None:
+                return cost + self.h(state, todo_list) >= self.best
+            return cost + stats._estimate(self.h, state, todo_list) \
+                >= self.best
         return False
 
-################################################################################
-# Applying methods
+
+def _action_cost(action):
+    "Return action's cost as declared with declare_actions_cost"
+    return _current_domain._action_cost_dict[action[0]]
 
 
-def _find_task_method(state, task1, more_tasks, plan, depth, verbose=0):
+def iter_improving_plans(state, todo_list, h=None, c=None, verbose=0, \
+                         budget=None, stats=None, tracer=None):
     """
-    if task1's name has an entry in the task-method dictionary, iterate
-    through the methods until we find one that's applicable, then apply
-    it to produce a list of subtasks, and call seek_plan recursively on
-    the subtask list + more_tasks.
-    If seek_plan fails, go on to the next method in the list.
+    A generator for depth-first branch-and-bound search. It yields pairs
+    (plan, cost), in which each plan is cheaper than the one before it;
+    after yielding a plan, it ignores every partial plan whose cost,
+    plus h's estimate of the cost of the rest of the todo list, is at least
+    as high. When the generator finishes without running out of budget,
+    the last plan is optimal. Arguments:
+     - c is a function like find_plan_GBFS's c, which returns an action's
+       cost. If it isn't given, the costs are the ones declared with
+       declare_actions_cost.
+     - h (optional) is a heuristic function like find_plan_GBFS's h. For
+       the last plan to be optimal, h must be admissible, i.e., it must
+       never overestimate the cost of accomplishing the todo list.
+     - state, todo_list, verbose, budget, stats, and tracer are as in
+       iter_plans.
+    Since branch and bound only needs find_plan's stack of choice points,
+    it can find optimal plans for problems whose A* frontier wouldn't fit
+    in memory.
     """
-    if verbose >= 3: 
-        print(f'depth {depth} task {task1}: look for a task method')
-    relevant = _current_domain._task_method_dict[task1[0]]
-    if verbose >= 3:
-        print(f'depth {depth} task {task1} methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} task {task1}: trying method {method.__name__}')
-        subtasks = method(state,*task1[1:])
-        # Can't just say "if subtasks:", because that's wrong if subtasks == []
-        if subtasks != False and subtasks != None:
-            if verbose >= 3:
-                print(f'depth {depth} task_method {method.__name__}', \
-                      f'subtasks: {subtasks}')
-            result = seek_plan(state, subtasks+more_tasks, plan, depth+1, verbose)
-            if result != False and result != None:
-                return result
+    if verbose >= 1: 
+        todo_list_str =     \
+            '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
+        print(f'FP> iter_improving_plans, verbose={verbose}:')
+        print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
+    bound = _CostBound(_action_cost if c == None else c, h)
+    stats = _search_stats(stats)
+    tracer = _tracer(tracer, verbose, 'iter_improving_plans', state, \
+                     todo_list)
+    if budget != None:
+        budget._start(state, shared_state=_use_trail)
+    if _use_trail:
+        plans = _seek_plans_with_trail(state, todo_list, verbose, None, \
+                                       budget, bound, None, stats, tracer)
+    else:
+        plans = _seek_plans(state, todo_list, [], 0, verbose, None, budget, \
+                            bound, None, stats, tracer)
+    if stats != None:
+        plans = _timed_steps(plans, stats)
+    for plan in plans:
+        if verbose >= 1: print(f'FP> plan with cost {bound.best} =',plan,'\n')
+        yield (plan, bound.best)
+    if tracer != None:
+        tracer.on_finish(budget.exhausted if budget != None and \
+                         budget.exhausted != None else False)
+    if verbose >= 1 and stats != None:
+        print('FP> search stats:', stats.stats())
+
+
+def find_plan_bnb(state, todo_list, h=None, c=None, verbose=0, budget=None,
+                  stats=None, tracer=None):
+    """
+    Use iter_improving_plans to find an optimal plan for todo_list, and
+    return it. The arguments are as in iter_improving_plans. If there's no
+    plan, return False. If the budget runs out, return the best plan found
+    so far (budget.exhausted tells whether that happened, in which case the
+    plan may not be optimal), or a BudgetExhausted object if there isn't one.
+    """
+    result = False
+    for (plan,cost) in iter_improving_plans(state, todo_list, h, c, \
+                             verbose=verbose, budget=budget, stats=stats,
+                             tracer=tracer):
+        result = plan
+    if result == False and budget != None and budget.exhausted != None:
+        result = budget.exhausted
+    if verbose >= 1: print('FP> result =',result,'\n')
+    return result
+
+
+############################################################
+# Parallel search
+#
+# find_plan_parallel splits the search at its first few choice points that
+# have more than one applicable method, and gives the resulting subproblems
+# to a set of worker processes. The workers are forked after the split, so
+# they inherit the domain and the subproblems, and only the plans need to be
+# sent back. This requires the 'fork' start method, which is available on
+# Linux and other Unix systems but not on Windows. Each worker repeatedly
+# takes the next unsolved subproblem, so the subproblems are started in
+# find_plan's order. As soon as the answer is known, the workers are killed.
+
+import multiprocessing, os, queue
+
+# The subproblems for the workers to solve, whether to use nogood caches,
+# whether to send back SearchStats, and whether to check for cycles
+_parallel_nodes = None
+_parallel_nogoods = None
+_parallel_stats = False
+_parallel_cycle_check = False
+
+
+def find_plan_parallel(state, todo_list, verbose=0, processes=None, levels=2,
+                       first_found=False, nogoods=None, stats=None,
+                       cycle_check=False):
+    """
+    Like find_plan, but search in parallel using a pool of processes (by
+    default, one per CPU). The first 'levels' choice points on each path
+    that have more than one applicable method are expanded here, and the
+    subproblems below them are searched by the workers. Arguments:
+     - state, todo_list, and verbose are as in find_plan;
+     - processes is the number of worker processes;
+     - levels is the number of choice-point levels to split the search at;
+     - if first_found is False (the default), the result is the same plan
+       that find_plan would return. If first_found is True, the result is
+       the first plan that any worker finds, which may come sooner.
+     - if nogoods is true, each worker uses a NogoodCache;
+     - stats is None or a SearchStats, which gets the sums of the workers'
+       statistics for the subproblems whose answers were received. The
+       search done here to split the problem isn't counted.
+     - cycle_check is as in find_plan.
+    The workers don't print anything. If the 'fork' start method isn't
+    available, find_plan_parallel just calls find_plan.
+    """
+    global _parallel_nodes, _parallel_nogoods, _parallel_stats, \
+        _parallel_cycle_check
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return find_plan(state, todo_list, verbose, nogoods, stats=stats, \
+                         cycle_check=cycle_check)
+    if verbose >= 1: 
+        todo_list_str =     \
+            '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
+        print(f'FP> find_plan_parallel, verbose={verbose}:')
+        print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
+    nodes = _split_search(state, todo_list, levels)
+    if verbose >= 1:
+        print(f'FP> {len(nodes)} subproblems')
+    stats = _search_stats(stats)
+    result = False
+    if len(nodes) == 1 or (nodes and nodes[0][1] == []):
+        # no need for any workers
+        result = _solve_subproblem_nodes(nodes[0], nogoods, stats, \
+                                         cycle_check)
+    elif nodes:
+        if processes == None:
+            processes = os.cpu_count()
+        _parallel_nodes = nodes
+        _parallel_nogoods = nogoods
+        _parallel_stats = stats != None
+        _parallel_cycle_check = cycle_check
+        context = multiprocessing.get_context('fork')
+        counter = context.Value('i', 0)
+        answers = context.Queue()
+        workers = [context.Process(target=_parallel_worker, \
+                                   args=(counter, answers), daemon=True) \
+                   for _ in range(min(processes, len(nodes)))]
+        try:
+            for worker in workers:
+                worker.start()
+            (answer, winner) = _parallel_answer(answers, workers, \
+                                                len(nodes), first_found, stats)
+            if winner != None:
+                if verbose >= 1:
+                    print(f'FP> subproblem {winner} has a plan')
+                result = answer
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.kill()
+            for worker in workers:
+                worker.join()
+            _parallel_nodes = None
+            _parallel_nogoods = None
+            _parallel_stats = False
+            _parallel_cycle_check = False
+    if verbose >= 1: print('FP> result =',result,'\n')
+    return result
+
+
+def _parallel_answer(answers, workers, n, first_found, stats=None):
+    """
+    Read (i, plan, worker_stats) triples from the answers queue until the
+    answer is known, adding each worker_stats to stats if it's given.
+    Return (plan, i) for the plan that find_plan_parallel should return
+    and the subproblem it came from, or (False, None) if there isn't one.
+    A subproblem's plan may be an exception that its search raised. It's
+    raised only if find_plan would have raised it, i.e., if the earlier
+    subproblems have no plans; with first_found, only if no subproblem
+    has a plan.
+    """
+    results = {}
+    next_i = 0      # the first subproblem whose result isn't known
+    while len(results) < n:
+        try:
+            (i, plan, worker_stats) = answers.get(timeout=1)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                raise Exception("find_plan_parallel: a worker process died")
+            continue
+        if stats != None and worker_stats != None:
+            stats._add(worker_stats)
+        results[i] = plan
+        if first_found:
+            if plan != False and not isinstance(plan, BaseException):
+                return (plan, i)
         else:
-            if verbose >= 3:
-                print(f'depth {depth}', \
-                      f'task_method {method.__name__} not applicable')
-    if verbose >= 3:
-        print(f'depth {depth} could not accomplish task {task1}')        
-    return False
+            while next_i in results and results[next_i] is False:
+                next_i += 1
+            if next_i in results:
+                if isinstance(results[next_i], BaseException):
+                    raise results[next_i]
+                return (results[next_i], next_i)
+    for i in sorted(results):
+        if isinstance(results[i], BaseException):
+            raise results[i]
+    return (False, None)
+
+
+def _parallel_worker(counter, answers):
+    """
+    In a worker process, solve subproblems until there aren't any more, and
+    put (i, plan, stats) into the answers queue for each subproblem i, where
+    stats is a SearchStats if _parallel_stats is True, and otherwise None.
+    """
+    while True:
+        with counter.get_lock():
+            i = counter.value
+            counter.value += 1
+        if i >= len(_parallel_nodes):
+            return
+        stats = SearchStats() if _parallel_stats else None
+        try:
+            plan = _solve_subproblem_nodes(_parallel_nodes[i], \
+                                           _parallel_nogoods, stats, \
+                                           _parallel_cycle_check)
+        except Exception as e:
+            plan = e
+        answers.put((i, _picklable(plan), stats))
+
+
+def _picklable(answer):
+    """
+    Return answer (a plan, False, or an exception) if it can be pickled, and
+    otherwise an Exception that describes it. A worker must check this
+    before putting answer into a multiprocessing queue: the queue pickles
+    it in a background thread, so if that fails, the answer is just lost.
+    """
+    try:
+        pickle.dumps(answer)
+        return answer
+    except Exception:
+        return Exception(repr(answer))
 
 
-def _find_goal_method(state, goal1, more_goals, plan, depth, verbose=0):
+def _solve_subproblem_nodes(node, nogoods, stats=None, cycle_check=False):
     """
-    if goal1's name has an entry in the goal-method dictionary, iterate
-    through the methods until we find one that's applicable, then apply
-    it to produce a list of subgoals, and call seek_plan recursively on
-    the subgoal list + [verification] + more_goals, where verification is a
-    special goal to test whether the method actually achieved goal1.
-    If seek_plan fails, go on to the next method in the list.
+    Return a plan for the subproblem (state, todo_list, plan, depth), or
+    False. stats is None or a SearchStats to add the search's statistics to,
+    and cycle_check is as in find_plan.
     """
-    if verbose >= 3:
-        print(f'depth {depth} goal {goal1}: look for a goal method')
-    (state_var_name, arg, val) = goal1
-    if vars(state).get(state_var_name).get(arg) == val:
-        if verbose >= 3:
-            print(f'depth {depth} goal {goal1} is already achieved')
-        return seek_plan(state, more_goals, plan, depth+1, verbose)
-    relevant = _current_domain._goal_method_dict[state_var_name]
-    if verbose >= 3:
-        print(f'depth {depth} goal {goal1} methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} goal {goal1}: trying method {method.__name__}')
-        subgoals = method(state,arg,val)
-        # Can't just say "if subgoals:", because that's wrong if subgoals == []
-        if subgoals != False and subgoals != None:
-            if verbose >= 3:
-                print(f'depth {depth} goal_method', \
-                      f'{method.__name__} subgoals: {subgoals}')
-            if _verify_goals:
-                verification = [('_verify_g', method.__name__, \
-                                 state_var_name, arg, val, depth, verbose)]
-            else:
-                verification = []
-            todo_list = subgoals + verification + more_goals
-            result = seek_plan(state, todo_list, plan, depth+1, verbose)
-            if result != False and result != None:
-                return result
-        else:
-            if verbose >= 3:
-                print(f'depth {depth}', \
-                      f'goal_method {method.__name__} not applicable')        
-    if verbose >= 3:
-        print(f'depth {depth} goal_method {method.__name__}', \
-              f'could not achieve goal {goal1}')        
-    return False
+    (state, todo_list, plan, depth) = node
+    nogoods = _nogood_cache(nogoods)
+    if _use_trail:
+        return _seek_plan_with_trail(state, todo_list, 0, nogoods, None, \
+                                     plan, depth, stats, cycle_check)
+    return seek_plan(state, todo_list, plan, depth, 0, nogoods, None, stats, \
+                     cycle_check)
 
 
-def _find_multigoal_method(state, multigoal1, more_goals, plan, depth, verbose=0):
+def _split_search(state, todo_list, levels):
     """
-    if multigoal1 is a multigoal, iterate though the multigoal methods
-    until we find one that's applicable, then apply it to get a subgoal
-    list, and call seek_plan recursively on the subgoal list + more_goals.
-    If seek_plan fails, go on to the next multigoal method. Unlike with
-    goal methods, we don't do verification here because it's unclear what
-    we're supposed to verify.
+    Do find_plan's depth-first search down to the first 'levels' choice
+    points on each path that have more than one applicable method, and
+    return a list of the search nodes (state, todo_list, plan, depth) below
+    them, in the order in which find_plan would search them. A node whose
+    todo_list is [] is a plan that was found along the way. A node whose
+    first todo isn't an action, task, goal, or multigoal is returned as
+    it is, so that the exception is raised only if find_plan would get to
+    it. Paths deeper than _CYCLE_CHECK_DEPTH aren't split any further,
+    since they may be decompositions that never end (see seek_plan).
     """
-    if verbose >= 3:
-        print(f'depth {depth} multigoal {multigoal1}:', \
-              f'look for a multigoal method')
-    relevant = _current_domain._multigoal_method_list
-    if verbose >= 3:
-        print(f'depth {depth} multigoal {multigoal1} methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} task {multigoal1}: trying method {method.__name__}')
-        subgoals = method(state,multigoal1)
-        # Can't just say "if subgoals:", because that's wrong if subgoals == []
-        if subgoals != False and subgoals != None:
-            if verbose >= 3:
-                print(f'depth {depth} multigoal_method {method.__name__}', \
-                      f'subgoals: {subgoals}')
-            if _verify_goals:
-                verification = [('_verify_mg', method.__name__, multigoal1, \
-                                 depth, verbose)]
+    dispatch = _dispatch_dict(_seek_plan_handlers)
+    nodes = []
+    stack = [(state, _link(todo_list), _nil, 0, levels)]
+    while stack:
+        (state, todo_list, plan, depth, levels) = stack.pop()
+        while True:
+            if not todo_list or levels == 0 or depth >= _CYCLE_CHECK_DEPTH:
+                nodes.append((state, list(todo_list), _plan_list(plan), depth))
+                break
+            (todo1, more) = (todo_list.first, todo_list.rest)
+            if isinstance(todo1, Multigoal):
+                handler = _find_multigoal_method
+            elif type(todo1) is tuple or type(todo1) is list:
+                handler = dispatch.get(todo1[0])
             else:
-                verification = []
-            todo_list = subgoals + verification + more_goals
-            result = seek_plan(state, todo_list, plan, depth+1, verbose)
-            if result != False and result != None:
-                return result
-        else:
-            if verbose >= 3:
-                print(f'depth {depth} multigoal_method {method.__name__}', \
-                      f'not applicable')
-    if verbose >= 3:
-        print(f'depth {depth} could not achieve multigoal {multigoal1}')        
-    return False
+                handler = None
+            if handler is _apply_action:
+                state = _apply_action(state, todo1, depth)
+                if not state:
+                    break
+                (todo_list, plan, depth) = (more, _Link(todo1, plan), depth+1)
+                continue
+            elif handler != None:
+                choice = handler(state, todo1, more, plan, depth)
+                if choice == None:
+                    (todo_list, depth) = (more, depth+1)
+                    continue
+            else:
+                choice = None
+            if choice == None:
+                # the search of this node will raise the exception
+                nodes.append((state, list(todo_list), _plan_list(plan), depth))
+                break
+            children = []
+            node = _next_method(choice)
+            while node != None:
+                children.append(node)
+                node = _next_method(choice)
+            if len(children) > 1:
+                levels -= 1
+            for node in reversed(children):
+                stack.append(node + (levels,))
+            break
+    return nodes
 
 
 ############################################################
-# The planning algorithm
+# Portfolios
+#
+# Which of find_plan, find_plan_GBFS, and find_plan_a_star is fastest
+# depends heavily on the problem (see briefcase.test). find_plan_portfolio
+# runs several engines on the same problem in forked processes, and kills
+# the others as soon as it has its answer. A PortfolioStats object records
+# how often each engine wins, and the portfolio starts the engines in order
+# of their records, which matters when there are fewer processes than
+# engines.
 
 
-def find_plan(state, todo_list, verbose=0):
+class PortfolioStats():
     """
-    find_plan tries to find a plan that accomplishes the items in todo_list,
-    starting from the given state, using whatever methods and actions you 
-    declared previously. If successful, it returns the plan. Otherwise it
-    returns False. Arguments:
-     - 'state' is a state;
-     - 'todo_list' is a list to-dos (tasks, goals, and multigoals);
-     - verbose = 0, 1, 2, or 3 indicates how much debugging info to print:
-        - if verbose = 0 (the default), it prints nothing;
-        - if verbose = 1, it prints the initial parameters and the answer;
-        - if verbose = 2, it also prints a message on each recursive call;
-        - if verbose = 3, it also prints info about what it's computing.
+    ps = PortfolioStats() creates a record of find_plan_portfolio's results.
+    For each engine name, ps.runs, ps.wins, and ps.solved are the number
+    of times the engine finished (returned an answer or raised an
+    exception), produced the plan that the portfolio returned, and found a
+    plan; ps.unfinished is the number of times it was stopped before it
+    finished, because another engine had already won or the time limit ran
+    out; and ps.seconds is the total time it took in the runs in which it
+    found a plan. find_plan_portfolio uses a global PortfolioStats object
+    (returned by portfolio_stats()) unless it's given a different one.
+    """
+
+    def __init__(self):
+        self.runs = {}
+        self.unfinished = {}
+        self.wins = {}
+        self.solved = {}
+        self.seconds = {}
+
+    def __repr__(self):
+        return f"<PortfolioStats {self.stats()}>"
+
+    def _record(self, name, solved, seconds):
+        "Record the result of a run of the engine called name"
+        self.runs[name] = self.runs.get(name, 0) + 1
+        if solved:
+            self.solved[name] = self.solved.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+
+    def _record_unfinished(self, name):
+        "Record that the engine called name was stopped before it finished"
+        self.unfinished[name] = self.unfinished.get(name, 0) + 1
+
+    def _record_win(self, name):
+        self.wins[name] = self.wins.get(name, 0) + 1
+
+    def ranking(self, names):
+        """
+        Return the engine names, sorted so that the engines with the highest
+        fraction of wins come first, and among those, the ones that have
+        been the fastest. Only runs that finished count. Engines that
+        haven't finished a run keep their order, ahead of ones that have
+        never won, so that they get tried.
+        """
+        def key(name):
+            runs = self.runs.get(name, 0)
+            if runs == 0:
+                return (-0.5, 0)
+            wins = self.wins.get(name, 0)
+            solved = self.solved.get(name, 0)
+            avg = self.seconds.get(name, 0) / solved if solved else float('inf')
+            return (-wins / runs, avg)
+        return sorted(names, key=key)
+
+    def stats(self):
+        "Return a dictionary that maps each engine name to its statistics"
+        names = list(self.runs)
+        names += [name for name in self.unfinished if name not in self.runs]
+        return {name: {'runs': self.runs.get(name, 0),
+                       'unfinished': self.unfinished.get(name, 0),
+                       'wins': self.wins.get(name, 0),
+                       'solved': self.solved.get(name, 0),
+                       'seconds': self.seconds.get(name, 0)}
+                for name in names}
+
+
+_portfolio_stats = PortfolioStats()
+
+
+def portfolio_stats():
+    "Return the PortfolioStats object that find_plan_portfolio uses by default"
+    return _portfolio_stats
+
+
+import inspect
+
+
+def find_plan_portfolio(state, todo_list, engines=None, h=None, c=None,
+                        processes=None, time_limit=None, best=False,
+                        stats=None, verbose=0):
+    """
+    Run several planning engines on the same problem, each in its own
+    process, and return the first plan that any of them finds, or False if
+    none of them finds one. Arguments:
+     - state and todo_list are as in find_plan;
+     - engines is a dictionary that maps names to functions, each of which
+       takes arguments (state, todo_list) and returns a plan or False. For
+       example:
+          {'dfs': find_plan,
+           'gbfs': lambda s,t: find_plan_GBFS(s, t, h_moves, c=c_dist)}
+       If engines isn't given, the portfolio has find_plan ('dfs'), and if
+       h is given, find_plan_GBFS ('gbfs') and find_plan_a_star ('a_star')
+       with heuristic h. c is passed to find_plan_GBFS if it's given;
+     - processes is the maximum number of engines to run at once (by
+       default, all of them). Engines are started in the order given by
+       stats.ranking, and each time one finishes without a plan, the next
+       one is started;
+     - time_limit is the maximum number of seconds to wait. If it runs out
+       before there's an answer, the result is a BudgetExhausted object;
+     - if best is True, wait for all of the engines (or until time_limit)
+       and return the cheapest plan, using c or declare_actions_cost's
+       costs; if several are equally cheap, the first to finish wins;
+     - stats is a PortfolioStats object to record the results in (by
+       default, the one returned by portfolio_stats()). It can't be a
+       SearchStats: the engines are arbitrary functions, so
+       find_plan_portfolio can't collect their search statistics;
+     - if verbose >= 1, print what each engine does. The engines themselves
+       don't print anything.
+    If an engine raises an exception or its process dies, the others go on.
+    The exception is raised only if no engine finds a plan.
+
+    If the 'fork' start method isn't available, the engines are run one at
+    a time in this process, in the order given by stats.ranking. Then
+    time_limit can only be enforced by the engines themselves: an engine
+    that has a budget parameter (as the default engines do) is given a
+    Budget that runs out at the time limit, and no engine is started after
+    it.
     """
+    if engines == None:
+        engines = {'dfs': find_plan}
+        if h != None:
+            if c == None:
+                engines['gbfs'] = lambda s,t,budget=None: \
+                    find_plan_GBFS(s, t, h, budget=budget)
+            else:
+                engines['gbfs'] = lambda s,t,budget=None: \
+                    find_plan_GBFS(s, t, h, c=c, budget=budget)
+            engines['a_star'] = lambda s,t,budget=None: \
+                find_plan_a_star(s, t, h, budget=budget)
+    if stats == None:
+        stats = _portfolio_stats
+    elif isinstance(stats, SearchStats):
+        raise Exception("find_plan_portfolio: stats must be a PortfolioStats; " \
+                        "the engines' SearchStats can't be collected")
+    cost = _action_cost if c == None else c
+    names = stats.ranking(list(engines))
     if verbose >= 1: 
         todo_list_str =     \
             '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
-        print(f'FP> find_plan, verbose={verbose}:')
+        print(f'FP> find_plan_portfolio, verbose={verbose}:')
         print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
-    result = seek_plan(state, todo_list, [], 0, verbose)
+        print(f'    engines = {names}')
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return _run_portfolio_serially(state, todo_list, engines, names, \
+                                       cost, best, time_limit, stats, verbose)
+    context = multiprocessing.get_context('fork')
+    answers = context.Queue()
+    start_time = time.monotonic()
+    stop_time = None if time_limit == None else start_time + time_limit
+    if processes == None:
+        processes = len(names)
+    waiting = list(names)
+    running = {}
+    (result, winner, best_cost, error) = (False, None, None, None)
+    try:
+        while waiting or running:
+            while waiting and len(running) < processes:
+                name = waiting.pop(0)
+                worker = context.Process(target=_portfolio_worker, daemon=True, \
+                             args=(name, engines[name], state, todo_list, answers))
+                worker.start()
+                running[name] = worker
+            timeout = 1 if stop_time == None else \
+                min(1, stop_time - time.monotonic())
+            # A worker that had already exited before the get has flushed
+            # its answer into the queue, so if it has no answer by then, it
+            # died without giving one (whatever its exit code was).
+            dead = [name for (name,worker) in running.items() \
+                    if not worker.is_alive()]
+            try:
+                (name, plan, seconds) = answers.get(timeout=max(timeout,0))
+            except queue.Empty:
+                if stop_time != None and time.monotonic() >= stop_time:
+                    if verbose >= 1: print('FP> time limit reached')
+                    break
+                for name in dead:
+                    if name in running:
+                        running.pop(name).join()
+                        plan = Exception( \
+                            f"find_plan_portfolio: engine {name} died")
+                        stats._record(name, False, 0)
+                        if verbose >= 1: print(f'FP> {name} died')
+                        if error == None:
+                            error = plan
+                continue
+            running.pop(name).join()
+            if isinstance(plan, BaseException):
+                stats._record(name, False, seconds)
+                if verbose >= 1: print(f'FP> {name} raised {plan!r}')
+                if error == None:
+                    error = plan
+                continue
+            # a plan is a list; anything else (False, BudgetExhausted) isn't
+            solved = isinstance(plan, list)
+            stats._record(name, solved, seconds)
+            if verbose >= 1:
+                print(f'FP> {name} returned {plan} after {seconds:.3f} seconds')
+            if solved:
+                plan_cost = sum(cost(action) for action in plan)
+                if best_cost == None or plan_cost < best_cost:
+                    (result, winner, best_cost) = (plan, name, plan_cost)
+                if not best:
+                    break
+    finally:
+        for (name,worker) in running.items():
+            worker.kill()
+            stats._record_unfinished(name)
+        for worker in running.values():
+            worker.join()
+    return _portfolio_result(result, winner, error, stop_time, start_time, \
+                             stats, verbose)
+
+
+def _portfolio_result(result, winner, error, stop_time, start_time, stats, \
+                      verbose):
+    """
+    Return find_plan_portfolio's result: the winner's plan, or else a
+    BudgetExhausted object if the time limit ran out, or else False. If no
+    engine found a plan and error is an exception, raise it instead.
+    """
+    if winner != None:
+        stats._record_win(winner)
+        if verbose >= 1: print(f'FP> winner = {winner}')
+    elif stop_time != None and time.monotonic() >= stop_time:
+        result = BudgetExhausted('time', None, \
+                                 time.monotonic() - start_time, None)
+    elif error != None:
+        raise error
     if verbose >= 1: print('FP> result =',result,'\n')
     return result
 
 
-def seek_plan(state, todo_list, plan, depth, verbose=0):
+def _portfolio_worker(name, engine, state, todo_list, answers):
+    "In a worker process, run engine and put (name, plan, seconds) into answers"
+    start_time = time.monotonic()
+    try:
+        plan = engine(state, todo_list)
+    except Exception as e:
+        plan = e
+    seconds = time.monotonic() - start_time
+    answers.put((name, _picklable(plan), seconds))
+
+
+def _takes_budget(engine):
+    "Return True if engine can be called with a budget keyword argument"
+    try:
+        parameters = inspect.signature(engine).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == 'budget' or p.kind == p.VAR_KEYWORD \
+               for p in parameters)
+
+
+def _run_portfolio_serially(state, todo_list, engines, names, cost, best, \
+                            time_limit, stats, verbose):
+    "Run find_plan_portfolio's engines one at a time, in this process"
+    start_time = time.monotonic()
+    stop_time = None if time_limit == None else start_time + time_limit
+    (result, winner, best_cost, error) = (False, None, None, None)
+    for name in names:
+        if stop_time != None and time.monotonic() >= stop_time:
+            if verbose >= 1: print('FP> time limit reached')
+            break
+        engine = engines[name]
+        engine_start = time.monotonic()
+        budget = None
+        try:
+            if stop_time != None and _takes_budget(engine):
+                budget = Budget(time_limit=stop_time - engine_start)
+                plan = engine(state, todo_list, budget=budget)
+            else:
+                plan = engine(state, todo_list)
+        except Exception as e:
+            stats._record(name, False, time.monotonic() - engine_start)
+            if verbose >= 1: print(f'FP> {name} raised {e!r}')
+            if error == None:
+                error = e
+            continue
+        seconds = time.monotonic() - engine_start
+        # a plan is a list; anything else (False, BudgetExhausted) isn't
+        solved = isinstance(plan, list)
+        if budget != None and budget.exhausted != None:
+            # the time limit stopped the engine before it finished
+            stats._record_unfinished(name)
+        else:
+            stats._record(name, solved, seconds)
+        if verbose >= 1:
+            print(f'FP> {name} returned {plan} after {seconds:.3f} seconds')
+        if solved:
+            plan_cost = sum(cost(action) for action in plan)
+            if best_cost == None or plan_cost < best_cost:
+                (result, winner, best_cost) = (plan, name, plan_cost)
+            if not best:
+                break
+    return _portfolio_result(result, winner, error, stop_time, start_time, \
+                             stats, verbose)
+
+
+############################################################
+# Batch planning
+#
+# find_plans_batch solves many independent problems with a pool of worker
+# processes. Each worker sets up the domain once, when it starts, and then
+# receives the problems in chunks, so the per-problem overhead is just the
+# cost of sending a state and todo list and getting back a plan. Each chunk
+# is a separate future, so if a worker process dies, only the chunks that
+# weren't finished yet are lost. The pool can't be used after that, so
+# find_plans_batch makes a new one and solves those chunks' problems one at
+# a time. If that pool breaks too, it solves each of the problems that
+# still don't have results in a pool with a single worker, one problem
+# after another, so that only a problem that kills the worker fails.
+
+import concurrent.futures, concurrent.futures.process
+
+# The engine and domain that a batch worker uses
+_batch_engine = None
+
+
+def find_plans_batch(problems, engine=None, workers=None, chunksize=None,
+                     domain_module=None, domain_name=None, verbose=0,
+                     stats=None):
     """
-    Workhorse for find_plan. Arguments:
-     - state is the current state;
-     - todo_list is the current list to-dos (tasks, goals, and multigoals);
-     - plan is the current partial plan;
-     - depth is the recursion depth, for use in debugging;
-     - verbose = 0, 1, 2, or 3 indicates how much debugging info to print.
-       For details, see the docstring for find_plan.
+    Solve each of the problems, which must be (state, todo_list) pairs,
+    using a pool of worker processes, and return a list of the results in
+    the same order as the problems. Arguments:
+     - engine is a function that takes arguments (state, todo_list) and
+       returns a plan or False. The default is find_plan. For the other
+       planners, use e.g. functools.partial(find_plan_GBFS, h=h_moves).
+     - workers is the number of worker processes (by default, one per CPU).
+       If it's 1, the problems are solved in this process.
+     - chunksize is the number of problems to send to a worker at a time.
+       By default, each worker gets about four chunks.
+     - domain_module is the name of a module that defines the domain, for
+       each worker to import when it starts; domain_name is the name of
+       the domain to use (by default, the current domain). If processes
+       can be forked, the workers inherit the domains that already exist,
+       and domain_module is optional. Otherwise it's required, and engine
+       and the problems must be picklable.
+     - stats is None or a SearchStats, which gets the sums of the
+       statistics of all of the searches. In this case, engine must take
+       a stats keyword argument, as all of the planners do.
+    If solving a problem raises an exception, or its plan can't be sent
+    back from a worker, its result is an exception, and the rest of the
+    batch goes on. If a worker process dies while solving a problem, that
+    problem's result is an exception, and the other problems are solved in
+    new worker processes.
     """
-    if verbose >= 2: 
-        todo_list_str =     \
-                '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
-        print(f'depth {depth} todo_list ' + todo_list_str)
-    if todo_list == []:
-        if verbose >= 3:
-            print(f'depth {depth} no more tasks or goals, return plan')
-        return plan
-    todo1 = todo_list[0]
-    ttype = get_type(todo1)
-    if ttype in {'list','tuple'}:
-        if todo1[0] in _current_domain._action_dict:
-            return _apply_action(state, todo1, todo_list[1:], \
-                                 plan, depth, verbose=verbose)
-        elif todo1[0] in _current_domain._task_method_dict:
-            return _find_task_method(state, todo1, todo_list[1:], \
-                                     plan, depth, verbose=verbose)
-        elif todo1[0] in _current_domain._goal_method_dict:
-            return _find_goal_method(state, todo1, todo_list[1:], \
-                                     plan, depth, verbose=verbose)
-    elif ttype in {'Multigoal'}:
-        return _find_multigoal_method(state, todo1, todo_list[1:], \
-                                      plan, depth, verbose=verbose)
-
-    raise Exception(    \
-        f"depth {depth}: {todo1} isn't an action, task, goal, or multigoal\n")
-    return False
+    problems = list(problems)
+    if engine == None:
+        engine = find_plan
+    if domain_name == None:
+        domain_name = _current_domain.__name__
+    if workers == None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(problems)))
+    if chunksize == None:
+        chunksize = max(1, len(problems) // (4 * workers))
+    if verbose >= 1:
+        print(f'FP> find_plans_batch: {len(problems)} problems,', \
+              f'{workers} workers, chunksize {chunksize}')
+    stats = _search_stats(stats)
+    start_time = time.monotonic()
+    if workers == 1:
+        _batch_init(engine, None, domain_name)
+        results = [_batch_solve(problem, stats) for problem in problems]
+    else:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        elif domain_module == None:
+            raise Exception(    \
+                "find_plans_batch: without fork, domain_module is required")
+        else:
+            context = multiprocessing.get_context('spawn')
+        results = [None] * len(problems)
+        pool_args = (context, engine, domain_module, domain_name)
+        # each item is (i, chunk), where chunk is problems[i:i+len(chunk)]
+        items = [(i, problems[i:i+chunksize]) \
+                 for i in range(0, len(problems), chunksize)]
+        failed = _batch_run(items, workers, pool_args, results, stats)
+        if failed:
+            if verbose >= 1:
+                print('FP> a worker process died; solving the unfinished', \
+                      'problems one at a time')
+            items = [(i+j, [problem]) for (i,chunk) in failed \
+                     for (j,problem) in enumerate(chunk)]
+            failed = _batch_run(items, workers, pool_args, results, stats)
+        for item in failed:
+            if _batch_run([item], 1, pool_args, results, stats):
+                (i, chunk) = item
+                if verbose >= 1:
+                    print(f'FP> a worker process died solving problem {i}')
+                results[i] = \
+                    Exception("find_plans_batch: a worker process died")
+    if verbose >= 1:
+        solved = sum(1 for result in results if isinstance(result, list))
+        print(f'FP> {solved} of {len(problems)} problems solved in', \
+              f'{time.monotonic() - start_time:.3f} seconds')
+    return results
+
+
+def _batch_run(items, workers, pool_args, results, stats):
+    """
+    Solve the chunks of problems in items, which are pairs (i, chunk), in a
+    new pool of worker processes. pool_args is (context, engine,
+    domain_module, domain_name). Put the results for each chunk that's
+    finished into results[i:i+len(chunk)], and add their statistics to
+    stats (if it isn't None). Return the items that weren't finished
+    because a worker process died.
+    """
+    (context, engine, domain_module, domain_name) = pool_args
+    pool = concurrent.futures.ProcessPoolExecutor(workers, \
+               mp_context=context, initializer=_batch_init, \
+               initargs=(engine, domain_module, domain_name))
+    failed = []
+    try:
+        futures = [pool.submit(_batch_solve_chunk, chunk, stats != None) \
+                   for (i,chunk) in items]
+        for ((i,chunk), future) in zip(items, futures):
+            try:
+                (chunk_results, chunk_stats) = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                failed.append((i, chunk))
+                continue
+            results[i:i+len(chunk)] = chunk_results
+            if stats != None:
+                stats._add(chunk_stats)
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return failed
+
+
+def _batch_init(engine, domain_module, domain_name):
+    "Set up a batch worker: import the domain module, and set the domain"
+    global _batch_engine
+    if domain_module != None:
+        __import__(domain_module)
+    set_current_domain(domain_name)
+    _batch_engine = engine
+
+
+def _batch_solve(problem, stats=None):
+    """
+    In a batch worker, solve problem and return the plan or an exception.
+    If stats is a SearchStats, add the search's statistics to it.
+    """
+    (state, todo_list) = problem
+    try:
+        if stats == None:
+            return _batch_engine(state, todo_list)
+        # the planners reset their stats, so give each search its own
+        problem_stats = SearchStats()
+        try:
+            return _batch_engine(state, todo_list, stats=problem_stats)
+        finally:
+            stats._add(problem_stats)
+    except Exception as e:
+        return e
+
+
+def _batch_solve_chunk(chunk, with_stats):
+    """
+    In a batch worker, solve each problem in chunk, and return the results
+    and a SearchStats for all of them (or None, if with_stats is False).
+    """
+    stats = SearchStats() if with_stats else None
+    results = [_picklable(_batch_solve(problem, stats)) for problem in chunk]
+    return (results, stats)
 
 
 ################################################################################
 # An actor
 
 
-def run_lazy_lookahead(state, todo_list, verbose=1, max_tries=10):
+def run_lazy_lookahead(state, todo_list, verbose=1, max_tries=10, trace=None,
+                       tracer=None):
     """
     An adaptation of the run_lazy_lookahead algorithm from Ghallab et al.
     (2016), Automated Planning and Acting. It works roughly like this:
@@ -980,11 +5212,22 @@ def run_lazy_lookahead(state, todo_list, verbose=1, max_tries=10):
       - verbose = 0, 1, 2, or 3 indicates how much feedback will be given
         to the user. For details, see find_plan's docstring.
       - max_tries is a bound on how many times to execute the outer loop.
+      - trace (optional) is a list. For each command that succeeds,
+        run_lazy_lookahead appends a pair (action, delta) to it, where delta
+        is the StateDelta that the command made. Applying the deltas in order
+        to a copy of the initial state reproduces the final state.
+      - tracer (optional) is a Tracer, which is given to each call to
+        find_plan and is told about each command. If it isn't given and
+        verbose >= 2, a VerboseTracer is used.
+    If verbose >= 2, run_lazy_lookahead prints each command's delta rather
+    than the entire new state.
       
     Note: whenever run_lazy_lookahead encounters an action for which there is
     no corresponding command definition, it uses the action definition instead.
     """
     
+    if tracer == None and verbose >= 2:
+        tracer = VerboseTracer(verbose)
     if verbose >= 1: 
         print(f"RLL> run_lazy_lookahead, verbose = {verbose}, max_tries = {max_tries}")
         print(f"RLL> initial state: {state.__name__}")
@@ -997,7 +5240,7 @@ def run_lazy_lookahead(state, todo_list, verbose=1, max_tries=10):
                 print(f"RLL> {tries}{ordinals.get(tries)} call to find_plan:\n")
             else:
                 print(f"RLL> {tries}th call to find_plan:\n")
-        plan = find_plan(state, todo_list, verbose=verbose)
+        plan = find_plan(state, todo_list, verbose=verbose, tracer=tracer)
         if plan == False or plan == None:
             if verbose >= 1:
                 raise Exception(
@@ -1020,14 +5263,18 @@ def run_lazy_lookahead(state, todo_list, verbose=1, max_tries=10):
             if verbose >= 1:
                 print('RLL> Command:', [command_name] + list(action[1:]))
             new_state = _apply_command(state, command_func, \
-                                       action[1:], verbose=verbose)
+                                       action[1:], tracer)
             if new_state == False:
                 if verbose >= 1: 
                     print(f'RLL> WARNING: command {command_name} failed; will call find_plan.')
                     break
             else:
-                if verbose >= 2: 
-                    new_state.display()
+                if verbose >= 2 or trace != None:
+                    delta = state.diff(new_state)
+                    if verbose >= 2:
+                        delta.display(heading=f'RLL> Changes made by {command_name}:')
+                    if trace != None:
+                        trace.append((action, delta))
                 state = new_state
         # if state != False then we're here because the plan ended
         if verbose >= 1 and state:
@@ -1055,124 +5302,637 @@ class PriorityQueue:
         heapq.heappush(self.heap, (value, self.time, item))
         self.time += 1
 
+    def __len__(self):
+        return len(self.heap)
 
-def history_string(state, tasks):
-    return state.nameless_repr() + repr(tasks[0]) if tasks else ''
 
-def _apply_action_GBFS(plans, state, task1, more_tasks, plan, depth, h, history, cost, c, a_star, verbose=0):
+###############################################################################
+# Closed sets for GBFS and A*
+#
+# The best-first planners (find_plan_best_first, find_plan_GBFS, and
+# find_plan_a_star) keep a closed set of the search nodes they have
+# generated, and don't put a node into the queue again. Since the closed set
+# holds every node, on large problems it's what uses the most memory. A
+# ClosedSet's policy decides how exact it is, and how much memory it uses.
+
+import math
+
+
+class ClosedSet():
     """
-    apply_action is called only when task1's name matches an action name.
-    It applies the action by retrieving the action's function definition
-    and calling it on the arguments.
+    cs = ClosedSet(policy, max_bytes) creates a closed set for
+    find_plan_best_first, find_plan_GBFS, or find_plan_a_star, which
+    identifies each search node by its state and the first item in its
+    todo list. The policy is one of:
+      - 'exact': store the node's state as encoded by encode_state. This
+        has no false positives, but uses memory proportional to the size
+        of the state for each node.
+      - 'hash' (the default): store the 64-bit history_key of each node,
+        i.e., about 60 bytes per node. Two different nodes get the same
+        key with probability about 2**-64, in which case the second one
+        is wrongly treated as a duplicate.
+      - 'bloom': use a Bloom filter of max_bytes bytes (default 1 MB).
+        The memory is fixed, but the false-positive rate grows as more
+        nodes are added. stats() reports its current estimate.
+      - 'lru': like 'hash', but when the memory would exceed max_bytes
+        (default 64 MB), forget the least recently seen node. Forgetting a
+        node can't make the search miss a plan, but the node may be
+        generated and expanded again.
+
+    After a search, cs.stats() returns a dictionary of statistics about it.
     """
-    if verbose >= 3: print(f'depth {depth} action {task1}: apply action')
-    action = _current_domain._action_dict[task1[0]]
-    newstate = action(state.copy(),*task1[1:])
-    if newstate:
-        history_str = history_string(newstate, more_tasks)
-        if history_str in history:
-            if verbose >= 3:
-                print(f'depth {depth}', end=' ')
-                print(repr(newstate) + ' repeated, not put into queue')
+    _BLOOM_HASHES = 4
+
+    # approximate bytes per entry, measured with tracemalloc
+    _SET_ENTRY_BYTES = 60
+    _LRU_ENTRY_BYTES = 140
+
+    def __init__(self, policy='hash', max_bytes=None):
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.lookups = 0
+        self.hits = 0
+        self.entries = 0
+        self.evictions = 0
+        self.bytes = 0
+        if policy == 'exact' or policy == 'hash':
+            self._table = set()
+        elif policy == 'lru':
+            self._table = collections.OrderedDict()
+            if max_bytes == None:
+                self.max_bytes = 64 << 20
+        elif policy == 'bloom':
+            if max_bytes == None:
+                self.max_bytes = 1 << 20
+            self._bits = bytearray(self.max_bytes)
+            self._nbits = 8 * self.max_bytes
+            self.bytes = self.max_bytes
         else:
-            history[history_str] = True
-            h_new = h(newstate, more_tasks)
-            c_new = cost + c(task1)
-            if a_star:
-                h_new += c_new
-            if verbose >= 3:
-                print(f'depth {depth}', end=' ')
-                print(repr(newstate) + ' with heuristic ' + str(h_new))
-            plans.push(h_new, (newstate, more_tasks, plan+[task1], c_new, depth+1))
-    elif verbose >= 3: print(f'depth {depth} action {task1} not applicable')
-
-def _find_task_method_GBFS(plans, state, task1, more_tasks, plan, depth, h, history, cost, c, a_star, verbose=0):
-    """
-    if task1's name has an entry in the task-method dictionary, iterate
-    through the methods until we find one that's applicable, then apply
-    it to produce a list of subtasks, and call seek_plan recursively on
-    the subtask list + more_tasks.
-    If seek_plan fails, go on to the next method in the list.
-    """
-    if verbose >= 3: 
-        print(f'depth {depth} task {task1}: look for a task method')
-    relevant = _current_domain._task_method_dict[task1[0]]
-    if verbose >= 3:
-        print(f'depth {depth} task {task1} methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} task {task1}: trying method {method.__name__}')
-        subtasks = method(state,*task1[1:])
-        # Can't just say "if subtasks:", because that's wrong if subtasks == []
-        if subtasks != False and subtasks != None:
-            new_todo = subtasks+more_tasks
-            history_str = history_string(state, new_todo)
-            if history_str in history:
-                if verbose >= 3:
-                    print(f'depth {depth} task_method {method.__name__}', \
-                          f'subtasks: {subtasks} repeated, not put into queue')
-            else:
-                history[history_str] = True
-                h_new = h(state, new_todo)
-                c_new = cost  # no action taken yet
-                if a_star:
-                    h_new += c_new
-                if verbose >= 3:
-                    print(f'depth {depth} task_method {method.__name__}', \
-                          f'subtasks: {subtasks} put into queue with heuristic {h_new}')
-                plans.push(h_new, (state, new_todo, plan, c_new, depth+1))
+            raise Exception(f"ClosedSet: unknown policy {policy}")
+
+    def __repr__(self):
+        return f"ClosedSet({self.policy!r}, max_bytes={self.max_bytes})"
+
+    def seen(self, state, tasks):
+        """
+        Return True if the node (state, tasks) is already in the closed
+        set. Otherwise add it and return False.
+        """
+        self.lookups += 1
+        policy = self.policy
+        if policy == 'exact':
+            # the key is never decoded, so pickling values is safe
+            key = encode_state(state, name=False, allow_pickle=True)
+            if tasks:
+                todo1 = tasks[0]
+                try:
+                    key = (key, todo1)
+                    hash(key)
+                except TypeError:
+                    key = (key[0], _freeze(todo1))
+        else:
+            key = history_key(state, tasks)
+        if policy == 'bloom':
+            return self._bloom_seen(key)
+        table = self._table
+        if key in table:
+            self.hits += 1
+            if policy == 'lru':
+                table.move_to_end(key)
+            return True
+        self.entries += 1
+        if policy == 'exact':
+            table.add(key)
+            self.bytes += len(key[0] if type(key) is tuple else key) \
+                + self._SET_ENTRY_BYTES
+        elif policy == 'hash':
+            table.add(key)
+            self.bytes += self._SET_ENTRY_BYTES
+        else:
+            table[key] = True
+            self.bytes += self._LRU_ENTRY_BYTES
+            while self.bytes > self.max_bytes and table:
+                table.popitem(last=False)
+                self.bytes -= self._LRU_ENTRY_BYTES
+                self.entries -= 1
+                self.evictions += 1
+        return False
+
+    def _bloom_seen(self, key):
+        # double hashing: the i'th bit is h1 + i*h2, for i = 0, 1, ...
+        bits = self._bits
+        nbits = self._nbits
+        h1 = key & 0xffffffff
+        h2 = (key >> 32) | 1
+        present = True
+        for i in range(self._BLOOM_HASHES):
+            j = (h1 + i*h2) % nbits
+            mask = 1 << (j & 7)
+            if not bits[j >> 3] & mask:
+                present = False
+                bits[j >> 3] |= mask
+        if present:
+            self.hits += 1
         else:
-            if verbose >= 3:
-                print(f'depth {depth}', \
-                      f'task_method {method.__name__} not applicable')
+            self.entries += 1
+        return present
 
-def find_plan_GBFS(state, todo_list, h, c=lambda a: 1, a_star=False, verbose=0):
+    def false_positive_rate(self):
+        """
+        Return an estimate of the probability that a node that isn't in
+        the closed set would be reported as being in it. It's 0 for
+        'exact'. For 'hash' and 'lru' it's the chance that the node's key
+        is the same as one of the stored keys, i.e., entries/2**64, which
+        is tiny but not 0.
+        """
+        if self.policy == 'bloom':
+            k = self._BLOOM_HASHES
+            return (1 - math.exp(-k * self.entries / self._nbits)) ** k
+        if self.policy == 'exact':
+            return 0.0
+        return self.entries / 2.0**64
+
+    def stats(self):
+        "Return a dictionary of statistics about the closed set"
+        return {'policy': self.policy,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'entries': self.entries,
+                'evictions': self.evictions,
+                'bytes': self.bytes,
+                'false_positive_rate': self.false_positive_rate()}
+
+
+def _closed_set(closed_set):
+    "Return a new ClosedSet if closed_set is a policy name or None"
+    if isinstance(closed_set, ClosedSet):
+        return closed_set
+    return ClosedSet('hash' if closed_set == None else closed_set)
+
+
+def _seek_plan_history(history):
     """
-    h is heuristic. Takes two arguments: state and todo-list
+    Return the closed set for seek_plan_GBFS's or seek_plan_a_star's history
+    argument, which may be a ClosedSet, or a dict or set of history_strings
+    as in earlier versions of Pyhop 2.
+    """
+    if isinstance(history, ClosedSet):
+        return history
+    return _HistoryStrings(history)
+
+
+class _HistoryStrings():
+    """
+    A closed set that keeps the history_string of each node in a dict or
+    set that the caller of seek_plan_GBFS or seek_plan_a_star gave it. It
+    has ClosedSet's seen method, so the planners can use it instead of a
+    ClosedSet. It's much slower than a ClosedSet.
+    """
+    def __init__(self, table):
+        self._table = table
+
+    def seen(self, state, tasks):
+        key = history_string(state, tasks)
+        if key in self._table:
+            return True
+        if type(self._table) is set:
+            self._table.add(key)
+        else:
+            self._table[key] = True
+        return False
+
+
+def history_string(state, tasks):
+    """
+    Deprecated: use history_key, which is much faster. The planners use it
+    only for a dict or set given as seek_plan_GBFS's or seek_plan_a_star's
+    history argument. Return a string that identifies the search node
+    (state, tasks).
+    """
+    return state.nameless_repr() + repr(tasks[0]) if tasks else ''
+
+###############################################################################
+# Best-first search
+#
+# find_plan_best_first, find_plan_GBFS, and find_plan_a_star all use the
+# same search engine, _seek_plan_best_first_steps. It keeps a priority queue
+# of (state, todo_list, plan, cost, depth) nodes, and handles actions,
+# tasks, goals, and multigoals the same way find_plan does, except that
+# instead of trying a todo's methods one at a time, it puts a node for
+# each applicable method into the queue. The planners differ only in the
+# cost function c and in the priority function f: f(hval, cost0, cost1)
+# is the priority of a node whose heuristic value is hval, where cost0 is
+# the cost of its parent's plan and cost1 is the cost of its own plan.
+#
+# Each node that an action produces has a state of its own, so the queue
+# holds about one state per node. In delta-frontier mode (see
+# delta_frontier), a node in the queue keeps only its parent's state and a
+# StateDelta, and the engine rebuilds the node's state when it pops the
+# node. The state object is emptied rather than replaced, so that tracers
+# see the same object in on_generate and on_expand.
+
+
+_delta_frontier = False
+
+
+def delta_frontier(boolean=None):
+    """
+    If boolean is True, then the best-first planners (find_plan_best_first,
+    find_plan_GBFS, find_plan_a_star, and their async versions) will store
+    each node in their priority queue as its parent's state plus a
+    StateDelta, rather than as a state of its own. The queue's memory then
+    grows with the size of the changes that the actions make, rather than
+    with the size of the state, at the cost of a diff when a node is put
+    into the queue and a copy when it's taken out.
+
+    If delta_frontier is called with no argument, it will return the
+    current value of boolean.
+    """
+    global _delta_frontier
+    if boolean != None:
+        _delta_frontier = boolean
+    return _delta_frontier
+
+
+def _empty_state(state, parents, parent):
+    """
+    Replace the bindings of state, a new node's state, with an entry in
+    parents that says how to rebuild them from parent's state
+    """
+    parents[id(state)] = (parent, parent.diff(state))
+    state_vars = vars(state)
+    name = state_vars['__name__']
+    state_vars.clear()
+    state_vars['__name__'] = name
+
+
+def _refill_state(state, parents):
+    "Rebuild the bindings of a state that _empty_state emptied"
+    (parent, delta) = parents.pop(id(state))
+    vars(state).update(vars(parent.copy(state.__name__)))
+    _apply_delta(state, delta)
+
+
+def _best_first_priority(policy, weight):
+    "Return the priority function for find_plan_best_first's policy"
+    if policy == 'greedy':
+        return lambda hval, cost0, cost1: hval
+    elif policy == 'a_star':
+        return lambda hval, cost0, cost1: cost1 + hval
+    elif policy == 'weighted_a_star':
+        return lambda hval, cost0, cost1: cost1 + weight*hval
+    raise Exception(f"find_plan_best_first: unknown policy {policy}")
+
+
+def find_plan_best_first(state, todo_list, h, policy='a_star', c=None,
+                         weight=2, verbose=0, closed_set=None, budget=None,
+                         stats=None, tracer=None):
+    """
+    Do a best-first search for a plan for todo_list, which may contain
+    actions, tasks, goals, and multigoals, and return the plan or False.
+    Goals and multigoals are handled as in find_plan (see verify_goals).
+     - h is a heuristic function like find_plan_GBFS's h.
+     - policy tells how to order the nodes in the priority queue. If it's
+       'greedy', a node's priority is h's value, as in find_plan_GBFS. If
+       it's 'a_star', it's cost + h, where cost is the cost of the node's
+       partial plan. If it's 'weighted_a_star', it's cost + weight*h; with
+       weight > 1, this usually finds a plan much sooner than 'a_star',
+       and if h is admissible, the plan costs at most weight times as
+       much as an optimal one.
+     - c is a function like find_plan_GBFS's c, which returns an action's
+       cost. If it isn't given, the costs are the ones declared with
+       declare_actions_cost.
+     - verbose, closed_set, budget, stats, and tracer are as in
+       find_plan_GBFS.
+    """
+    return _run_steps(_find_plan_best_first_steps(state, todo_list, h, \
+                      _action_cost if c == None else c, \
+                      _best_first_priority(policy, weight), \
+                      'find_plan_best_first', verbose, closed_set, budget, \
+                      None, stats, tracer))
+
+
+def _find_plan_best_first_steps(state, todo_list, h, c, f, planner, verbose,
+                                closed_set, budget, yield_every=None,
+                                stats=None, tracer=None, root_priority=None):
+    """
+    A generator that does the work of a best-first planner, like
+    _find_plan_steps. planner is the planner's name, c and f are as
+    described above, and root_priority is the priority of the initial
+    node; if it's None, it's computed from h.
     """
     if verbose >= 1: 
         todo_list_str =     \
             '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
         print(f'FP> find_plan, verbose={verbose}:')
         print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
+    todo_list = _link(todo_list)
+    history = _closed_set(closed_set)
+    history.seen(state, todo_list)
+    deltas = _delta_frontier
+    if budget != None:
+        budget._start(state, shared_state=deltas)
+    stats = _search_stats(stats)
+    tracer = _tracer(tracer, verbose, planner, state, todo_list)
+    if root_priority == None:
+        root_priority = f(_estimate(h, state, todo_list, stats), 0, 0)
     plans = PriorityQueue()
-    plans.push(0, (state, todo_list, [], 0, 0))
-    result = seek_plan_GBFS(plans, h, c, {history_string(state, todo_list): True}, a_star, verbose)
-    if verbose >= 1: print('FP> result =',result,'\n')
+    plans.push(root_priority, (state, todo_list, _nil, 0, 0))
+    steps = _seek_plan_best_first_steps(plans, h, c, f, history, tracer, \
+                                        budget, yield_every, stats, \
+                                        {} if deltas else None)
+    if stats != None:
+        steps = _timed_steps(steps, stats)
+    result = yield from steps
+    if tracer != None: tracer.on_finish(result)
+    if verbose >= 1:
+        if closed_set != None:
+            print('FP> closed set:', history.stats())
+        if stats != None:
+            print('FP> search stats:', stats.stats())
+        print('FP> result =',result,'\n')
     return result
 
 
-def seek_plan_GBFS(plans, h, c, history, a_star, verbose=0):
+def _seek_plan_best_first_steps(plans, h, c, f, history, tracer=None,
+                                budget=None, yield_every=None, stats=None,
+                                parents=None):
     """
-    plans is a priority queue with (state, todo_list, plan, depth) tuples sorted by heuristic
+    A generator that searches for a plan, starting with the nodes in plans
+    (a PriorityQueue). If yield_every is a number, it yields _pause after
+    every yield_every expansions. tracer is None or a Tracer, and stats is
+    None or a SearchStats.
+    If parents is a dict, the nodes that actions produce are put into plans
+    with emptied states (see _empty_state), and parents is where their
+    parents and deltas are kept.
+    It returns the plan, or False, or a BudgetExhausted object.
     """
+    dispatch = _dispatch_dict(_best_first_handlers)
+    expansions = 0  # expansions since the last pause
+    last_depth = -1 # the depth of the last node expanded
     while plans:
         h_pop, (state, todo_list, plan, cost, depth) = plans.pop()
-        if verbose >= 2: 
-            todo_list_str =     \
-                    '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
-            print(f'depth {depth} todo_list ' + todo_list_str + f' popped with heuristic {h_pop}')
-        if todo_list == []:
-            if verbose >= 3:
-                print(f'depth {depth} no more tasks or goals, return plan')
-            return plan
-        todo1 = todo_list[0]
-        ttype = get_type(todo1)
-        if ttype in {'list','tuple'}:
-            if todo1[0] in _current_domain._action_dict:
-                _apply_action_GBFS(plans, state, todo1, todo_list[1:], \
-                                plan, depth, h, history, cost, c, a_star, verbose=verbose)
-            elif todo1[0] in _current_domain._task_method_dict:
-                _find_task_method_GBFS(plans, state, todo1, todo_list[1:], \
-                                    plan, depth, h, history, cost, c, a_star, verbose=verbose)
+        if parents and id(state) in parents:
+            _refill_state(state, parents)
+        if tracer != None: tracer.on_expand(depth, state, todo_list, h_pop)
+        if not todo_list:
+            if tracer != None: tracer.on_solution(depth)
+            return _plan_list(plan)
+        if budget != None:
+            exhausted = budget._charge(len(plans))
+            if exhausted != None:
+                if tracer != None:
+                    tracer.on_budget_exhausted(depth, exhausted)
+                return exhausted
+        if yield_every != None:
+            expansions += 1
+            if expansions >= yield_every:
+                expansions = 0
+                yield _pause
+        if stats != None:
+            stats._expand(depth, len(plans))
+            if depth != last_depth + 1:
+                stats.backtracks += 1
+            last_depth = depth
+        (todo1, more) = (todo_list.first, todo_list.rest)
+        if isinstance(todo1, Multigoal):
+            handler = _apply_multigoal_methods_best_first
+        elif type(todo1) is tuple or type(todo1) is list:
+            handler = dispatch.get(todo1[0])
         else:
+            handler = None
+        if handler == None:
             raise Exception(    \
                 f"depth {depth}: {todo1} isn't an action, task, goal, or multigoal\n")
+        handler(plans, state, todo1, more, plan, cost, depth, h, c, f, \
+                history, tracer, stats, parents)
     return False
 
+
+def _estimate(h, state, todo_list, stats):
+    "Return h's estimate for the node (state, todo_list)"
+    if stats == None:
+        return h(state, todo_list)
+    return stats._estimate(h, state, todo_list)
+
+
+def _apply_action_best_first(plans, state, task1, more_tasks, plan, cost, \
+                             depth, h, c, f, history, tracer=None, stats=None, \
+                             parents=None):
+    """
+    Apply the action task1 to state, and if it's applicable and the new
+    node isn't in the closed set history, put the new node into plans. If
+    parents is a dict, the new node's state is emptied (see _empty_state).
+    """
+    if tracer != None: tracer.on_action_try(depth, task1)
+    action = _current_domain._action_dict[task1[0]]
+    if stats == None:
+        newstate = action(state.copy(),*task1[1:])
+    else:
+        newstate = stats._apply(action, state.copy(), task1)
+    if not newstate:
+        if tracer != None: tracer.on_action(depth, task1, newstate)
+    elif history.seen(newstate, more_tasks):
+        if tracer != None:
+            tracer.on_action(depth, task1, newstate, duplicate=True)
+        if stats != None:
+            stats.duplicates += 1
+    else:
+        h_new = _estimate(h, newstate, more_tasks, stats)
+        if tracer != None:
+            tracer.on_action(depth, task1, newstate, heuristic=h_new)
+        c_new = cost + c(task1)
+        priority = f(h_new, cost, c_new)
+        plans.push(priority, (newstate, more_tasks, _Link(task1, plan), \
+                              c_new, depth+1))
+        if tracer != None:
+            tracer.on_generate(depth+1, newstate, more_tasks, priority)
+        if parents != None:
+            _empty_state(newstate, parents, state)
+
+
+def _apply_task_methods_best_first(plans, state, task1, more_tasks, plan, \
+                                   cost, depth, h, c, f, history, \
+                                   tracer=None, stats=None, parents=None):
+    "Apply task1's relevant methods (see _apply_methods_best_first)"
+    relevant = _current_domain._task_method_dict[task1[0]]
+    _apply_methods_best_first(plans, 'task', state, task1, more_tasks, plan, \
+                              cost, depth, h, f, history, tracer, stats, \
+                              relevant, task1[1:])
+
+
+def _apply_goal_methods_best_first(plans, state, goal1, more_goals, plan, \
+                                   cost, depth, h, c, f, history, \
+                                   tracer=None, stats=None, parents=None):
+    """
+    Apply goal1's relevant methods (see _apply_methods_best_first). If goal1
+    is already achieved, put a node for more_goals into plans instead.
+    """
+    (state_var_name, arg, val) = goal1
+    if getattr(state,state_var_name).get(arg) == val:
+        if tracer != None: tracer.on_choice(depth, 'goal', goal1, None)
+        if history.seen(state, more_goals):
+            if stats != None:
+                stats.duplicates += 1
+            return
+        priority = f(_estimate(h, state, more_goals, stats), cost, cost)
+        plans.push(priority, (state, more_goals, plan, cost, depth+1))
+        if tracer != None:
+            tracer.on_generate(depth+1, state, more_goals, priority)
+        return
+    relevant = _current_domain._goal_method_dict[state_var_name]
+    _apply_methods_best_first(plans, 'goal', state, goal1, more_goals, plan, \
+                              cost, depth, h, f, history, tracer, stats, \
+                              relevant, (arg, val))
+
+
+def _apply_multigoal_methods_best_first(plans, state, multigoal1, more_goals, \
+                                        plan, cost, depth, h, c, f, history, \
+                                        tracer=None, stats=None, parents=None):
+    "Apply the multigoal methods to multigoal1 (see _apply_methods_best_first)"
+    _apply_methods_best_first(plans, 'multigoal', state, multigoal1, \
+                              more_goals, plan, cost, depth, h, f, history, \
+                              tracer, stats, \
+                              _current_domain._multigoal_method_list, \
+                              (multigoal1,))
+
+
+# The handlers for the best-first planners' dispatch table (see
+# _dispatch_dict). They all take the same arguments.
+_best_first_handlers = (_apply_action_best_first, \
+                        _apply_task_methods_best_first, \
+                        _apply_goal_methods_best_first)
+
+
+def _apply_methods_best_first(plans, kind, state, todo1, more, plan, cost, \
+                              depth, h, f, history, tracer, stats, relevant, \
+                              args):
+    """
+    todo1 is a task, goal, or multigoal (kind is 'task', 'goal', or
+    'multigoal'), and relevant is its list of relevant methods. Apply each
+    of them to state and args, and put a node into plans for each one
+    that's applicable and doesn't produce a node that's in the closed set
+    history. As in _next_method, the node's todo_list is the method's
+    subtasks or subgoals, plus a verification task for a goal or
+    multigoal, plus more.
+    """
+    if tracer != None: tracer.on_choice(depth, kind, todo1, relevant)
+    for method in relevant:
+        if tracer != None: tracer.on_method_try(depth, kind, todo1, method)
+        if stats == None:
+            result = method(state,*args)
+        else:
+            result = stats._try(method, state,*args)
+        if tracer != None and kind == 'task':
+            _trace_verify(tracer, todo1, method)
+        # Can't just say "if result:", because that's wrong if result == []
+        if result == False or result == None:
+            if tracer != None:
+                tracer.on_method(depth, kind, todo1, method, result)
+            continue
+        if kind == 'task' or not _verify_goals:
+            new_todo = _link(result, more)
+        elif kind == 'goal':
+            new_todo = _link(result + [('_verify_g', method.__name__, \
+                            *todo1, depth)], more)
+        else:
+            new_todo = _link(result + [('_verify_mg', method.__name__, \
+                            todo1, depth)], more)
+        if history.seen(state, new_todo):
+            if tracer != None:
+                tracer.on_method(depth, kind, todo1, method, result, \
+                                 duplicate=True)
+            if stats != None:
+                stats.duplicates += 1
+        else:
+            h_new = _estimate(h, state, new_todo, stats)
+            if tracer != None:
+                tracer.on_method(depth, kind, todo1, method, result, \
+                                 heuristic=h_new)
+            priority = f(h_new, cost, cost)     # no action taken yet
+            plans.push(priority, (state, new_todo, plan, cost, depth+1))
+            if tracer != None:
+                tracer.on_generate(depth+1, state, new_todo, priority)
+
+
 ###############################################################################
-# A*
-import heapq
+# GBFS and A*
+
+
+def find_plan_GBFS(state, todo_list, h, c=lambda a: 1, a_star=False, verbose=0,
+                   closed_set=None, budget=None, stats=None, tracer=None):
+    """
+    h is heuristic. Takes two arguments: state and todo-list. The todo-list
+    is a read-only sequence (see "Linked lists"), not an ordinary list.
+    closed_set is a ClosedSet, or the name of a ClosedSet policy. It
+    defaults to 'hash'. To see its statistics afterward, pass a ClosedSet.
+    budget is a Budget. If it runs out before a plan is found, the result
+    is a BudgetExhausted object rather than False.
+    stats is a SearchStats, in which to collect statistics about the search.
+    tracer is a Tracer, as in find_plan.
+    If a_star is True, a node's priority is h plus the cost of its partial
+    plan (according to c); otherwise it's just h. The todo list may contain
+    goals and multigoals as well as tasks (see find_plan_best_first).
+    """
+    return _run_steps(_find_plan_GBFS_steps(state, todo_list, h, c, a_star, \
+                                            verbose, closed_set, budget, \
+                                            None, stats, tracer))
+
+
+def _find_plan_GBFS_steps(state, todo_list, h, c, a_star, verbose,
+                          closed_set, budget, yield_every=None, stats=None,
+                          tracer=None):
+    """
+    Return a generator that does find_plan_GBFS's work, like
+    _find_plan_steps. The initial node's priority is 0.
+    """
+    return _find_plan_best_first_steps(state, todo_list, h, c, \
+        _gbfs_priority(a_star), 'find_plan_GBFS', verbose, closed_set, \
+        budget, yield_every, stats, tracer, root_priority=0)
+
+
+def _gbfs_priority(a_star):
+    "Return find_plan_GBFS's priority function"
+    if a_star:
+        return lambda hval, cost0, cost1: hval + cost1
+    return lambda hval, cost0, cost1: hval
+
+
+def seek_plan_GBFS(plans, h, c, history, a_star, verbose=0, budget=None):
+    """
+    plans is a priority queue with (state, todo_list, plan, cost, depth) tuples sorted by heuristic
+    The todo lists and plans may be lists or _Links (see _seek_plan_nodes).
+    history is a ClosedSet, or a dict or set of the history_strings of the
+    nodes that have been generated.
+    """
+    _seek_plan_nodes(plans)
+    tracer = _tracer(None, verbose, 'seek_plan_GBFS', None, None)
+    return _run_steps(_seek_plan_best_first_steps(plans, h, c, \
+                      _gbfs_priority(a_star), _seek_plan_history(history), \
+                      tracer, budget))
+
+
+def _seek_plan_nodes(plans):
+    """
+    Put the nodes in plans, a PriorityQueue given to seek_plan_GBFS or
+    seek_plan_a_star, into the form that _seek_plan_best_first_steps uses.
+    Todo lists and plans that are lists become _Links (with the plan in
+    reverse order), and a node (state, todo_list, plan, depth), as in
+    earlier versions of seek_plan_a_star, gets the cost of its plan. The
+    nodes' priorities don't change, so the heap stays in order.
+    """
+    heap = plans.heap
+    for (i,(priority, time, node)) in enumerate(heap):
+        if len(node) == 4:
+            (state, todo_list, plan, depth) = node
+            cost = current_cost(plan)
+        else:
+            (state, todo_list, plan, cost, depth) = node
+        if len(node) == 5 and type(todo_list) is _Link and type(plan) is _Link:
+            continue
+        plan = plan if type(plan) is _Link else _link(plan[::-1])
+        heap[i] = (priority, time, (state, _link(todo_list), plan, cost, depth))
+
 
 def current_cost(plan):
     cost = 0
@@ -1180,117 +5940,162 @@ def current_cost(plan):
         cost = cost + _current_domain._action_cost_dict[item[0]]
     return cost
 
-def _apply_action_a_star(plans, state, task1, more_tasks, plan, depth, h, history, verbose=0):
+
+def find_plan_a_star(state, todo_list, h, verbose=0, closed_set=None,
+                     budget=None, stats=None, tracer=None):
     """
-    apply_action is called only when task1's name matches an action name.
-    It applies the action by retrieving the action's function definition
-    and calling it on the arguments.
+    h is heuristic. Takes two arguments: state and todo-list
+    closed_set, budget, stats, and tracer are as in find_plan_GBFS.
+    The actions' costs are the ones declared with declare_actions_cost.
     """
-    if verbose >= 3: print(f'depth {depth} action {task1}: apply action')
-    action = _current_domain._action_dict[task1[0]]
-    newstate = action(state.copy(),*task1[1:])
-    if newstate:
-        history_str = history_string(newstate, more_tasks)
-        if history_str in history:
-            if verbose >= 3:
-                print(f'depth {depth}', end=' ')
-                print(repr(newstate) + ' repeated, not put into queue')
-        else:
-            history[history_str] = True
-            h_new = h(newstate, more_tasks)
-            h_old = current_cost(plan)
-            h_use = h_new + h_old
-            if verbose >= 3:
-                print(f'depth {depth}', end=' ')
-                print(repr(newstate) + ' with heuristic ' + str(h_new))
-            plans.push(h_use, (newstate, more_tasks, plan+[task1], depth+1))
-    elif verbose >= 3: print(f'depth {depth} action {task1} not applicable')
-
-def _find_task_method_a_star(plans, state, task1, more_tasks, plan, depth, h, history, verbose=0):
-    """
-    if task1's name has an entry in the task-method dictionary, iterate
-    through the methods until we find one that's applicable, then apply
-    it to produce a list of subtasks, and call seek_plan recursively on
-    the subtask list + more_tasks.
-    If seek_plan fails, go on to the next method in the list.
-    """
-    if verbose >= 3: 
-        print(f'depth {depth} task {task1}: look for a task method')
-    relevant = _current_domain._task_method_dict[task1[0]]
-    if verbose >= 3:
-        print(f'depth {depth} task {task1} methods {[m.__name__ for m in relevant]}')
-    for method in relevant:
-        if verbose >= 3: 
-            print(f'depth {depth} task {task1}: trying method {method.__name__}')
-        subtasks = method(state,*task1[1:])
-        # Can't just say "if subtasks:", because that's wrong if subtasks == []
-        if subtasks != False and subtasks != None:
-            new_todo = subtasks+more_tasks
-            history_str = history_string(state, new_todo)
-            if history_str in history:
-                if verbose >= 3:
-                    print(f'depth {depth} task_method {method.__name__}', \
-                          f'subtasks: {subtasks} repeated, not put into queue')
-            else:
-                history[history_str] = True
-                h_new = h(state, new_todo)
-                h_old = current_cost(plan)
-                h_use = h_new + h_old
-                if verbose >= 3:
-                    print(f'depth {depth} task_method {method.__name__}', \
-                          f'subtasks: {subtasks} put into queue with heuristic {h_new}')
-                plans.push(h_use, (state, new_todo, plan, depth+1))
-        else:
-            if verbose >= 3:
-                print(f'depth {depth}', \
-                      f'task_method {method.__name__} not applicable')
+    return _run_steps(_find_plan_a_star_steps(state, todo_list, h, verbose, \
+                                     closed_set, budget, None, stats, tracer))
 
-def find_plan_a_star(state, todo_list, h, verbose=0):
+
+def _find_plan_a_star_steps(state, todo_list, h, verbose, closed_set, budget,
+                            yield_every=None, stats=None, tracer=None):
     """
-    h is heuristic. Takes two arguments: state and todo-list
+    Return a generator that does find_plan_a_star's work, like
+    _find_plan_steps.
     """
-    if verbose >= 1: 
-        todo_list_str =     \
-            '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
-        print(f'FP> find_plan, verbose={verbose}:')
-        print(f'    state = {state.__name__}\n    todo_list = {todo_list_str}')
-    plans = PriorityQueue()
-    #f(n) = 0 here, only g(n) needed
-    plans.push(h(state, todo_list), (state, todo_list, [], 0))
-    result = seek_plan_a_star(plans, h, {history_string(state, todo_list): True}, verbose)
-    if verbose >= 1: print('FP> result =',result,'\n')
-    return result
+    return _find_plan_best_first_steps(state, todo_list, h, _action_cost, \
+        _a_star_priority, 'find_plan_a_star', verbose, closed_set, budget, \
+        yield_every, stats, tracer)
 
 
-def seek_plan_a_star(plans, h, history, verbose=0):
+def _a_star_priority(hval, cost0, cost1):
     """
-    plans is a priority queue with (state, todo_list, plan, depth) tuples sorted by heuristic
+    find_plan_a_star's priority function. It has always added the cost of
+    the parent's plan rather than the node's own plan, and still does so
+    that it finds the same plans; find_plan_best_first's 'a_star' policy
+    uses the node's own cost.
     """
-    while plans:
-        h_pop, (state, todo_list, plan, depth) = plans.pop()
-        if verbose >= 2: 
-            todo_list_str =     \
-                    '[' + ', '.join([_todo_to_string(x) for x in todo_list]) + ']'
-            print(f'depth {depth} todo_list ' + todo_list_str + f' popped with heuristic {h_pop}')
-        if todo_list == []:
-            if verbose >= 3:
-                print(f'depth {depth} no more tasks or goals, return plan')
-            return plan
-        todo1 = todo_list[0]
-        ttype = get_type(todo1)
-        if ttype in {'list','tuple'}:
-            if todo1[0] in _current_domain._action_dict:
-                _apply_action_a_star(plans, state, todo1, todo_list[1:], \
-                                plan, depth, h, history, verbose=verbose)
-            elif todo1[0] in _current_domain._task_method_dict:
-                _find_task_method_a_star(plans, state, todo1, todo_list[1:], \
-                                    plan, depth, h, history, verbose=verbose)
-        else:
-            raise Exception(    \
-                f"depth {depth}: {todo1} isn't an action, task, goal, or multigoal\n")
-    return False
+    return hval + cost0
+
+
+def seek_plan_a_star(plans, h, history, verbose=0, budget=None):
+    """
+    plans is a priority queue with (state, todo_list, plan, cost, depth) tuples sorted by heuristic
+    It may also contain (state, todo_list, plan, depth) tuples, as in
+    earlier versions of Pyhop 2. history is as in seek_plan_GBFS.
+    """
+    _seek_plan_nodes(plans)
+    tracer = _tracer(None, verbose, 'seek_plan_a_star', None, None)
+    return _run_steps(_seek_plan_best_first_steps(plans, h, _action_cost, \
+                      _a_star_priority, _seek_plan_history(history), \
+                      tracer, budget))
+
+
+###############################################################################
+# Asynchronous planning
+#
+# find_plan_async, find_plan_best_first_async, find_plan_GBFS_async, and
+# find_plan_a_star_async are coroutines that do the same search as
+# find_plan, find_plan_best_first, find_plan_GBFS, and find_plan_a_star,
+# but give control back to the event loop after every yield_every node
+# expansions, so that an asyncio program can run several searches at once
+# without blocking its other tasks. The planners' generators
+# (_find_plan_steps, etc.) do the searching, and _run_async awaits
+# asyncio.sleep(0) each time one of them pauses.
+#
+# Cancelling the task that's running the search, or using asyncio.timeout
+# or asyncio.wait_for, stops the search at its next pause.
+#
+# Each search uses the domain and the state-copying modes (copy_on_write,
+# undo_trail, and delta_frontier) that are current when the function is
+# called, even if the search doesn't start until later. While a search is
+# paused, other tasks may change them, so _run_async sets them back to the
+# search's own each time the search resumes, and restores the other tasks'
+# when it pauses. For this reason the four functions aren't declared with
+# "async def"; instead each of them returns the coroutine that _run_async
+# creates, which you can await.
+
+import asyncio
+
+
+def find_plan_async(state, todo_list, verbose=0, nogoods=None, budget=None,
+                    yield_every=100, stats=None, tracer=None,
+                    cycle_check=False):
+    """
+    Like find_plan, but returns a coroutine that lets other asyncio tasks
+    run after every yield_every node expansions. For example,
+        plan = await asyncio.wait_for(find_plan_async(state, todo_list), 5)
+    raises TimeoutError if there's no answer within 5 seconds.
+    """
+    return _run_async(_find_plan_steps(state, todo_list, verbose, nogoods, \
+                        budget, yield_every, stats, tracer, cycle_check), \
+                      _search_modes())
+
+
+def find_plan_best_first_async(state, todo_list, h, policy='a_star', c=None,
+                               weight=2, verbose=0, closed_set=None,
+                               budget=None, yield_every=100, stats=None,
+                               tracer=None):
+    """
+    Like find_plan_best_first, but returns a coroutine that lets other
+    asyncio tasks run after every yield_every node expansions.
+    """
+    return _run_async(_find_plan_best_first_steps(state, todo_list, h, \
+                      _action_cost if c == None else c, \
+                      _best_first_priority(policy, weight), \
+                      'find_plan_best_first', verbose, closed_set, budget, \
+                      yield_every, stats, tracer), _search_modes())
+
+
+def find_plan_GBFS_async(state, todo_list, h, c=lambda a: 1, a_star=False,
+                         verbose=0, closed_set=None, budget=None,
+                         yield_every=100, stats=None, tracer=None):
+    """
+    Like find_plan_GBFS, but returns a coroutine that lets other asyncio
+    tasks run after every yield_every node expansions.
+    """
+    return _run_async(_find_plan_GBFS_steps(state, todo_list, h, c, a_star, \
+                      verbose, closed_set, budget, yield_every, stats, \
+                      tracer), _search_modes())
+
+
+def find_plan_a_star_async(state, todo_list, h, verbose=0, closed_set=None,
+                           budget=None, yield_every=100, stats=None,
+                           tracer=None):
+    """
+    Like find_plan_a_star, but returns a coroutine that lets other asyncio
+    tasks run after every yield_every node expansions.
+    """
+    return _run_async(_find_plan_a_star_steps(state, todo_list, h, verbose, \
+                      closed_set, budget, yield_every, stats, tracer), \
+                      _search_modes())
+
+
+def _search_modes():
+    """
+    Return the current domain and state-copying modes, as a tuple for
+    _run_async.
+    """
+    return (_current_domain, _copy_on_write, _use_trail, _delta_frontier)
 
 
+async def _run_async(steps, modes):
+    """
+    Run steps, one of the planners' generators, with the domain and
+    state-copying modes in modes (see _search_modes), awaiting
+    asyncio.sleep(0) each time it pauses, and return the value it returns.
+    """
+    global _current_domain, _copy_on_write, _use_trail, _delta_frontier
+    try:
+        while True:
+            outer_modes = _search_modes()
+            (_current_domain, _copy_on_write, _use_trail, _delta_frontier) = \
+                modes
+            try:
+                next(steps)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                (_current_domain, _copy_on_write, _use_trail, \
+                 _delta_frontier) = outer_modes
+            await asyncio.sleep(0)
+    finally:
+        steps.close()
 
 
 ###############################################################################
@@ -0,0 +1,17 @@
+import os, sys
+
+import pytest
+
+# pyhop2 and the example domains are in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyhop2
+
+
+@pytest.fixture(autouse=True)
+def default_modes():
+    "Put back the default state-copying modes after each test"
+    yield
+    pyhop2.undo_trail(False)
+    pyhop2.copy_on_write(False)
+    pyhop2.delta_frontier(False)
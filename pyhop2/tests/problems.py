@@ -0,0 +1,84 @@
+"""
+Planning problems from the example domains, for use in the tests. Each
+problem is a tuple (name, domain_name, state, todo_list); the states and
+multigoals are made fresh for each call, so a test can't change another
+test's problems.
+"""
+
+import pyhop2
+import simple_tasks1, simple_tasks2, backtracking_tasks, blocks_tasks
+import simple_goals, blocks_goals
+
+
+def blocks_state1():
+    state1 = pyhop2.State('state1')
+    state1.pos = {'a':'b', 'b':'table', 'c':'table'}
+    state1.clear = {'c':True, 'b':False, 'a':True}
+    state1.holding = {'hand':False}
+    return state1
+
+
+def blocks_state2():
+    state2 = pyhop2.State('state2')
+    state2.pos = {'a':'c', 'b':'d', 'c':'table', 'd':'table'}
+    state2.clear = {'a':True, 'c':False, 'b':True, 'd':False}
+    state2.holding = {'hand':False}
+    return state2
+
+
+def multigoal(name, **state_vars):
+    goal = pyhop2.Multigoal(name)
+    for (varname,val) in state_vars.items():
+        setattr(goal, varname, val)
+    return goal
+
+
+def task_problems():
+    "Return problems whose todo lists contain only actions and tasks"
+    return [
+        ('simple_tasks1_alice', 'simple_tasks1', simple_tasks1.state0.copy(),
+         [('travel','alice','park')]),
+        ('simple_tasks1_both', 'simple_tasks1', simple_tasks1.state0.copy(),
+         [('travel','alice','park'), ('travel','bob','park')]),
+        ('simple_tasks2_a', 'simple_tasks2', simple_tasks2.state0a.copy(),
+         [('travel','alice','park')]),
+        ('simple_tasks2_b', 'simple_tasks2', simple_tasks2.state0b.copy(),
+         [('travel','bob','park')]),
+        ('backtracking_need0', 'backtracking_tasks',
+         backtracking_tasks.state0.copy(), [('put_it',), ('need0',)]),
+        ('backtracking_need01', 'backtracking_tasks',
+         backtracking_tasks.state0.copy(), [('put_it',), ('need01',)]),
+        ('backtracking_need10', 'backtracking_tasks',
+         backtracking_tasks.state0.copy(), [('put_it',), ('need10',)]),
+        ('backtracking_need1', 'backtracking_tasks',
+         backtracking_tasks.state0.copy(), [('put_it',), ('need1',)]),
+        ('blocks_tasks_get', 'blocks_tasks', blocks_state1(), [('get','a')]),
+        ('blocks_tasks_move_one', 'blocks_tasks', blocks_state1(),
+         [('move_one','a','table')]),
+        ('blocks_tasks_goal1a', 'blocks_tasks', blocks_state1(),
+         [('move_blocks', multigoal('goal1a',
+                            pos={'c':'b', 'b':'a', 'a':'table'}))]),
+        ('blocks_tasks_goal1b', 'blocks_tasks', blocks_state1(),
+         [('move_blocks', multigoal('goal1b', pos={'c':'b', 'b':'a'}))]),
+        ('blocks_tasks_goal2b', 'blocks_tasks', blocks_state2(),
+         [('move_blocks', multigoal('goal2b', pos={'b':'c', 'a':'d'}))]),
+        ]
+
+
+def goal_problems():
+    "Return problems whose todo lists contain goals or multigoals"
+    return [
+        ('simple_goals_alice', 'simple_goals', simple_goals.state0.copy(),
+         [('loc','alice','park')]),
+        ('simple_goals_both', 'simple_goals', simple_goals.state0.copy(),
+         [('loc','alice','park'), ('loc','bob','park')]),
+        ('simple_goals_goal3', 'simple_goals', simple_goals.state0.copy(),
+         [multigoal('goal3', loc={'alice':'park', 'bob':'park'})]),
+        ('blocks_goals_pos', 'blocks_goals', blocks_state1(),
+         [('pos','a','table')]),
+        ('blocks_goals_goal1a', 'blocks_goals', blocks_state1(),
+         [multigoal('goal1a', pos={'c':'b', 'b':'a', 'a':'table'})]),
+        ('blocks_goals_goal2a', 'blocks_goals', blocks_state2(),
+         [multigoal('goal2a', pos={'b':'c', 'a':'d', 'c':'table',
+                                   'd':'table'})]),
+        ]
@@ -0,0 +1,240 @@
+"""
+Tests of the planners that run searches in worker processes.
+"""
+
+import os
+import time
+
+import pytest
+
+import pyhop2
+import problems
+
+
+def all_problems():
+    return problems.task_problems() + problems.goal_problems()
+
+
+def problem_ids(problem_list):
+    return [p[0] for p in problem_list]
+
+
+@pytest.fixture
+def choice_domain():
+    """
+    A domain in which the task 'choose' has a slow method whose plan is
+    [('wait',)], and a fast one whose search raises an exception
+    """
+    old_domain = pyhop2.current_domain()
+    pyhop2.Domain('choice_domain')
+    def wait(state):
+        time.sleep(0.3)
+        return state
+    def fail(state):
+        return False
+    pyhop2.declare_actions(wait, fail)
+    pyhop2.declare_task_methods('choose',
+                                lambda state: [('wait',)],
+                                lambda state: [('broken',)])
+    pyhop2.declare_task_methods('choose_failing',
+                                lambda state: [('fail',)],
+                                lambda state: [('broken',)])
+    pyhop2.declare_task_methods('broken', lambda state: [('undeclared',)])
+    pyhop2.declare_task_methods('undeclared_later',
+                                lambda state: [('wait',)],
+                                lambda state: [('undeclared',)])
+    yield
+    pyhop2.set_current_domain(old_domain)
+    pyhop2.remove_domain('choice_domain')
+
+
+@pytest.mark.parametrize('problem', all_problems(),
+                         ids=problem_ids(all_problems()))
+def test_find_plan_parallel(problem):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    expected = pyhop2.find_plan(state, todo_list)
+    plan = pyhop2.find_plan_parallel(state, todo_list, processes=2, levels=2)
+    assert plan == expected
+    plan = pyhop2.find_plan_parallel(state, todo_list, processes=2,
+                                     first_found=True)
+    assert bool(plan) == bool(expected)
+
+
+def test_find_plan_parallel_stats():
+    # the split search here isn't counted, so use a problem that it
+    # splits into subproblems for the workers
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.SearchStats()
+    plan = pyhop2.find_plan_parallel(state, todo_list, processes=2,
+                                     levels=2, stats=stats)
+    assert plan == pyhop2.find_plan(state, todo_list)
+    assert stats.expanded > 0 and stats.seconds > 0
+    assert stats.action_attempts['getv'] >= 2
+
+
+def test_parallel_exception_after_plan(choice_domain):
+    # the second subproblem's exception comes back first, but find_plan
+    # would have returned the first subproblem's plan
+    state = pyhop2.State('state')
+    assert pyhop2.find_plan(state, [('choose',)]) == [('wait',)]
+    assert pyhop2.find_plan_parallel(state, [('choose',)], processes=2,
+                                     levels=1) == [('wait',)]
+    assert pyhop2.find_plan_parallel(state, [('choose',)], processes=2,
+                                     levels=1, first_found=True) == [('wait',)]
+    # the unknown todo is found while splitting the search
+    assert pyhop2.find_plan_parallel(state, [('undeclared_later',)],
+                                     processes=2, levels=1) == [('wait',)]
+
+
+@pytest.mark.parametrize('first_found', [False, True])
+def test_parallel_exception_without_plan(choice_domain, first_found):
+    state = pyhop2.State('state')
+    with pytest.raises(Exception, match="isn't an action, task, goal"):
+        pyhop2.find_plan_parallel(state, [('choose_failing',)], processes=2,
+                                  levels=1, first_found=first_found)
+
+
+def test_parallel_split_stops_on_endless_decomposition():
+    pyhop2.set_current_domain('blocks_tasks')
+    state = problems.blocks_state1()
+    goal = problems.multigoal('impossible', pos={'a':'a'})
+    assert pyhop2.find_plan_parallel(state, [('move_blocks', goal)],
+                                     processes=2, cycle_check=True) == False
+
+
+def blocks_problems():
+    return [(state, todo_list) for (name, domain_name, state, todo_list)
+            in problems.task_problems() if domain_name == 'blocks_tasks']
+
+
+def crash_on_marked_state(state, todo_list):
+    """Kill the worker process if state is marked, else use find_plan"""
+    if getattr(state, 'crash', False):
+        os._exit(1)
+    return pyhop2.find_plan(state, todo_list)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_find_plans_batch(workers):
+    pyhop2.set_current_domain('blocks_tasks')
+    batch = blocks_problems() + [(pyhop2.State('empty'), [('undeclared',)])]
+    stats = pyhop2.SearchStats()
+    results = pyhop2.find_plans_batch(batch, workers=workers, chunksize=2,
+                                      stats=stats)
+    assert results[:-1] == [pyhop2.find_plan(state, todo_list)
+                            for (state, todo_list) in batch[:-1]]
+    assert isinstance(results[-1], Exception)
+    assert stats.expanded > 0
+
+
+def test_find_plans_batch_worker_dies():
+    pyhop2.set_current_domain('blocks_tasks')
+    batch = blocks_problems()
+    crash_state = batch[1][0].copy()
+    crash_state.crash = True
+    batch.insert(2, (crash_state, batch[1][1]))
+    results = pyhop2.find_plans_batch(batch, engine=crash_on_marked_state,
+                                      workers=2, chunksize=2)
+    # only the problem that killed a worker fails
+    assert isinstance(results[2], Exception)
+    assert 'died' in str(results[2])
+    del batch[2], results[2]
+    assert results == [pyhop2.find_plan(state, todo_list)
+                       for (state, todo_list) in batch]
+
+
+@pytest.fixture
+def grow_domain():
+    "A domain with a task whose todo list grows forever"
+    old_domain = pyhop2.current_domain()
+    pyhop2.Domain('grow_domain')
+    def inc(state):
+        state.n += 1
+        return state
+    pyhop2.declare_actions(inc)
+    pyhop2.declare_task_methods('grow', lambda state: [('grow',), ('inc',)])
+    yield
+    pyhop2.set_current_domain(old_domain)
+    pyhop2.remove_domain('grow_domain')
+
+
+@pytest.fixture(params=['fork', 'serial'])
+def portfolio_mode(request, monkeypatch):
+    "Run find_plan_portfolio with processes, and without fork"
+    if request.param == 'serial':
+        monkeypatch.setattr(pyhop2.multiprocessing, 'get_all_start_methods',
+                            lambda: ['spawn'])
+    return request.param
+
+
+def h_todo_length(state, todo_list):
+    return len(todo_list)
+
+
+def raise_error(state, todo_list):
+    raise ValueError('broken engine')
+
+
+def test_portfolio(portfolio_mode):
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.PortfolioStats()
+    plan = pyhop2.find_plan_portfolio(state, todo_list, h=h_todo_length,
+                                      stats=stats)
+    assert plan == pyhop2.find_plan(state, todo_list)
+    assert sum(stats.wins.values()) == 1
+    runs = dict(stats.runs)
+    # with best=True, every engine finishes
+    plan = pyhop2.find_plan_portfolio(state, todo_list, h=h_todo_length,
+                                      best=True, stats=stats)
+    assert plan == pyhop2.find_plan(state, todo_list)
+    assert all(stats.runs[name] == runs.get(name, 0) + 1
+               for name in ('dfs', 'gbfs', 'a_star'))
+
+
+def test_portfolio_engine_exception(portfolio_mode):
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.PortfolioStats()
+    engines = {'broken': raise_error, 'dfs': pyhop2.find_plan}
+    plan = pyhop2.find_plan_portfolio(state, todo_list, engines=engines,
+                                      processes=1, stats=stats)
+    assert plan == pyhop2.find_plan(state, todo_list)
+    assert stats.runs == {'broken': 1, 'dfs': 1}
+    with pytest.raises(ValueError, match='broken engine'):
+        pyhop2.find_plan_portfolio(state, todo_list, processes=1,
+                                   engines={'broken': raise_error},
+                                   stats=stats)
+
+
+def test_portfolio_time_limit(grow_domain, portfolio_mode):
+    state = pyhop2.State('state', n=0)
+    stats = pyhop2.PortfolioStats()
+    start = time.monotonic()
+    result = pyhop2.find_plan_portfolio(state, [('grow',)], h=h_todo_length,
+                                        time_limit=0.3, stats=stats)
+    assert isinstance(result, pyhop2.BudgetExhausted)
+    assert result.reason == 'time'
+    assert time.monotonic() - start < 5
+    # find_plan was stopped, so it didn't lose; the best-first engines'
+    # closed sets see that grow repeats itself, so they return False
+    assert stats.unfinished == {'dfs': 1}
+    assert 'dfs' not in stats.runs and stats.wins == {}
+
+
+def test_portfolio_losers_are_unfinished():
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.PortfolioStats()
+    engines = {'slow': lambda s,t: time.sleep(10) or False,
+               'dfs': pyhop2.find_plan}
+    for _ in range(2):
+        plan = pyhop2.find_plan_portfolio(state, todo_list, engines=engines,
+                                          stats=stats)
+        assert plan == pyhop2.find_plan(state, todo_list)
+    assert stats.stats()['slow'] == {'runs': 0, 'unfinished': 2, 'wins': 0,
+                                     'solved': 0, 'seconds': 0}
+    assert stats.runs == {'dfs': 2} and stats.wins == {'dfs': 2}
+    assert stats.ranking(['slow', 'dfs']) == ['dfs', 'slow']
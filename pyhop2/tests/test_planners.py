@@ -0,0 +1,582 @@
+"""
+Tests that the planners return the same plans as the original Pyhop 2
+planners, for each way of representing and copying states.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import pyhop2
+import problems
+
+
+# The plans that the original find_plan returned for the problems in
+# problems.py. On the task problems other than the backtracking ones, the
+# original find_plan_GBFS (with h = the length of the todo list) and
+# find_plan_a_star (with h = 0) returned the same plans.
+EXPECTED = {
+    'simple_tasks1_alice': [('call_taxi', 'alice', 'home_a'),
+                            ('ride_taxi', 'alice', 'park'),
+                            ('pay_driver', 'alice', 'park')],
+    'simple_tasks1_both': [('call_taxi', 'alice', 'home_a'),
+                           ('ride_taxi', 'alice', 'park'),
+                           ('pay_driver', 'alice', 'park'),
+                           ('walk', 'bob', 'home_b', 'park')],
+    'simple_tasks2_a': [('call_taxi', 'alice', 'home_a'),
+                        ('ride_taxi', 'alice', 'park'),
+                        ('pay_driver', 'alice', 'park')],
+    'simple_tasks2_b': [('walk', 'bob', 'home_b', 'park')],
+    'backtracking_need0': [('putv', 0), ('getv', 0), ('getv', 0)],
+    'backtracking_need01': [('putv', 0), ('getv', 0), ('getv', 0)],
+    'backtracking_need10': [('putv', 0), ('getv', 0), ('getv', 0)],
+    'backtracking_need1': [('putv', 1), ('getv', 1), ('getv', 1)],
+    'blocks_tasks_get': [('unstack', 'a', 'b')],
+    'blocks_tasks_move_one': [('unstack', 'a', 'b'), ('putdown', 'a')],
+    'blocks_tasks_goal1a': [('unstack', 'a', 'b'), ('putdown', 'a'),
+                            ('pickup', 'b'), ('stack', 'b', 'a'),
+                            ('pickup', 'c'), ('stack', 'c', 'b')],
+    'blocks_tasks_goal1b': [('unstack', 'a', 'b'), ('putdown', 'a'),
+                            ('pickup', 'b'), ('stack', 'b', 'a'),
+                            ('pickup', 'c'), ('stack', 'c', 'b')],
+    'blocks_tasks_goal2b': [('unstack', 'a', 'c'), ('putdown', 'a'),
+                            ('unstack', 'b', 'd'), ('stack', 'b', 'c'),
+                            ('pickup', 'a'), ('stack', 'a', 'd')],
+    'simple_goals_alice': [('call_taxi', 'alice', 'home_a'),
+                           ('ride_taxi', 'alice', 'park'),
+                           ('pay_driver', 'alice', 'park')],
+    'simple_goals_both': [('call_taxi', 'alice', 'home_a'),
+                          ('ride_taxi', 'alice', 'park'),
+                          ('pay_driver', 'alice', 'park'),
+                          ('walk', 'bob', 'home_b', 'park')],
+    'simple_goals_goal3': [('call_taxi', 'alice', 'home_a'),
+                           ('ride_taxi', 'alice', 'park'),
+                           ('pay_driver', 'alice', 'park'),
+                           ('walk', 'bob', 'home_b', 'park')],
+    'blocks_goals_pos': [('unstack', 'a', 'b'), ('putdown', 'a')],
+    'blocks_goals_goal1a': [('unstack', 'a', 'b'), ('putdown', 'a'),
+                            ('pickup', 'b'), ('stack', 'b', 'a'),
+                            ('pickup', 'c'), ('stack', 'c', 'b')],
+    'blocks_goals_goal2a': [('unstack', 'a', 'c'), ('putdown', 'a'),
+                            ('unstack', 'b', 'd'), ('stack', 'b', 'c'),
+                            ('pickup', 'a'), ('stack', 'a', 'd')],
+    }
+
+
+def all_problems():
+    return problems.task_problems() + problems.goal_problems()
+
+
+def best_first_problems():
+    return [p for p in problems.task_problems()
+            if not p[0].startswith('backtracking')]
+
+
+def problem_ids(problem_list):
+    return [p[0] for p in problem_list]
+
+
+def h_todo_length(state, todo_list):
+    return len(todo_list)
+
+
+def h_zero(state, todo_list):
+    return 0
+
+
+@pytest.mark.parametrize('problem', all_problems(),
+                         ids=problem_ids(all_problems()))
+def test_find_plan(problem):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    assert pyhop2.find_plan(state, todo_list) == EXPECTED[name]
+
+
+@pytest.mark.parametrize('problem', best_first_problems(),
+                         ids=problem_ids(best_first_problems()))
+def test_find_plan_GBFS(problem):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    plan = pyhop2.find_plan_GBFS(state, todo_list, h_todo_length)
+    assert plan == EXPECTED[name]
+
+
+@pytest.mark.parametrize('problem', best_first_problems(),
+                         ids=problem_ids(best_first_problems()))
+def test_find_plan_a_star(problem):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    assert pyhop2.find_plan_a_star(state, todo_list, h_zero) == EXPECTED[name]
+
+
+@pytest.fixture
+def json_domain():
+    "A domain whose action only works if state.pos is a plain dict"
+    old_domain = pyhop2.current_domain()
+    pyhop2.Domain('json_domain')
+    def move(state, x, y):
+        if type(state.pos) is dict:
+            state.log.append(json.dumps(state.pos))
+            state.pos[x] = y
+            return state
+    pyhop2.declare_actions(move)
+    yield
+    pyhop2.set_current_domain(old_domain)
+    pyhop2.remove_domain('json_domain')
+
+
+def test_planners_keep_plain_dicts(json_domain):
+    # fingerprinting the states for a closed set or a nogood cache doesn't
+    # change the types of the values that the actions see
+    state = pyhop2.State('state', pos={'a':'b'}, log=[])
+    todo_list = [('move', 'a', 'c'), ('move', 'a', 'd')]
+    plan = [('move', 'a', 'c'), ('move', 'a', 'd')]
+    assert pyhop2.find_plan_GBFS(state, todo_list, h_zero) == plan
+    assert pyhop2.find_plan_a_star(state, todo_list, h_zero) == plan
+    assert pyhop2.find_plan(state, todo_list, nogoods=True) == plan
+    assert list(pyhop2.iter_plans(state, todo_list, nogoods=True)) == [plan]
+    assert type(state.pos) is dict and state.log == []
+
+
+def test_best_first_backtracking_returns_false():
+    # The closed set identifies a node by its state and first todo item, so
+    # it prunes the branch that has a plan. The original planners raised
+    # IndexError when their queue ran out; now they return False.
+    pyhop2.set_current_domain('backtracking_tasks')
+    for (name, domain_name, state, todo_list) in problems.task_problems():
+        if name.startswith('backtracking'):
+            assert pyhop2.find_plan_GBFS(state, todo_list, h_zero) == False
+            assert pyhop2.find_plan_a_star(state, todo_list, h_zero) == False
+
+
+@pytest.mark.parametrize('policy', ['greedy', 'a_star', 'weighted_a_star'])
+@pytest.mark.parametrize('problem', problems.goal_problems(),
+                         ids=problem_ids(problems.goal_problems()))
+def test_find_plan_best_first_with_goals(problem, policy):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    plan = pyhop2.find_plan_best_first(state, todo_list, h_zero, policy=policy)
+    assert plan == EXPECTED[name]
+
+
+def test_find_plan_best_first_costs():
+    (name, domain_name, state, todo_list) = problems.task_problems()[1]
+    pyhop2.set_current_domain(domain_name)
+    taxi_plan = EXPECTED[name][:3] + [('call_taxi', 'bob', 'home_b'),
+                                      ('ride_taxi', 'bob', 'park'),
+                                      ('pay_driver', 'bob', 'park')]
+    # if walking is expensive, A* finds the plan in which bob takes a taxi
+    c = lambda action: 10 if action[0] == 'walk' else 1
+    assert pyhop2.find_plan_best_first(state, todo_list, h_zero, c=c) == \
+        taxi_plan
+    assert pyhop2.find_plan_best_first(state, todo_list, h_zero) == \
+        EXPECTED[name]
+    with pytest.raises(Exception, match='unknown policy'):
+        pyhop2.find_plan_best_first(state, todo_list, h_zero, policy='dfs')
+
+
+@pytest.mark.parametrize('closed_set', ['hash', 'exact', 'lru', 'bloom'])
+@pytest.mark.parametrize('policy', ['greedy', 'a_star', 'weighted_a_star'])
+def test_find_plan_best_first_keeps_plain_dicts(json_domain, policy,
+                                                closed_set):
+    state = pyhop2.State('state', pos={'a':'b'}, log=[])
+    todo_list = [('move', 'a', 'c'), ('move', 'a', 'd')]
+    plan = pyhop2.find_plan_best_first(state, todo_list, h_zero, policy=policy,
+                                       closed_set=closed_set)
+    assert plan == todo_list
+    for planner in (pyhop2.find_plan_best_first_async,
+                    pyhop2.find_plan_a_star_async,
+                    pyhop2.find_plan_GBFS_async):
+        assert asyncio.run(planner(state, todo_list, h_zero,
+                                   closed_set=closed_set)) == plan
+
+
+@pytest.mark.parametrize('mode', ['undo_trail', 'copy_on_write', 'both'])
+def test_state_copying_modes(mode):
+    if mode in ('undo_trail', 'both'):
+        pyhop2.undo_trail(True)
+    if mode in ('copy_on_write', 'both'):
+        pyhop2.copy_on_write(True)
+    for (name, domain_name, state, todo_list) in all_problems():
+        pyhop2.set_current_domain(domain_name)
+        assert pyhop2.find_plan(state, todo_list) == EXPECTED[name], name
+        assert list(pyhop2.iter_plans(state, todo_list))[0] == EXPECTED[name]
+
+
+class GeneratedStates(pyhop2.Tracer):
+    "A tracer that keeps the state of each node that's put into the queue"
+    def __init__(self):
+        self.states = []
+
+    def on_generate(self, depth, state, todo_list, heuristic):
+        self.states.append(state)
+
+
+@pytest.mark.parametrize('mode', [None, 'copy_on_write', 'persistent'])
+def test_delta_frontier(mode):
+    pyhop2.delta_frontier(True)
+    if mode == 'copy_on_write':
+        pyhop2.copy_on_write(True)
+    for (name, domain_name, state, todo_list) in best_first_problems():
+        pyhop2.set_current_domain(domain_name)
+        if mode == 'persistent':
+            state = pyhop2.PersistentState(state.__name__, **{
+                varname: val for (varname,val) in vars(state).items()
+                if varname != '__name__'})
+        plan = pyhop2.find_plan_GBFS(state, todo_list, h_todo_length)
+        assert plan == EXPECTED[name], name
+        assert pyhop2.find_plan_a_star(state, todo_list, h_zero) == plan
+    # a tracer sees the same state object when a node is expanded
+    profiler = pyhop2.PathProfiler()
+    stats = pyhop2.SearchStats()
+    pyhop2.find_plan_a_star(state, todo_list, h_zero, tracer=profiler,
+                            stats=stats)
+    paths = profiler.stats()
+    assert sum(path['nodes'] for path in paths.values()) == stats.expanded
+    # a node that's still in the queue when the search ends is emptied
+    (name, domain_name, state, todo_list) = problems.task_problems()[1]
+    pyhop2.set_current_domain(domain_name)
+    tracer = GeneratedStates()
+    pyhop2.find_plan_a_star(state, todo_list, h_zero, tracer=tracer)
+    [emptied] = [s for s in tracer.states if list(vars(s)) == ['__name__']]
+
+
+def test_persistent_state():
+    for (name, domain_name, state, todo_list) in all_problems():
+        pyhop2.set_current_domain(domain_name)
+        pstate = pyhop2.PersistentState(state.__name__, **{
+            varname: val for (varname,val) in vars(state).items()
+            if varname != '__name__'})
+        assert pyhop2.find_plan(pstate, todo_list) == EXPECTED[name], name
+
+
+@pytest.fixture
+def blocks_schema():
+    pyhop2.set_current_domain('blocks_tasks')
+    domain = pyhop2._current_domain
+    blocks = ['a', 'b', 'c', 'd']
+    pyhop2.declare_state_schema(pos=(blocks, blocks + ['table', 'hand']),
+                                clear=(blocks, [True, False]),
+                                holding=(['hand'], blocks + [False]))
+    yield
+    domain._state_schema = None
+
+
+def test_compact_state(blocks_schema):
+    for (name, domain_name, state, todo_list) in problems.task_problems():
+        if domain_name == 'blocks_tasks':
+            cstate = pyhop2.CompactState(state.__name__, pos=state.pos,
+                                         clear=state.clear,
+                                         holding=state.holding)
+            assert pyhop2.find_plan(cstate, todo_list) == EXPECTED[name]
+            pyhop2.undo_trail(True)
+            assert pyhop2.find_plan(cstate, todo_list) == EXPECTED[name]
+            pyhop2.undo_trail(False)
+
+
+@pytest.fixture
+def order_domain():
+    "A domain whose plans depend on the order of a dict's keys"
+    old_domain = pyhop2.current_domain()
+    pyhop2.Domain('order_domain')
+    def remove(state, key):
+        del state.items[key]
+        return state
+    def pop_last(state):
+        state.items.popitem()
+        return state
+    def fail(state):
+        return False
+    def note(state, key):
+        return state
+    pyhop2.declare_actions(remove, pop_last, fail, note)
+    pyhop2.declare_task_methods('try',
+                                lambda state: [('remove','a'), ('fail',)],
+                                lambda state: [('pop_last',), ('fail',)],
+                                lambda state: [])
+    pyhop2.declare_task_methods('first',
+                                lambda state: [('note', next(iter(state.items)))])
+    yield
+    pyhop2.set_current_domain(old_domain)
+    pyhop2.remove_domain('order_domain')
+
+
+def test_undo_trail_keeps_dict_order(order_domain):
+    state = pyhop2.State('state', items={'a':1, 'b':2, 'c':3})
+    todo_list = [('try',), ('first',)]
+    plan = pyhop2.find_plan(state, todo_list)
+    assert plan == [('note','a')]
+    pyhop2.undo_trail(True)
+    assert pyhop2.find_plan(state, todo_list) == plan
+
+
+@pytest.fixture
+def count_domain():
+    "A domain whose plans have n actions, and a task that never terminates"
+    old_domain = pyhop2.current_domain()
+    pyhop2.Domain('count_domain')
+    def inc(state):
+        state.n += 1
+        return state
+    def dec(state):
+        state.n -= 1
+        return state
+    pyhop2.declare_actions(inc, dec)
+    pyhop2.declare_task_methods('count',
+        lambda state, n: [('inc',), ('count', n-1)] if n > 0 else [])
+    pyhop2.declare_task_methods('spin',
+        lambda state: [('inc',), ('dec',), ('spin',)])
+    yield
+    pyhop2.set_current_domain(old_domain)
+    pyhop2.remove_domain('count_domain')
+
+
+def test_plan_longer_than_recursion_limit(count_domain, monkeypatch):
+    # without cycle_check, a deep search never computes a subproblem key
+    def no_key(state, todo_list):
+        raise Exception('_subproblem_key called')
+    monkeypatch.setattr(pyhop2, '_subproblem_key', no_key)
+    state = pyhop2.State('state', n=0)
+    plan = pyhop2.find_plan(state, [('count', 5000)])
+    assert plan == [('inc',)] * 5000
+    assert list(pyhop2.iter_plans(state, [('count', 5000)])) == [plan]
+    pyhop2.undo_trail(True)
+    assert pyhop2.find_plan(state, [('count', 5000)]) == plan
+
+
+@pytest.mark.parametrize('mode', [None, 'undo_trail'])
+def test_cycle_fails(count_domain, mode):
+    if mode == 'undo_trail':
+        pyhop2.undo_trail(True)
+    state = pyhop2.State('state', n=0)
+    stats = pyhop2.SearchStats()
+    assert pyhop2.find_plan(state, [('spin',)], stats=stats,
+                            cycle_check=True) == False
+    assert stats.duplicates == 1
+    assert list(pyhop2.iter_plans(state, [('spin',)], cycle_check=True)) == []
+
+
+def test_cycle_needs_budget_without_cycle_check(count_domain):
+    state = pyhop2.State('state', n=0)
+    budget = pyhop2.Budget(max_expansions=1000)
+    result = pyhop2.find_plan(state, [('spin',)], budget=budget)
+    assert isinstance(result, pyhop2.BudgetExhausted)
+
+
+def test_unsolvable_blocks_goal():
+    # move_blocks keeps moving a to the table and back
+    pyhop2.set_current_domain('blocks_tasks')
+    state = problems.blocks_state1()
+    goal = problems.multigoal('impossible', pos={'a':'a'})
+    assert pyhop2.find_plan(state, [('move_blocks', goal)],
+                            cycle_check=True) == False
+
+
+def test_seek_plan_nodes_as_lists():
+    # nodes with list todo lists and plans, as seek_plan_GBFS and
+    # seek_plan_a_star used to take; seek_plan_a_star's had no cost
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    expected = EXPECTED[name]
+    plans = pyhop2.PriorityQueue()
+    plans.push(0, (state, todo_list, [('noop',)], 1, 1))
+    plan = pyhop2.seek_plan_GBFS(plans, h_todo_length, lambda a: 1, {}, False)
+    assert plan == [('noop',)] + expected
+    plans = pyhop2.PriorityQueue()
+    plans.push(0, (state, todo_list, [], 0))
+    assert pyhop2.seek_plan_a_star(plans, h_zero, {}) == expected
+
+
+def test_dispatch_table(count_domain):
+    state = pyhop2.State('state', n=0)
+    assert pyhop2.find_plan(state, [('count', 2)]) == [('inc',), ('inc',)]
+    assert pyhop2.find_plan_GBFS(state, [('count', 2)], h_zero) == \
+        [('inc',), ('inc',)]
+    # an action takes precedence over a task with the same name, and
+    # declaring something new recompiles the tables
+    def count(state, n):
+        state.n += n
+        return state
+    pyhop2.declare_actions(count)
+    assert pyhop2.find_plan(state, [('count', 2)]) == [('count', 2)]
+    assert pyhop2.find_plan_GBFS(state, [('count', 2)], h_zero) == \
+        [('count', 2)]
+    with pytest.raises(Exception, match="isn't an action, task, goal"):
+        pyhop2.find_plan(state, [('undeclared',)])
+
+
+def test_budget_exhausted():
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    for planner in (pyhop2.find_plan,
+                    lambda s,t,budget: pyhop2.find_plan_GBFS(s, t, h_zero,
+                                                              budget=budget),
+                    lambda s,t,budget: pyhop2.find_plan_a_star(s, t, h_zero,
+                                                                budget=budget)):
+        budget = pyhop2.Budget(max_expansions=3)
+        result = planner(state, todo_list, budget=budget)
+        assert isinstance(result, pyhop2.BudgetExhausted)
+        assert not result and result != False
+        assert result.reason == 'expansions'
+        assert budget.exhausted is result
+        # a big enough budget doesn't change the plan
+        budget = pyhop2.Budget(max_expansions=1000)
+        assert planner(state, todo_list, budget=budget) == EXPECTED[name]
+        assert budget.exhausted == None
+
+
+def test_budget_cancel():
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    budget = pyhop2.Budget()
+    budget.cancel()
+    result = pyhop2.find_plan(state, todo_list, budget=budget)
+    assert isinstance(result, pyhop2.BudgetExhausted)
+    assert result.reason == 'cancelled'
+
+
+def test_budget_time_and_frontier(count_domain):
+    # grow's todo list gets longer at every step, so only a budget stops it
+    pyhop2.declare_task_methods('grow',
+        lambda state: [('grow',), ('inc',)])
+    state = pyhop2.State('state', n=0)
+    budget = pyhop2.Budget(time_limit=0.05)
+    result = pyhop2.find_plan(state, [('grow',)], budget=budget)
+    assert result.reason == 'time' and result.seconds >= 0.05
+    budget = pyhop2.Budget(max_frontier_bytes=100000)
+    result = pyhop2.find_plan(state, [('grow',)], budget=budget)
+    assert result.reason == 'frontier_bytes'
+    assert budget.frontier_bytes > 100000
+
+
+def test_iter_plans():
+    (name, domain_name, state, todo_list) = problems.task_problems()[1]
+    pyhop2.set_current_domain(domain_name)
+    plans = list(pyhop2.iter_plans(state, todo_list))
+    assert plans[0] == EXPECTED[name]
+    assert plans[1] == EXPECTED[name][:3] + [('call_taxi', 'bob', 'home_b'),
+                                             ('ride_taxi', 'bob', 'park'),
+                                             ('pay_driver', 'bob', 'park')]
+    assert len(plans) == 2
+    # the enumeration can stop and go on later, with other searches between
+    plans_iter = pyhop2.iter_plans(state, todo_list)
+    assert next(plans_iter) == plans[0]
+    assert pyhop2.find_plan(state, todo_list) == plans[0]
+    assert list(plans_iter) == plans[1:]
+
+
+def test_find_cheapest_plan():
+    pyhop2.set_current_domain('backtracking_tasks')
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    assert pyhop2.find_cheapest_plan(state, todo_list, 3) == EXPECTED[name]
+    with pytest.raises(Exception, match='k must be at least 1'):
+        pyhop2.find_cheapest_plan(state, todo_list, 0)
+
+
+def test_branch_and_bound():
+    (name, domain_name, state, todo_list) = problems.task_problems()[1]
+    pyhop2.set_current_domain(domain_name)
+    plans = list(pyhop2.iter_plans(state, todo_list))
+    # with unit costs, the first plan is the cheapest
+    assert pyhop2.find_plan_bnb(state, todo_list) == plans[0]
+    # if walking is expensive, taking a taxi is cheaper
+    c = lambda action: 10 if action[0] == 'walk' else 1
+    assert list(pyhop2.iter_improving_plans(state, todo_list, c=c)) == \
+        [(plans[0], 13), (plans[1], 6)]
+    assert pyhop2.find_plan_bnb(state, todo_list, h=h_todo_length, c=c) == \
+        plans[1]
+    pyhop2.undo_trail(True)
+    assert pyhop2.find_plan_bnb(state, todo_list, c=c) == plans[1]
+
+
+def test_async_planners_match():
+    for (name, domain_name, state, todo_list) in best_first_problems():
+        pyhop2.set_current_domain(domain_name)
+        for (planner, args) in ((pyhop2.find_plan_async, ()),
+                                (pyhop2.find_plan_GBFS_async,
+                                 (h_todo_length,)),
+                                (pyhop2.find_plan_a_star_async, (h_zero,)),
+                                (pyhop2.find_plan_best_first_async,
+                                 (h_zero,))):
+            plan = asyncio.run(planner(state, todo_list, *args,
+                                       yield_every=1))
+            assert plan == EXPECTED[name], (name, planner.__name__)
+
+
+def test_async_searches_interleave():
+    # each search keeps the domain that was current when it was created,
+    # while another task counts how often the searches pause
+    searches = []
+    for i in (1, 13):
+        (name, domain_name, state, todo_list) = all_problems()[i]
+        pyhop2.set_current_domain(domain_name)
+        searches.append((name, pyhop2.find_plan_async(state, todo_list,
+                                                      yield_every=1)))
+    pyhop2.set_current_domain('blocks_tasks')
+    ticks = []
+    async def ticker():
+        while True:
+            ticks.append(pyhop2.current_domain())
+            await asyncio.sleep(0)
+    async def main():
+        ticker_task = asyncio.ensure_future(ticker())
+        plans = await asyncio.gather(*[search for (name, search) in searches])
+        ticker_task.cancel()
+        return plans
+    plans = asyncio.run(main())
+    assert plans == [EXPECTED[name] for (name, search) in searches]
+    assert len(ticks) > 2 and set(ticks) == {'blocks_tasks'}
+    assert pyhop2.current_domain() == 'blocks_tasks'
+
+
+def test_async_searches_keep_their_modes(count_domain):
+    # each search keeps the state-copying modes that were current when it
+    # was created, while another task keeps changing them
+    seen = set()
+    def probe(state, name):
+        seen.add((name, pyhop2.copy_on_write(), pyhop2.undo_trail(),
+                  pyhop2.delta_frontier()))
+        state.n += 1
+        return state
+    pyhop2.declare_actions(probe)
+    pyhop2.declare_task_methods('probes', lambda state, name, n:
+        [('probe', name), ('probes', name, n-1)] if n > 0 else [])
+    state = pyhop2.State('state', n=0)
+    pyhop2.copy_on_write(True)
+    cow = pyhop2.find_plan_async(state, [('probes', 'cow', 5)],
+                                 yield_every=1)
+    pyhop2.copy_on_write(False)
+    pyhop2.undo_trail(True)
+    trail = pyhop2.find_plan_async(state, [('probes', 'trail', 5)],
+                                   yield_every=1)
+    pyhop2.undo_trail(False)
+    pyhop2.delta_frontier(True)
+    delta = pyhop2.find_plan_GBFS_async(state, [('probes', 'delta', 5)],
+                                        lambda s,t: len(t), yield_every=1)
+    pyhop2.delta_frontier(False)
+    async def toggler():
+        while True:
+            for mode in (pyhop2.copy_on_write, pyhop2.undo_trail,
+                         pyhop2.delta_frontier):
+                mode(not mode())
+            await asyncio.sleep(0)
+    async def main():
+        toggler_task = asyncio.ensure_future(toggler())
+        plans = await asyncio.gather(cow, trail, delta)
+        toggler_task.cancel()
+        return plans
+    plans = asyncio.run(main())
+    assert plans == [[('probe', name)] * 5 for name in ('cow', 'trail', 'delta')]
+    assert seen == {('cow', True, False, False), ('trail', False, True, False),
+                    ('delta', False, False, True)}
+
+
+def test_async_timeout(count_domain):
+    pyhop2.declare_task_methods('grow',
+        lambda state: [('grow',), ('inc',)])
+    state = pyhop2.State('state', n=0)
+    search = pyhop2.find_plan_async(state, [('grow',)])
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(search, 0.05))
+    assert pyhop2.current_domain() == 'count_domain'
@@ -0,0 +1,283 @@
+"""
+Tests of nogood caches, closed sets, search statistics, and the messages
+that the planners print when verbose >= 1.
+"""
+
+import asyncio
+import copy
+import io
+import os
+import re
+
+import pytest
+
+import pyhop2
+import problems
+
+
+def all_problems():
+    return problems.task_problems() + problems.goal_problems()
+
+
+def problem_ids(problem_list):
+    return [p[0] for p in problem_list]
+
+
+def h_zero(state, todo_list):
+    return 0
+
+
+@pytest.mark.parametrize('mode', [None, 'undo_trail', 'copy_on_write'])
+@pytest.mark.parametrize('problem', all_problems(),
+                         ids=problem_ids(all_problems()))
+def test_nogoods_dont_change_plans(problem, mode):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    if mode == 'undo_trail':
+        pyhop2.undo_trail(True)
+    elif mode == 'copy_on_write':
+        pyhop2.copy_on_write(True)
+    before = copy.deepcopy(vars(state))
+    plans = list(pyhop2.iter_plans(state, todo_list))
+    nc = pyhop2.NogoodCache()
+    assert pyhop2.find_plan(state, todo_list, nogoods=nc) == plans[0]
+    assert list(pyhop2.iter_plans(state, todo_list, nogoods=True)) == plans
+    # the planners don't modify the caller's state or replace its dicts
+    assert type(state) is pyhop2.State
+    assert vars(state) == before
+    assert all(type(val) is type(before[varname])
+               for (varname,val) in vars(state).items())
+
+
+def test_nogoods_prune_unsolvable_subproblems():
+    # need01 first tries getv(1) twice after put_it chooses 0, then
+    # backtracks; the cache remembers the subproblems that failed
+    pyhop2.set_current_domain('backtracking_tasks')
+    for (name, domain_name, state, todo_list) in problems.task_problems():
+        if name.startswith('backtracking'):
+            nc = pyhop2.NogoodCache()
+            pyhop2.find_plan(state, todo_list, nogoods=nc)
+            stats = nc.stats()
+            assert stats['lookups'] >= stats['hits'] >= 0
+            assert stats['evictions'] == 0
+
+
+def test_unsolvable_with_nogoods():
+    pyhop2.set_current_domain('blocks_tasks')
+    state = problems.blocks_state1()
+    goal = problems.multigoal('impossible', pos={'a':'a'})
+    assert pyhop2.find_plan(state, [('move_blocks', goal)],
+                            cycle_check=True) == False
+    assert pyhop2.find_plan(state, [('move_blocks', goal)], nogoods=True,
+                            cycle_check=True) == False
+
+
+@pytest.mark.parametrize('policy', ['hash', 'exact', 'lru'])
+@pytest.mark.parametrize('problem', all_problems(),
+                         ids=problem_ids(all_problems()))
+def test_closed_set_policies(problem, policy):
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    expected = pyhop2.find_plan_best_first(state, todo_list, h_zero)
+    closed_set = pyhop2.ClosedSet(policy)
+    plan = pyhop2.find_plan_best_first(state, todo_list, h_zero,
+                                       closed_set=closed_set)
+    assert plan == expected
+    stats = closed_set.stats()
+    assert stats['policy'] == policy
+    assert stats['lookups'] >= stats['hits']
+    if policy == 'exact':
+        assert stats['false_positive_rate'] == 0
+    else:
+        assert 0 < stats['false_positive_rate'] < 1e-15
+
+
+def test_closed_set_lru_eviction():
+    pyhop2.set_current_domain('blocks_goals')
+    (name, domain_name, state, todo_list) = problems.goal_problems()[5]
+    expected = pyhop2.find_plan_best_first(state, todo_list, h_zero)
+    closed_set = pyhop2.ClosedSet('lru', max_bytes=500)
+    plan = pyhop2.find_plan_best_first(state, todo_list, h_zero,
+                                       closed_set=closed_set)
+    assert plan == expected
+    assert closed_set.stats()['evictions'] > 0
+
+
+def test_closed_set_bloom():
+    pyhop2.set_current_domain('blocks_goals')
+    for (name, domain_name, state, todo_list) in problems.goal_problems():
+        if domain_name == 'blocks_goals':
+            closed_set = pyhop2.ClosedSet('bloom')
+            plan = pyhop2.find_plan_best_first(state, todo_list, h_zero,
+                                               closed_set=closed_set)
+            # a false positive can prune the best plan, but not all of them;
+            # after the plan's actions, the goals need no more actions
+            assert plan and pyhop2.find_plan(state, plan + todo_list) == plan
+            assert 0 <= closed_set.stats()['false_positive_rate'] < 1e-6
+
+
+def test_closed_set_unknown_policy():
+    with pytest.raises(Exception, match='unknown policy'):
+        pyhop2.ClosedSet('fifo')
+
+
+@pytest.mark.parametrize('history', [dict, set])
+def test_seek_plan_history_strings(history):
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    history = history()
+    plans = pyhop2.PriorityQueue()
+    plans.push(0, (state, todo_list, [], 0, 0))
+    plan = pyhop2.seek_plan_GBFS(plans, lambda s,t: len(t), lambda a: 1,
+                                 history, False)
+    assert plan == pyhop2.find_plan_GBFS(state, todo_list,
+                                         lambda s,t: len(t))
+    assert len(history) > 1
+    assert all(type(key) is str for key in history)
+
+
+def counts(stats):
+    "The statistics in stats other than the times"
+    return {key: val for (key,val) in stats.stats().items()
+            if not key.endswith('seconds')}
+
+
+@pytest.mark.parametrize('mode', [None, 'undo_trail', 'copy_on_write'])
+def test_search_stats_find_plan(mode):
+    if mode == 'undo_trail':
+        pyhop2.undo_trail(True)
+    elif mode == 'copy_on_write':
+        pyhop2.copy_on_write(True)
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.SearchStats()
+    pyhop2.find_plan(state, todo_list, stats=stats)
+    assert counts(stats) == {
+        'expanded': 8, 'generated': 8,
+        'method_attempts': {'m_err': 1, 'm0': 1, 'm_need1': 1, 'm_need0': 1},
+        'method_failures': {},
+        'action_attempts': {'putv': 2, 'getv': 4},
+        'action_failures': {'getv': 2},
+        'backtracks': 2, 'max_depth': 4, 'max_frontier': 2, 'duplicates': 0}
+    assert stats.seconds >= stats.domain_seconds > 0
+    assert stats.heuristic_seconds == 0
+    times = stats.stats()
+    assert times['engine_seconds'] == pytest.approx(
+        stats.seconds - stats.domain_seconds)
+    # the planner resets the statistics when it starts
+    first = counts(stats)
+    pyhop2.find_plan(state, todo_list, stats=stats)
+    assert counts(stats) == first
+
+
+def test_search_stats_best_first():
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.SearchStats()
+    pyhop2.find_plan_GBFS(state, todo_list, lambda s,t: len(t), stats=stats)
+    # the closed set prunes the nodes that two methods both produce
+    assert stats.expanded == 7 and stats.duplicates == 2
+    assert stats.action_failures == {'getv': 2}
+    assert stats.heuristic_seconds > 0
+    async_stats = pyhop2.SearchStats()
+    asyncio.run(pyhop2.find_plan_GBFS_async(state, todo_list,
+                                            lambda s,t: len(t),
+                                            yield_every=1, stats=async_stats))
+    assert counts(async_stats) == counts(stats)
+
+
+def test_search_stats_iter_plans():
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    stats = pyhop2.SearchStats()
+    plans = list(pyhop2.iter_plans(state, todo_list, stats=stats))
+    assert len(plans) == 2
+    # enumerating every plan expands more nodes than finding the first one
+    assert stats.expanded == 13 and stats.backtracks == 7
+    assert sum(stats.action_attempts.values()) == 10
+
+
+################################################################################
+# verbose output
+#
+# The files in tests/verbose contain what the original planners printed for
+# some of the problems, with names like _state12 changed to _state, and
+# without the verbose argument that verification tasks used to end with.
+
+VERBOSE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'verbose')
+
+PLANNERS = {
+    'dfs': lambda state, todo_list, verbose, tracer=None:
+        pyhop2.find_plan(state, todo_list, verbose=verbose, tracer=tracer),
+    'gbfs': lambda state, todo_list, verbose, tracer=None:
+        pyhop2.find_plan_GBFS(state, todo_list, lambda s,t: len(t),
+                              verbose=verbose, tracer=tracer),
+    'astar': lambda state, todo_list, verbose, tracer=None:
+        pyhop2.find_plan_a_star(state, todo_list, h_zero, verbose=verbose,
+                                tracer=tracer),
+    }
+
+
+def verbose_output(planner, name, verbose, capsys, tracer=None):
+    "What PLANNERS[planner] prints for the problem called name"
+    problem = [p for p in all_problems() if p[0] == name][0]
+    (name, domain_name, state, todo_list) = problem
+    pyhop2.set_current_domain(domain_name)
+    capsys.readouterr()
+    PLANNERS[planner](state, todo_list, verbose, tracer)
+    return re.sub(r'_state\d+', '_state', capsys.readouterr().out)
+
+
+@pytest.mark.parametrize('filename', sorted(os.listdir(VERBOSE_DIR)))
+def test_verbose_output(filename, capsys):
+    (planner, verbose, name) = filename[:-len('.txt')].split('_', 2)
+    output = verbose_output(planner, name, int(verbose), capsys)
+    with open(os.path.join(VERBOSE_DIR, filename)) as f:
+        assert output == f.read()
+
+
+@pytest.mark.parametrize('planner', sorted(PLANNERS))
+def test_verbose_tracer_is_the_default(planner, capsys):
+    # a tracer given explicitly replaces the messages at levels 2 and 3
+    name = 'simple_tasks1_both'
+    recorder = pyhop2.TraceRecorder(io.StringIO())
+    output = verbose_output(planner, name, 3, capsys, recorder)
+    expected = verbose_output(planner, name, 1, capsys)
+    assert output == expected.replace('verbose=1', 'verbose=3')
+    assert recorder.events > 0
+
+
+class VerifyCommandTracer(pyhop2.Tracer):
+    "A tracer that records the on_verify and on_command events"
+    def __init__(self):
+        self.events = []
+
+    def on_verify(self, depth, method_name, goal):
+        self.events.append(('verify', depth, method_name, goal))
+
+    def on_command(self, command, args, newstate):
+        self.events.append(('command', command.__name__, args, bool(newstate)))
+
+
+@pytest.mark.parametrize('planner', sorted(PLANNERS))
+def test_tracer_on_verify(planner, capsys):
+    tracer = VerifyCommandTracer()
+    verbose_output(planner, 'simple_goals_goal3', 0, capsys, tracer)
+    assert ('verify', 1, 'travel_by_taxi', ('loc', 'alice', 'park')) \
+        in tracer.events
+    (kind, depth, method_name, goal) = tracer.events[-1]
+    assert (depth, method_name, goal.__name__) == (0, 'm_split_goals', 'goal3')
+
+
+def test_run_lazy_lookahead_tracer(capsys):
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    tracer = VerifyCommandTracer()
+    pyhop2.run_lazy_lookahead(state, todo_list, verbose=0, tracer=tracer)
+    assert len(tracer.events) == 6
+    assert all(event[0] == 'command' and event[3] for event in tracer.events)
+    assert capsys.readouterr().out == ''
+    pyhop2.run_lazy_lookahead(state, todo_list, verbose=3)
+    output = capsys.readouterr().out
+    assert output.count('_apply_command:') == 12
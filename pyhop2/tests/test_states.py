@@ -0,0 +1,267 @@
+"""
+Tests of the ways that states can be represented and copied, fingerprints,
+and the state encoding.
+"""
+
+import itertools, json
+
+import pytest
+
+import pyhop2
+import problems
+
+
+def blocks_vars(state):
+    return {'pos': dict(state.pos), 'clear': dict(state.clear),
+            'holding': dict(state.holding)}
+
+
+def test_copy_on_write_copy_does_not_change_original():
+    pyhop2.copy_on_write(True)
+    state = problems.blocks_state1()
+    state.order = ['a', 'b']
+    new_state = state.copy()
+    new_state.pos['a'] = 'table'
+    new_state.order.append('c')
+    assert type(state.pos) is dict and type(state.order) is list
+    assert state.pos['a'] == 'b' and state.order == ['a', 'b']
+    json.dumps(vars(state))
+    # later copies share the copy's data until one of them writes to it
+    newer_state = new_state.copy()
+    newer_state.pos['b'] = 'a'
+    assert new_state.pos['b'] == 'table'
+    assert newer_state.pos == {'a':'table', 'b':'a', 'c':'table'}
+
+
+def test_cow_list_operations():
+    pyhop2.copy_on_write(True)
+    state = pyhop2.State('s', order=[3, 1, 2])
+    new_state = state.copy()
+    order = new_state.order
+    assert [0] + order == [0, 3, 1, 2]
+    assert order + [0] == [3, 1, 2, 0]
+    assert order * 2 == [3, 1, 2, 3, 1, 2]
+    assert 2 * order == [3, 1, 2, 3, 1, 2]
+    shared = new_state.copy()
+    order.sort()
+    assert order == [1, 2, 3] and shared.order == [3, 1, 2]
+    order.sort(key=lambda x: -x, reverse=True)
+    assert order == [1, 2, 3]
+    order *= 2
+    assert order == [1, 2, 3, 1, 2, 3] and shared.order == [3, 1, 2]
+    assert state.order == [3, 1, 2]
+
+
+def test_persistent_state_copy():
+    state = problems.blocks_state1()
+    pstate = pyhop2.PersistentState('pstate', **blocks_vars(state))
+    new_state = pstate.copy()
+    new_state.pos['a'] = 'table'
+    del new_state.clear['c']
+    assert blocks_vars(pstate) == blocks_vars(state)
+    assert new_state.pos['a'] == 'table' and 'c' not in new_state.clear
+    assert new_state != pstate
+    new_state.pos['a'] = 'b'
+    new_state.clear['c'] = True
+    assert new_state == pstate and hash(new_state) == hash(pstate)
+    # many keys, so that the trie has more than one level
+    pstate.n = {i: i*i for i in range(1000)}
+    new_state = pstate.copy()
+    for i in range(0, 1000, 3):
+        new_state.n[i] = -i
+    assert all(pstate.n[i] == i*i for i in range(1000))
+    assert all(new_state.n[i] == (-i if i % 3 == 0 else i*i)
+               for i in range(1000))
+
+
+def test_fingerprint_does_not_change_state():
+    state = problems.blocks_state1()
+    state.fingerprint()
+    assert type(state.pos) is dict
+    json.dumps(vars(state))
+
+
+def test_fingerprint_equivalence():
+    state = problems.blocks_state1()
+    x = state.fingerprint()
+    assert problems.blocks_state1().fingerprint() == x
+    trail_state = pyhop2.State('trail_state')
+    for (varname,val) in blocks_vars(state).items():
+        setattr(trail_state, varname, pyhop2._TrailDict(val))
+    assert trail_state.fingerprint() == x
+    pstate = pyhop2.PersistentState('pstate', **blocks_vars(state))
+    assert pstate.fingerprint() == x
+    # a copy that writes to a state variable and then changes it back
+    pyhop2.copy_on_write(True)
+    cow_state = state.copy()
+    assert cow_state.fingerprint() == x
+    new_state = cow_state.copy()
+    new_state.fingerprint()
+    new_state.pos['a'] = 'table'
+    assert new_state.fingerprint() != x
+    new_state.pos['a'] = 'b'
+    assert new_state.fingerprint() == x
+
+
+def test_persistent_state_list_fingerprint():
+    pstate = pyhop2.PersistentState('pstate', order=['a', 'b'])
+    state = pyhop2.State('state', order=['a', 'b', 'c'])
+    pstate.order.append('c')
+    assert pstate.fingerprint() == state.fingerprint()
+
+
+def test_zobrist_table_stays_bounded():
+    state = pyhop2.State('state', order=tuple(range(6)))
+    state.fingerprint()
+    size = len(pyhop2._zobrist_table)
+    fingerprints = set()
+    for order in itertools.permutations(range(6)):
+        state.order = order
+        fingerprints.add(state.fingerprint())
+    assert len(pyhop2._zobrist_table) <= size + 1
+    assert len(fingerprints) == 720
+
+
+@pytest.fixture
+def blocks_schema():
+    pyhop2.set_current_domain('blocks_tasks')
+    domain = pyhop2._current_domain
+    blocks = ['a', 'b', 'c']
+    pyhop2.declare_state_schema(pos=(blocks, blocks + ['table', 'hand']),
+                                clear=(blocks, [True, False]),
+                                holding=(['hand'], blocks + [False]))
+    yield
+    domain._state_schema = None
+
+
+def test_compact_state_equivalence(blocks_schema):
+    state = problems.blocks_state1()
+    cstate = pyhop2.CompactState('cstate', **blocks_vars(state))
+    assert blocks_vars(cstate) == blocks_vars(state)
+    new_state = cstate.copy()
+    new_state.pos['a'] = 'table'
+    assert cstate.pos['a'] == 'b' and new_state.pos['a'] == 'table'
+    # a CompactState's fingerprint is a hash of its array, so it's
+    # comparable only with the fingerprints of other CompactStates
+    assert new_state.fingerprint() != cstate.fingerprint()
+    new_state.pos['a'] = 'b'
+    assert new_state.fingerprint() == cstate.fingerprint()
+
+
+def test_compact_state_keeps_true_and_1_apart(blocks_schema):
+    cstate = pyhop2.CompactState('cstate', clear={'a':True})
+    with pytest.raises(Exception):
+        cstate.clear['a'] = 1
+    cstate.clear['b'] = False
+    assert cstate.clear['a'] is True and cstate.clear['b'] is False
+
+
+def test_compact_state_other_vars(blocks_schema):
+    state = problems.blocks_state1()
+    cstate = pyhop2.CompactState('cstate', **blocks_vars(state))
+    cstate.max_stacks = 4
+    assert cstate.nameless_repr().endswith("'hand': False}, max_stacks=4)")
+    new_state = cstate.copy()
+    assert new_state.max_stacks == 4
+    assert new_state.fingerprint() == cstate.fingerprint()
+    new_state.max_stacks = 5
+    assert new_state.fingerprint() != cstate.fingerprint()
+    delta = cstate.diff(new_state)
+    assert delta.changes == {} and delta.var_changes == {'max_stacks': (4, 5)}
+
+
+def test_diff_and_apply_delta():
+    state = problems.blocks_state1()
+    new_state = state.copy()
+    new_state.pos['a'] = 'table'
+    del new_state.clear['c']
+    new_state.holding['hand'] = 'c'
+    new_state.extra = 5
+    delta = state.diff(new_state)
+    assert len(delta) == 4
+    assert delta.changes['pos'] == {'a': ('b', 'table')}
+    assert delta.changes['clear'] == {'c': (True, pyhop2.StateDelta.UNBOUND)}
+    assert delta.var_changes['extra'] == (pyhop2.StateDelta.UNBOUND, 5)
+    assert not state.diff(state.copy())
+    applied = state.copy().apply_delta(delta)
+    assert blocks_vars(applied) == blocks_vars(new_state)
+    assert applied.extra == 5
+    assert new_state.copy().apply_delta(delta.invert()).pos == state.pos
+    # a PersistentState's diff skips the parts that the states share
+    pstate = pyhop2.PersistentState('pstate', **blocks_vars(state))
+    new_pstate = pstate.copy()
+    new_pstate.pos['a'] = 'table'
+    assert pstate.diff(new_pstate).changes == {'pos': {'a': ('b', 'table')}}
+
+
+def test_run_lazy_lookahead_trace():
+    (name, domain_name, state, todo_list) = problems.task_problems()[10]
+    pyhop2.set_current_domain(domain_name)
+    trace = []
+    final_state = pyhop2.run_lazy_lookahead(state, todo_list, verbose=0,
+                                            trace=trace)
+    assert len(trace) == 6
+    replayed = state.copy()
+    for (action, delta) in trace:
+        replayed.apply_delta(delta)
+    assert blocks_vars(replayed) == blocks_vars(final_state)
+
+
+ENCODABLE = [None, True, False, 0, 1, -5, 2**70, 1.5, 'x', '', b'\x00y',
+             (1, 'a'), [1, [2, 3]], {'a':{'b':1}}, frozenset([1, 2]),
+             {3, 4}, {(1, 2): 'pair'}]
+
+
+@pytest.mark.parametrize('val', ENCODABLE, ids=repr)
+def test_codec_round_trip(val):
+    state = pyhop2.State('state', v=val)
+    decoded = pyhop2.decode_state(pyhop2.encode_state(state))
+    assert decoded.__name__ == 'state'
+    assert decoded.v == val and type(decoded.v) is type(val)
+
+
+def test_codec_is_canonical():
+    state1 = pyhop2.State('s1', pos={'a':'b', 'b':'table'}, clear={'a':True})
+    state2 = pyhop2.State('s2', clear={'a':True}, pos={'b':'table', 'a':'b'})
+    assert pyhop2.encode_state(state1) != pyhop2.encode_state(state2)
+    assert pyhop2.encode_state(state1, name=False) == \
+        pyhop2.encode_state(state2, name=False)
+    # True and 1 encode differently
+    state3 = pyhop2.State('s3', v=1)
+    state4 = pyhop2.State('s4', v=True)
+    assert pyhop2.encode_state(state3, name=False) != \
+        pyhop2.encode_state(state4, name=False)
+
+
+def test_codec_multigoal_and_cls():
+    goal = problems.multigoal('goal', pos={'a':'table'})
+    decoded = pyhop2.decode_state(pyhop2.encode_state(goal))
+    assert isinstance(decoded, pyhop2.Multigoal) and decoded.pos == goal.pos
+    state = problems.blocks_state1()
+    decoded = pyhop2.decode_state(pyhop2.encode_state(state),
+                                  cls=pyhop2.PersistentState)
+    assert isinstance(decoded, pyhop2.PersistentState)
+    assert blocks_vars(decoded) == blocks_vars(state)
+
+
+class Opaque():
+    def __eq__(self, other):
+        return type(other) is Opaque
+
+
+def test_codec_pickle_needs_allow_pickle():
+    state = pyhop2.State('state', v=Opaque())
+    with pytest.raises(Exception):
+        pyhop2.encode_state(state)
+    data = pyhop2.encode_state(state, allow_pickle=True)
+    with pytest.raises(Exception):
+        pyhop2.decode_state(data)
+    assert pyhop2.decode_state(data, allow_pickle=True).v == Opaque()
+
+
+def test_codec_rejects_bad_data():
+    data = pyhop2.encode_state(problems.blocks_state1())
+    with pytest.raises(Exception):
+        pyhop2.decode_state(b'junk' + data)
+    with pytest.raises(Exception):
+        pyhop2.decode_state(data + b'\x00')
@@ -0,0 +1,147 @@
+"""
+Tests of the tracers that record a search: TraceRecorder and PathProfiler.
+"""
+
+import io
+import json
+
+import pytest
+
+import pyhop2
+import problems
+
+
+def h_zero(state, todo_list):
+    return 0
+
+
+def read_jsonl(file):
+    return [json.loads(line) for line in file.getvalue().splitlines()]
+
+
+def check_tree(events):
+    "Check that each event's parent is an event that was written"
+    ids = {event['id'] for event in events}
+    assert len(ids) == len(events)
+    assert all(event['parent'] in ids for event in events
+               if event['cat'] != 'search')
+
+
+################################################################################
+# TraceRecorder
+
+
+def test_trace_recorder_jsonl():
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    file = io.StringIO()
+    recorder = pyhop2.TraceRecorder(file)
+    plan = pyhop2.find_plan(state, todo_list, tracer=recorder)
+    recorder.close()
+    events = read_jsonl(file)
+    assert len(events) == recorder.events
+    check_tree(events)
+    [search] = [event for event in events if event['cat'] == 'search']
+    assert search['name'] == 'find_plan' and search['parent'] == None
+    assert search['plan_length'] == len(plan)
+    # getv 1 fails twice before find_plan backtracks to putv 0
+    failures = [event['name'] for event in events
+                if event['cat'] == 'action' and not event['applicable']]
+    assert len(failures) == 2
+    # in a depth-first search, each event lies within its parent's
+    by_id = {event['id']: event for event in events}
+    for event in events:
+        if event['parent'] != None and 'dur' in event:
+            parent = by_id[event['parent']]
+            assert parent['ts'] <= event['ts'] + 0.001
+            assert event['ts'] + event['dur'] <= \
+                parent['ts'] + parent['dur'] + 0.002
+
+
+def test_trace_recorder_chrome(tmp_path):
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    path = str(tmp_path / 'trace.json')
+    recorder = pyhop2.TraceRecorder(path, format='chrome')
+    pyhop2.find_plan_a_star(state, todo_list, h_zero, tracer=recorder)
+    pyhop2.find_plan(state, todo_list, tracer=recorder)
+    recorder.close()
+    with open(path) as f:
+        events = json.load(f)
+    assert len(events) == recorder.events
+    assert [event['name'] for event in events if event['cat'] == 'search'] \
+        == ['find_plan_a_star', 'find_plan']
+    assert {event['ph'] for event in events} <= {'X', 'i'}
+    # A*'s closed set sees the nodes that two methods both produce
+    assert any(event['args'].get('duplicate') for event in events)
+    # only A*'s nodes have heuristic values
+    nodes = [event for event in events if event['cat'] == 'node']
+    assert 0 < sum('heuristic' in event['args'] for event in nodes) \
+        < len(nodes)
+
+
+def test_trace_recorder_instants():
+    (name, domain_name, state, todo_list) = problems.task_problems()[1]
+    pyhop2.set_current_domain(domain_name)
+    file = io.StringIO()
+    recorder = pyhop2.TraceRecorder(file)
+    plans = list(pyhop2.iter_plans(state, todo_list, tracer=recorder))
+    budget = pyhop2.Budget(max_expansions=3)
+    pyhop2.find_plan(state, todo_list, budget=budget, tracer=recorder)
+    recorder.close()
+    events = read_jsonl(file)
+    check_tree(events)
+    solutions = [event for event in events if event['cat'] == 'solution']
+    assert len(solutions) == len(plans) == 2
+    [exhausted] = [event for event in events if event['cat'] == 'budget']
+    assert exhausted['reason'] == 'expansions' and 'dur' not in exhausted
+
+
+def test_trace_recorder_unknown_format():
+    with pytest.raises(Exception, match="isn't 'jsonl' or 'chrome'"):
+        pyhop2.TraceRecorder(io.StringIO(), format='xml')
+
+
+################################################################################
+# PathProfiler
+
+
+@pytest.mark.parametrize('planner', ['find_plan', 'find_plan_a_star'])
+def test_path_profiler_counts_nodes(planner):
+    (name, domain_name, state, todo_list) = problems.task_problems()[6]
+    pyhop2.set_current_domain(domain_name)
+    profiler = pyhop2.PathProfiler()
+    stats = pyhop2.SearchStats()
+    args = (h_zero,) if planner == 'find_plan_a_star' else ()
+    getattr(pyhop2, planner)(state, todo_list, *args, tracer=profiler,
+                             stats=stats)
+    paths = profiler.stats()
+    assert sum(path['nodes'] for path in paths.values()) == stats.expanded
+    assert all(path['seconds'] >= 0 for path in paths.values())
+    # the time in a method goes to a path that ends with its name
+    assert paths['put_it > m_err']['nodes'] == 0
+    assert paths['put_it > m_err']['seconds'] > 0
+    assert paths['put_it > m_err > putv']['nodes'] == 1
+
+
+def test_path_profiler_folded():
+    (name, domain_name, state, todo_list) = problems.goal_problems()[-1]
+    pyhop2.set_current_domain(domain_name)
+    profiler = pyhop2.PathProfiler()
+    pyhop2.find_plan(state, todo_list, tracer=profiler)
+    paths = profiler.stats()
+    lines = profiler.folded(nodes=True).splitlines()
+    folded = {line.rsplit(' ', 1)[0]: int(line.rsplit(' ', 1)[1])
+              for line in lines}
+    # paths without nodes are left out
+    assert folded == {path.replace(' > ', ';'): val['nodes']
+                      for (path, val) in paths.items() if val['nodes']}
+    assert folded['multigoal;m_moveb;pos;m_move1;pos;m_put;putdown'] == 1
+    for line in profiler.folded().splitlines():
+        (path, microseconds) = line.rsplit(' ', 1)
+        assert ' ' not in path and int(microseconds) >= 0
+    # the statistics add up over searches until they're cleared
+    pyhop2.find_plan(state, todo_list, tracer=profiler)
+    assert profiler.stats()['multigoal']['nodes'] == 2
+    profiler.clear()
+    assert profiler.stats() == {} and profiler.folded() == ''